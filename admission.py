@@ -0,0 +1,279 @@
+"""
+admission.py
+
+Admission control and load shedding.
+
+Every request belongs to a cost class, and each class has a number of
+slots per worker process. A request runs only once it holds a slot of its
+class, and of its endpoint if that has a limit of its own. A request that
+can't get one before its deadline is answered 503 with a Retry-After
+header instead of waiting until the client gives up, and one whose
+deadline passed before it reached the app (it sat in the socket backlog)
+is rejected without waiting at all. An overloaded worker keeps answering
+what it admits at normal latency, and expensive dumps (GET /store) can
+only use their own slots, not the ones cheap lookups (GET /item/<id>) need.
+
+Classes (ADMISSION_CLASSES, name -> slots, None = unlimited):
+
+    - "priority": login, refresh, logout and GET /health. Never limited or
+      queued, so clients can still authenticate and health checks pass
+      while the rest of the API sheds load.
+    - "cheap": endpoints not listed in ADMISSION_ENDPOINTS.
+    - "expensive": whole-catalogue reads and bulk requests.
+    - "stream": Server-Sent Events, which hold their slot while connected.
+
+A request's deadline is its arrival plus the ADMISSION_QUEUE_TIMEOUT of
+its class. Arrival is when the app sees it or, with ADMISSION_REQUEST_START
+on, the X-Request-Start header set by the proxy in front of gunicorn
+("t=<seconds, ms or us since the epoch>"), which counts the backlog too.
+A request waiting for a slot holds a gunicorn thread, so a class can also
+have a queue length (ADMISSION_QUEUE_LENGTH): a request arriving when that
+many are waiting is rejected at once. Retry-After is the time the waiting requests of the class need at its
+recent mean service time.
+
+Slots are per process and a gunicorn sync worker runs one request at a
+time, so docker-entrypoint.sh runs threaded (gthread) workers. A POST
+/batch holds one slot of its own class for all its sub-requests.
+GET /stats/admission reports the counters of the worker that answers.
+
+Config (app.config):
+
+    ADMISSION_ENABLED          -> turn admission control on/off.
+    ADMISSION_CLASSES          -> {"priority": None, "cheap": 16, ...}
+    ADMISSION_ENDPOINTS        -> {"GET stores.StoreList": "expensive",
+                                   "Users.UserLogin": "priority", ...}
+    ADMISSION_DEFAULT_CLASS    -> class of the endpoints not listed.
+    ADMISSION_ENDPOINT_LIMITS  -> {"GET stores.StoreList": 1, ...}: slots of
+                                  an endpoint, within those of its class.
+    ADMISSION_QUEUE_TIMEOUT    -> {"cheap": 2.0, ...}: seconds from arrival a
+                                  request of the class may wait for its slots.
+    ADMISSION_QUEUE_LENGTH     -> {"expensive": 2, ...}: requests of the class
+                                  that may wait at once (unset = no limit).
+    ADMISSION_REQUEST_START    -> trust the X-Request-Start header.
+"""
+
+import math
+import threading
+import time
+
+from flask import g, jsonify, request
+
+
+class Gate:
+    """Slots of a class or endpoint, and its counters.
+
+    A counting semaphore whose acquire() gives up at a deadline, or at once
+    when 'queue' requests are already waiting. 'service' is a moving
+    average of how long a slot is held, for Retry-After.
+    """
+
+    def __init__(self, name, slots, queue=None):
+        self.name = name
+        self.slots = slots
+        self.queue = queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline):
+        """Take a slot, waiting until 'deadline' (time.monotonic()).
+
+        Returns True, or False if the deadline passed first.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if deadline <= now and self.slots is not None:
+                self.expired += 1
+                return False
+            if self.slots is not None and self.in_flight >= self.slots:
+                if self.queue is not None and self.waiting >= self.queue:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.slots:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            waited = time.monotonic() - now
+            self.in_flight += 1
+            self.admitted += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return True
+
+    def release(self, held=None):
+        """Give a slot back after holding it for 'held' seconds (None: it
+        was not used)."""
+        with self._cond:
+            self.in_flight -= 1
+            if held is not None:
+                self.service = held if not self.service else self.service + (held - self.service) / 10
+            self._cond.notify()
+
+    def retry_after(self):
+        """Seconds until the requests waiting now have likely been served."""
+        if not self.slots:
+            return 1
+        return max(1, math.ceil(self.service * (self.waiting + 1) / self.slots))
+
+    def report(self):
+        with self._cond:
+            return {
+                "name": self.name,
+                "slots": self.slots,
+                "queue": self.queue,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "mean_wait_ms": self.wait_total / self.admitted * 1000 if self.admitted else None,
+                "max_wait_ms": self.wait_max * 1000,
+                "mean_service_ms": self.service * 1000,
+            }
+
+
+def request_start(header):
+    """Wall-clock time of an X-Request-Start header, or None.
+
+    Proxies send seconds (nginx 't=${msec}'), milliseconds (Heroku) or
+    microseconds (Apache 't=%D') since the epoch, with or without 't='.
+    """
+    try:
+        value = float(header.removeprefix("t="))
+    except (AttributeError, ValueError):
+        return None
+    while value > 1e11:  # ms or us
+        value /= 1000
+    return value
+
+
+class AdmissionController:
+    """Flask extension admitting requests into per-class slots."""
+
+    def __init__(self, app=None):
+        self.classes = {}
+        self._endpoints = {}
+        self._gates = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ADMISSION_ENABLED", True)
+        app.config.setdefault("ADMISSION_CLASSES", {
+            "priority": None, "cheap": 16, "expensive": 2, "stream": None,
+        })
+        app.config.setdefault("ADMISSION_ENDPOINTS", {
+            "Users.UserLogin": "priority",
+            "Users.TokenRefresh": "priority",
+            "Users.UserLogout": "priority",
+            "Stats.Health": "priority",
+            "GET stores.StoreList": "expensive",
+            "Batch.Batch": "expensive",
+            "Catalogue.CatalogueImport": "expensive",
+            "stores.StoreEvents": "stream",
+        })
+        app.config.setdefault("ADMISSION_DEFAULT_CLASS", "cheap")
+        app.config.setdefault("ADMISSION_ENDPOINT_LIMITS", {})
+        app.config.setdefault("ADMISSION_QUEUE_TIMEOUT", {"cheap": 2.0, "expensive": 1.0})
+        app.config.setdefault("ADMISSION_QUEUE_LENGTH", {"expensive": 2})
+        app.config.setdefault("ADMISSION_REQUEST_START", False)
+
+        if not app.config["ADMISSION_ENABLED"]:
+            return
+
+        queues = app.config["ADMISSION_QUEUE_LENGTH"]
+        self.classes = {
+            name: Gate(name, slots, queues.get(name))
+            for name, slots in app.config["ADMISSION_CLASSES"].items()
+        }
+        self._configured = app.config["ADMISSION_ENDPOINTS"]
+        self._default = app.config["ADMISSION_DEFAULT_CLASS"]
+        self._limits = app.config["ADMISSION_ENDPOINT_LIMITS"]
+        self._timeouts = app.config["ADMISSION_QUEUE_TIMEOUT"]
+        self._request_start = app.config["ADMISSION_REQUEST_START"]
+        app.extensions["admission"] = self
+        app.before_request(self.admit)
+        app.teardown_request(self.release)
+
+    def gates_for(self, method, endpoint):
+        """Return (timeout, gates) for a method/endpoint, cached per pair.
+
+        The endpoint's own gate, if it has a limit, comes before its class's.
+        """
+        try:
+            return self._endpoints[method, endpoint]
+        except KeyError:
+            pass
+        if endpoint is None or endpoint.startswith("api-docs."):
+            name = "priority"  # 404s and the swagger-ui / openapi.json pages
+        else:
+            name = self._configured.get(
+                f"{method} {endpoint}", self._configured.get(endpoint, self._default)
+            )
+        gates = [self.classes[name]]
+        limit = self._limits.get(f"{method} {endpoint}", self._limits.get(endpoint))
+        if limit is not None:
+            key = f"{method} {endpoint}"
+            gates.insert(0, self._gates.setdefault(key, Gate(key, limit)))
+        entry = self._timeouts.get(name, 0.0), gates
+        self._endpoints[method, endpoint] = entry
+        return entry
+
+    def admit(self):
+        timeout, gates = self.gates_for(request.method, request.endpoint)
+        deadline = time.monotonic() + timeout
+        if self._request_start:
+            started = request_start(request.headers.get("X-Request-Start"))
+            if started is not None:
+                deadline -= max(0.0, time.time() - started)
+
+        held = []
+        for gate in gates:
+            if not gate.acquire(deadline):
+                for taken in held:
+                    taken.release()
+                return self.overloaded(gate)
+            held.append(gate)
+        g.admission = (held, time.monotonic())
+        return None
+
+    @staticmethod
+    def release(exc=None):
+        admission = g.pop("admission", None)
+        if admission is not None:
+            held, started = admission
+            seconds = time.monotonic() - started
+            for gate in held:
+                gate.release(seconds)
+
+    @staticmethod
+    def overloaded(gate):
+        response = jsonify(
+            {
+                "code": 503,
+                "status": "Service Unavailable",
+                "message": "The server is overloaded. Try again later.",
+            }
+        )
+        response.status_code = 503
+        response.headers["Retry-After"] = str(gate.retry_after())
+        return response
+
+    def report(self):
+        """Counters of every class and limited endpoint in this process."""
+        return {
+            "classes": [gate.report() for gate in self.classes.values()],
+            "endpoints": [gate.report() for gate in list(self._gates.values())],
+        }
@@ -9,17 +9,40 @@
 import os
 from flask_smorest import Api
 from flask_migrate import Migrate   # Flask-Migrate includes Alembic
-from flask_jwt_extended import JWTManager
 from flask import Flask, jsonify
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from admission import AdmissionController
+from archive import archive_command
 from db import db
 from blocklist import BLOCKLIST
+from compress import Compressor
+from importer import import_command
+from negotiation import NegotiatingJSONProvider
+from profiler import Profiler
+from jobs import worker_command
+from events import EventBroker
+from groupcommit import GroupCommitter
+from ratelimit import RateLimiter
+from sharding import ShardRouter, StoreMoving, shards_cli
+from singleflight import SingleFlight
+from snapshot import Catalogue
+from tracing import Tracer, traces_command
+from statements import StatementCache
+from tokens import CachingJWTManager, admin_claims, load_signing_keys
+from user_cache import init_user_cache, load_current_user
 
 from resources.user import blp as UserBlueprint
 from resources.item import blp as ItemBlueprint
 from resources.store import blp as StoreBlueprint
 from resources.tag import blp as TagBlueprint
+from resources.catalogue import blp as CatalogueBlueprint
+from resources.change import blp as ChangeBlueprint
+from resources.job import blp as JobBlueprint
+from resources.stats import blp as StatsBlueprint
+from resources.profile import blp as ProfileBlueprint
+from resources.batch import blp as BatchBlueprint
 
 
 def create_app(db_url=None):
@@ -44,16 +67,85 @@ def create_app(db_url=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = db_url or os.getenv("DATABASE_URL", "sqlite:///data.db")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # Compiled SQL kept per engine, and cached lambda statements (see
+    # statements.py); GET /stats/sql shows the hit rates. On Postgres with
+    # "postgresql+psycopg://" a query run SQL_PREPARE_THRESHOLD times on a
+    # connection becomes a server-side prepared statement ("off" = never).
+    app.config["SQL_COMPILED_CACHE_SIZE"] = int(os.getenv("SQL_COMPILED_CACHE_SIZE", 1000))
+    app.config["SQL_LAMBDA_CACHE_SIZE"] = int(os.getenv("SQL_LAMBDA_CACHE_SIZE", 1000))
+    prepare_threshold = os.getenv("SQL_PREPARE_THRESHOLD", "5")
+    app.config["SQL_PREPARE_THRESHOLD"] = int(prepare_threshold) if prepare_threshold.isdigit() else None
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "query_cache_size": app.config["SQL_COMPILED_CACHE_SIZE"],
+    }
+
+    # Extra databases (comma separated) to shard stores across. The default
+    # database is shard 0 and holds the shard map. Empty = no sharding.
+    app.config["SHARD_DATABASE_URLS"] = [
+        url for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url
+    ]
+    ShardRouter(app)  # before db.init_app: registers the shards as binds
+
+    @app.errorhandler(StoreMoving)
+    def store_moving(error):
+        # Raised by a commit (sharding._fence_writes): nothing was written.
+        db.session.rollback()
+        response = jsonify({"code": 503, "status": "Service Unavailable", "message": str(error)})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+
     # Initialize Flask SQLAlchemy extension (take flask app as argument & connect
     # it to SQLAlchemy)
     db.init_app(app)
+    StatementCache(app)
+
+    # Backfills in migrations (migrations/batching.py): rows per transaction
+    # and seconds to sleep between batches.
+    app.config["MIGRATION_BATCH_SIZE"] = int(os.getenv("MIGRATION_BATCH_SIZE", 1000))
+    app.config["MIGRATION_BATCH_PAUSE"] = float(os.getenv("MIGRATION_BATCH_PAUSE", 0))
     migrate = Migrate(app, db)  # migrate not in use, until it is!
     api = Api(app)
 
     # --------------------------- JWT CONFIGURATION ---------------------------- #
 
     app.config["JWT_SECRET_KEY"] = "90406336934580040544378782535470379379"
-    jwt = JWTManager(app)
+
+    # RS256/ES256 etc: PEM files are parsed once here, not on every request.
+    app.config["JWT_ALGORITHM"] = os.getenv("JWT_ALGORITHM", "HS256")
+    load_signing_keys(app,
+                      private_key_file=os.getenv("JWT_PRIVATE_KEY_FILE"),
+                      public_key_file=os.getenv("JWT_PUBLIC_KEY_FILE"))
+
+    # Verified claims are cached by token hash until 'exp' (0 = no cache).
+    app.config["JWT_VERIFIED_CACHE_SIZE"] = int(os.getenv("JWT_VERIFIED_CACHE_SIZE", 10000))
+    jwt = CachingJWTManager(app)
+
+    # Users (comma separated ids) whose tokens carry the 'is_admin' claim.
+    app.config["ADMIN_USER_IDS"] = {
+        user_id for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id
+    }
+
+    @jwt.additional_claims_loader
+    def add_claims_to_jwt(identity):
+        return admin_claims(app, identity)
+
+    # 'current_user' is a cached (id, username) tuple; see user_cache.py.
+    app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", 60))
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", 10000))
+    init_user_cache(app)
+
+    @jwt.user_lookup_loader
+    def user_lookup_callback(jwt_header, jwt_payload):
+        return load_current_user(jwt_payload["sub"])
+
+    @jwt.user_lookup_error_loader
+    def user_lookup_error_callback(jwt_header, jwt_payload):
+        return (
+            jsonify({"message": "The user no longer exists.",
+                     "error": "user_not_found"}),
+            401,
+        )
 
     @jwt.needs_fresh_token_loader
     def token_not_fresh_callback(jwt_header, jwt_payload):
@@ -147,6 +239,180 @@ def create_app(db_url=None):
 
     # --------------------------- END JWT CONFIGURATION ------------------------ #
 
+    # --------------------------- CHANGE FEED ---------------------------------- #
+
+    # Seconds the change feed holds back new changes so that concurrent
+    # transactions committing out of id order are not skipped (Postgres).
+    app.config["CHANGEFEED_SETTLE_SECONDS"] = float(os.getenv("CHANGEFEED_SETTLE_SECONDS", 0))
+
+    # "local" pushes store events (GET /store/<id>/events) straight from the
+    # commit; use "changelog" with more than one worker process.
+    app.config["EVENTS_BACKEND"] = os.getenv("EVENTS_BACKEND", "local")
+    EventBroker(app)
+
+    # --------------------------- CATALOGUE SNAPSHOT --------------------------- #
+
+    # Each worker keeps stores and tags in memory for existence checks and
+    # nested rendering. Other workers' changes show up within
+    # SNAPSHOT_CHECK_INTERVAL seconds (one version read per interval).
+    app.config["SNAPSHOT_ENABLED"] = os.getenv("SNAPSHOT_ENABLED", "True") == "True"
+    app.config["SNAPSHOT_CHECK_INTERVAL"] = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", 1.0))
+    Catalogue(app)
+
+    # --------------------------- ADMISSION CONTROL ---------------------------- #
+
+    # Requests take a slot of their cost class (per worker process) or get a
+    # 503 with Retry-After once ADMISSION_QUEUE_TIMEOUT has passed since they
+    # arrived. Login, refresh, logout and /health are never held back. Set
+    # ADMISSION_REQUEST_START=True behind a proxy sending X-Request-Start so
+    # the time spent in the socket backlog counts too.
+    app.config["ADMISSION_ENABLED"] = os.getenv("ADMISSION_ENABLED", "True") == "True"
+    app.config["ADMISSION_CLASSES"] = {
+        "priority": None,
+        "cheap": int(os.getenv("ADMISSION_CHEAP_SLOTS", 16)),
+        "expensive": int(os.getenv("ADMISSION_EXPENSIVE_SLOTS", 2)),
+        "stream": None,
+    }
+    app.config["ADMISSION_QUEUE_TIMEOUT"] = {
+        "cheap": float(os.getenv("ADMISSION_CHEAP_TIMEOUT", 2.0)),
+        "expensive": float(os.getenv("ADMISSION_EXPENSIVE_TIMEOUT", 1.0)),
+    }
+    app.config["ADMISSION_QUEUE_LENGTH"] = {
+        "expensive": int(os.getenv("ADMISSION_EXPENSIVE_QUEUE", 2)),
+    }
+    app.config["ADMISSION_REQUEST_START"] = os.getenv("ADMISSION_REQUEST_START", "False") == "True"
+    AdmissionController(app)
+
+    # --------------------------- RATE LIMITING -------------------------------- #
+
+    # Opt-in token bucket per client (JWT 'sub' or IP) and endpoint. Limits
+    # look like "100/minute". Use the "shared" backend when running several
+    # gunicorn workers so they all draw from the same buckets. Behind
+    # reverse proxies, set PROXY_FIX_X_FOR to how many there are so the IP
+    # is the client's, taken from X-Forwarded-For, not the proxy's.
+    app.config["PROXY_FIX_X_FOR"] = int(os.getenv("PROXY_FIX_X_FOR", 0))
+    if app.config["PROXY_FIX_X_FOR"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+    app.config["RATELIMIT_ENABLED"] = os.getenv("RATELIMIT_ENABLED", "False") == "True"
+    app.config["RATELIMIT_DEFAULT"] = os.getenv("RATELIMIT_DEFAULT", "50/second")
+    app.config["RATELIMIT_ENDPOINTS"] = {
+        "GET stores.StoreList": os.getenv("RATELIMIT_STORE_LIST", "5/second"),
+    }
+    app.config["RATELIMIT_BACKEND"] = os.getenv("RATELIMIT_BACKEND", "memory")
+    RateLimiter(app)
+
+    # --------------------------- WRITE BATCHING ------------------------------- #
+
+    # Batch concurrent PUT /item/<id> updates into one multi-row UPDATE and
+    # one commit per GROUP_COMMIT_WINDOW seconds (per process). Each PUT
+    # still returns only after its write has committed, or a 503 once it
+    # has waited GROUP_COMMIT_TIMEOUT seconds.
+    app.config["ITEM_GROUP_COMMIT"] = os.getenv("ITEM_GROUP_COMMIT", "False") == "True"
+    app.config["GROUP_COMMIT_WINDOW"] = float(os.getenv("GROUP_COMMIT_WINDOW", 0.005))
+    app.config["GROUP_COMMIT_MAX_ROWS"] = int(os.getenv("GROUP_COMMIT_MAX_ROWS", 500))
+    app.config["GROUP_COMMIT_TIMEOUT"] = float(os.getenv("GROUP_COMMIT_TIMEOUT", 10))
+    GroupCommitter(app)
+
+    # --------------------------- BACKGROUND JOBS ------------------------------ #
+
+    # Run jobs with 'flask worker'. Store deletes above JOBS_ASYNC_ITEMS items
+    # (or any long operation sent with 'Prefer: respond-async') answer 202
+    # and run there. JOBS_UPLOAD_DIR must be reachable by the workers.
+    app.config["JOBS_ASYNC_ITEMS"] = int(os.getenv("JOBS_ASYNC_ITEMS", 5000))
+    app.config["JOBS_UPLOAD_DIR"] = (os.getenv("JOBS_UPLOAD_DIR")
+                                     or os.path.join(app.instance_path, "uploads"))
+    app.config["JOBS_STALE_SECONDS"] = int(os.getenv("JOBS_STALE_SECONDS", 60))
+    app.config["JOBS_MAX_ATTEMPTS"] = int(os.getenv("JOBS_MAX_ATTEMPTS", 3))
+    app.config["JOBS_PROGRESS_INTERVAL"] = 1.0
+
+    # --------------------------- ARCHIVING ------------------------------------ #
+
+    # 'flask archive' moves deleted items, and items not updated for
+    # ARCHIVE_INACTIVE_DAYS (0 = never), out of the items table in
+    # batches of ARCHIVE_BATCH_SIZE. GETs return them with
+    # ?include_archived=true.
+    app.config["ARCHIVE_BATCH_SIZE"] = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+    app.config["ARCHIVE_INACTIVE_DAYS"] = int(os.getenv("ARCHIVE_INACTIVE_DAYS", 0)) or None
+    app.config["ARCHIVE_BATCH_PAUSE"] = float(os.getenv("ARCHIVE_BATCH_PAUSE", 0))
+
+    # --------------------------- NESTED COLLECTIONS --------------------------- #
+
+    # Items and tags nested in store and tag responses are capped at this
+    # many rows (with counts and "next" links) unless ?expand= asks for all.
+    app.config["NESTED_LIMIT"] = int(os.getenv("NESTED_LIMIT", 50))
+
+    # --------------------------- BATCH REQUESTS ------------------------------- #
+
+    # POST /batch runs up to this many item/store/tag requests in one call.
+    app.config["BATCH_MAX_REQUESTS"] = int(os.getenv("BATCH_MAX_REQUESTS", 50))
+
+    # --------------------------- REQUEST COALESCING --------------------------- #
+
+    # Identical concurrent GETs of stores, items and tags share one response.
+    # "shared" also coalesces across the gunicorn workers on this host.
+    app.config["SINGLEFLIGHT_ENABLED"] = os.getenv("SINGLEFLIGHT_ENABLED", "True") == "True"
+    app.config["SINGLEFLIGHT_BACKEND"] = os.getenv("SINGLEFLIGHT_BACKEND", "local")
+    SingleFlight(app)
+
+    # --------------------------- RESPONSE COMPRESSION ------------------------- #
+
+    # gzip/br/zstd by Accept-Encoding for JSON bodies >= COMPRESS_MIN_SIZE.
+    # Compressed bodies are cached by content, so repeated responses are
+    # compressed once. Brotli 6 halves the store list compared to level 4
+    # for ~0.6 ms more per 190 KB (python -m benchmarks.bench_compression).
+    app.config["COMPRESS_ENABLED"] = os.getenv("COMPRESS_ENABLED", "True") == "True"
+    app.config["COMPRESS_MIN_SIZE"] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+    app.config["COMPRESS_LEVELS"] = {"gzip": 6, "br": 4, "zstd": 3}
+    app.config["COMPRESS_ENDPOINT_LEVELS"] = {
+        "GET stores.StoreList": {"br": 6},
+    }
+    Compressor(app)
+
+    # --------------------------- CONTENT NEGOTIATION -------------------------- #
+
+    # Responses (and request bodies) in MessagePack or columnar form for
+    # clients that ask with Accept / Content-Type; JSON otherwise. See
+    # negotiation.py and python -m benchmarks.bench_formats.
+    app.config["CONTENT_FORMATS"] = os.getenv("CONTENT_FORMATS", "json,msgpack,columnar").split(",")
+    app.json = NegotiatingJSONProvider(app)
+
+    # --------------------------- REQUEST VALIDATION --------------------------- #
+
+    # Opt-in: validate the bodies of these schemas with loaders compiled from
+    # them (validation.py), with the same 422 errors as marshmallow, and
+    # answer 413 to bodies over VALIDATION_MAX_BODY bytes before parsing.
+    # Compare with python -m benchmarks.bench_validation.
+    app.config["VALIDATION_COMPILED"] = os.getenv("VALIDATION_COMPILED", "False") == "True"
+    app.config["VALIDATION_COMPILED_SCHEMAS"] = [
+        "ItemSchema", "ItemUpdateSchema", "StoreSchema", "TagSchema", "UserSchema",
+    ]
+    app.config["VALIDATION_MAX_BODY"] = int(os.getenv("VALIDATION_MAX_BODY", 16384))
+
+    # --------------------------- PROFILING ------------------------------------ #
+
+    # Profile requests sent with 'X-Profile: 1' by an admin, and one in
+    # PROFILER_SAMPLE_RATE requests (0 = none). GET /profiles lists the last
+    # PROFILER_RING_SIZE. Off: no per-request cost at all.
+    app.config["PROFILER_ENABLED"] = os.getenv("PROFILER_ENABLED", "False") == "True"
+    app.config["PROFILER_SAMPLE_RATE"] = int(os.getenv("PROFILER_SAMPLE_RATE", 0))
+    app.config["PROFILER_MODE"] = os.getenv("PROFILER_MODE", "sample")
+    app.config["PROFILER_RING_SIZE"] = int(os.getenv("PROFILER_RING_SIZE", 100))
+    Profiler(app)
+
+    # --------------------------- TRACING -------------------------------------- #
+
+    # Per-request span traces (JWT, arguments, SQL, handler, serialization,
+    # JSON). Tail sampling keeps every trace slower than TRACING_SLOW_MS or
+    # failing, plus TRACING_SAMPLE_RATE of the rest. Kept traces go to
+    # TRACING_EXPORT_PATH and/or an OTLP/HTTP collector; see 'flask traces'.
+    app.config["TRACING_ENABLED"] = os.getenv("TRACING_ENABLED", "False") == "True"
+    app.config["TRACING_SLOW_MS"] = float(os.getenv("TRACING_SLOW_MS", 500))
+    app.config["TRACING_SAMPLE_RATE"] = float(os.getenv("TRACING_SAMPLE_RATE", 0.01))
+    app.config["TRACING_EXPORT_PATH"] = (os.getenv("TRACING_EXPORT_PATH")
+                                         or os.path.join(app.instance_path, "traces.jsonl"))
+    app.config["TRACING_OTLP_ENDPOINT"] = os.getenv("TRACING_OTLP_ENDPOINT") or None
+    Tracer(app)
+
     # Don't need the following if using Flask-Migrate for database migrations.
     # with app.app_context():
     #     db.create_all()
@@ -155,5 +421,21 @@ def create_app(db_url=None):
     api.register_blueprint(ItemBlueprint)
     api.register_blueprint(StoreBlueprint)
     api.register_blueprint(TagBlueprint)
+    api.register_blueprint(CatalogueBlueprint)
+    api.register_blueprint(ChangeBlueprint)
+    api.register_blueprint(JobBlueprint)
+    api.register_blueprint(StatsBlueprint)
+    api.register_blueprint(ProfileBlueprint)
+    api.register_blueprint(BatchBlueprint)
+
+    # flask import <file.csv|file.ndjson>
+    app.cli.add_command(import_command)
+    # flask shards init|status|move|rebalance
+    app.cli.add_command(shards_cli)
+    # flask worker [--processes N]
+    app.cli.add_command(worker_command)
+    # flask archive [--inactive-days N]
+    app.cli.add_command(archive_command)
+    app.cli.add_command(traces_command)
 
     return app
@@ -0,0 +1,148 @@
+"""
+archive.py
+
+Hot/cold partitioning of items: 'flask archive'.
+
+'items' and 'items_tags' only ever grew: deleted items went away, but a
+catalogue that keeps its history also keeps every item it stopped selling,
+and every list, page and index lookup pays for them. Now:
+
+    - DELETE /item/<id> soft-deletes: it sets 'deleted_at' (writepath.py)
+      and every read skips such rows (readpath.LIVE).
+    - 'flask archive' moves soft-deleted items, and with
+      ARCHIVE_INACTIVE_DAYS items not updated for that many days, to
+      'items_archive' with their links to 'items_tags_archive', so 'items'
+      and 'items_tags' hold only what the API serves.
+    - '?include_archived=true' on GET /item and GET /item/<id> also returns
+      them, with 'deleted_at' / 'archived_at' (readpath.archived_item_rows).
+
+Each batch of ARCHIVE_BATCH_SIZE items is one transaction: copy the items
+and their links, delete them from the hot tables, log a "delete" change for
+the archived items that were still live (clients stop seeing them, like a
+delete), commit. The batch is selected FOR UPDATE SKIP LOCKED on Postgres,
+so rows being written are left for the next run, and the newest item is
+never archived, so SQLite (which hands out max(id) + 1) doesn't reuse an
+archived id. An item created again with an archived id (PUT) replaces its
+archived copy when it is archived in turn. With sharding every shard is
+archived in turn. The command can be stopped and run again at any time.
+
+Config (app.config):
+
+    ARCHIVE_BATCH_SIZE     -> items moved per transaction.
+    ARCHIVE_INACTIVE_DAYS  -> also archive items not updated for this many
+                              days (0 or None = only deleted items).
+    ARCHIVE_BATCH_PAUSE    -> seconds to sleep between batches.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DateTime, delete, func, insert, literal, or_, select
+
+from changefeed import change, record
+from db import db
+from models import ItemArchiveModel, ItemModel, ItemTags, ItemTagsArchive
+from sharding import use_shard
+
+
+items = ItemModel.__table__
+links = ItemTags.__table__
+archive = ItemArchiveModel.__table__
+archive_links = ItemTagsArchive.__table__
+
+# Columns copied from 'items' to 'items_archive'.
+COLUMNS = ("id", "name", "price_cents", "description", "store_id", "updated_at", "deleted_at")
+
+
+def archive_batch(cutoff=None, batch_size=1000):
+    """Move one batch of deleted items, and with 'cutoff' of items not
+    updated since then, to the archive tables and commit.
+
+    Returns the number of items moved; 0 when there are none left.
+    """
+    session = db.session
+    stale = items.c.deleted_at.is_not(None)
+    if cutoff is not None:
+        stale = or_(stale, items.c.updated_at < cutoff)
+    newest = select(func.max(items.c.id)).scalar_subquery()
+    item_ids = session.scalars(
+        select(items.c.id).where(stale, items.c.id < newest)
+        .order_by(items.c.id).limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not item_ids:
+        session.rollback()
+        return 0
+
+    live = session.execute(
+        select(items.c.id, items.c.store_id)
+        .where(items.c.id.in_(item_ids), items.c.deleted_at.is_(None))
+    ).all()
+    # Replace the archived copies of ids that were created again.
+    session.execute(delete(archive_links).where(archive_links.c.item_id.in_(item_ids)))
+    session.execute(delete(archive).where(archive.c.id.in_(item_ids)))
+    session.execute(insert(archive).from_select(
+        [*COLUMNS, "archived_at"],
+        select(*(items.c[column] for column in COLUMNS), literal(datetime.utcnow(), DateTime))
+        .where(items.c.id.in_(item_ids)),
+    ))
+    session.execute(insert(archive_links).from_select(
+        ["item_id", "tag_id"],
+        select(links.c.item_id, links.c.tag_id).where(links.c.item_id.in_(item_ids)),
+    ))
+    session.execute(delete(links).where(links.c.item_id.in_(item_ids)))
+    session.execute(delete(items).where(items.c.id.in_(item_ids)))
+    record(session, [change("item", item_id, "delete", store_id) for item_id, store_id in live])
+    session.commit()
+    return len(item_ids)
+
+
+def archive_items(inactive_days=None, batch_size=None, pause=None, progress=None):
+    """Archive batches until no deleted (or inactive) item is left, on
+    every shard. Returns the number of items moved.
+
+    Defaults come from ARCHIVE_INACTIVE_DAYS / ARCHIVE_BATCH_SIZE /
+    ARCHIVE_BATCH_PAUSE.
+
+    :param progress: Called with (shard, items moved so far) per batch.
+    """
+    config = current_app.config
+    if inactive_days is None:
+        inactive_days = config["ARCHIVE_INACTIVE_DAYS"]
+    batch_size = batch_size or config["ARCHIVE_BATCH_SIZE"]
+    pause = config["ARCHIVE_BATCH_PAUSE"] if pause is None else pause
+    cutoff = datetime.utcnow() - timedelta(days=inactive_days) if inactive_days else None
+
+    router = current_app.extensions["sharding"]
+    moved = 0
+    for shard in router.shards() if router.enabled else (0,):
+        use_shard(shard)
+        while True:
+            count = archive_batch(cutoff, batch_size)
+            if not count:
+                break
+            moved += count
+            if progress:
+                progress(shard, moved)
+            if pause:
+                time.sleep(pause)
+    return moved
+
+
+@click.command("archive")
+@click.option("--inactive-days", type=int, default=None,
+              help="Also archive items not updated for this many days "
+                   "(default ARCHIVE_INACTIVE_DAYS).")
+@click.option("--batch-size", type=int, default=None,
+              help="Items per transaction (default ARCHIVE_BATCH_SIZE).")
+@with_appcontext
+def archive_command(inactive_days, batch_size):
+    """Move deleted and inactive items to the archive tables."""
+    def progress(shard, moved):
+        click.echo(f"  shard {shard}: {moved} items archived", err=True)
+
+    moved = archive_items(inactive_days, batch_size, progress=progress)
+    click.echo(f"Archived {moved} items.")
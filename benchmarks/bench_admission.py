@@ -0,0 +1,96 @@
+"""
+Admission control under overload.
+
+A pool of threads stands in for a gthread worker and serves a mix of cheap
+lookups and expensive dumps arriving faster than it can serve them, with
+and without admission control. Requests are queued in arrival order like
+in the socket backlog, and carry X-Request-Start so the time spent there
+counts against their deadline. Reports the latency of the cheap requests
+that were answered and how many of each kind were rejected with 503.
+
+Run from the project root:
+
+    python -m benchmarks.bench_admission
+"""
+
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from admission import AdmissionController
+
+
+THREADS = 8
+SECONDS = 5
+CHEAP = (500, 0.005)      # per second, seconds each (GET /item/<id>)
+EXPENSIVE = (60, 0.100)   # per second, seconds each (GET /store): 8.5 threads busy
+
+
+def make_app(enabled):
+    app = Flask(__name__)
+    app.config.update(
+        ADMISSION_ENABLED=enabled,
+        ADMISSION_ENDPOINTS={"expensive": "expensive"},
+        ADMISSION_REQUEST_START=True,
+    )
+    AdmissionController(app)
+
+    @app.get("/cheap")
+    def cheap():
+        time.sleep(CHEAP[1])
+        return "ok"
+
+    @app.get("/expensive")
+    def expensive():
+        time.sleep(EXPENSIVE[1])
+        return "ok"
+
+    return app
+
+
+def schedule():
+    """(offset, path) of every request, in arrival order."""
+    arrivals = [(i / CHEAP[0], "/cheap") for i in range(CHEAP[0] * SECONDS)]
+    arrivals += [(i / EXPENSIVE[0], "/expensive") for i in range(EXPENSIVE[0] * SECONDS)]
+    return sorted(arrivals)
+
+
+def run(enabled):
+    app = make_app(enabled)
+    client = app.test_client()
+    results = {"/cheap": [], "/expensive": []}
+    rejected = {"/cheap": 0, "/expensive": 0}
+
+    def call(path, arrived):
+        status = client.get(path, headers={"X-Request-Start": f"t={arrived:.6f}"}).status_code
+        if status == 503:
+            rejected[path] += 1
+        else:
+            results[path].append(time.time() - arrived)
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        start = time.time()
+        for offset, path in schedule():
+            delay = start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(call, path, start + offset)
+    return results, rejected
+
+
+def percentile(values, p):
+    """p-th percentile of 'values' in milliseconds."""
+    return statistics.quantiles(values, n=100)[p - 1] * 1000
+
+
+if __name__ == "__main__":
+    print(f"{'admission':>9}  {'cheap ok':>8}  {'p50 ms':>8}  {'p99 ms':>8}  "
+          f"{'cheap 503':>9}  {'exp ok':>6}  {'exp 503':>7}")
+    for enabled in (False, True):
+        results, rejected = run(enabled)
+        cheap = results["/cheap"]
+        print(f"{'on' if enabled else 'off':>9}  {len(cheap):>8}  {percentile(cheap, 50):>8.1f}  "
+              f"{percentile(cheap, 99):>8.1f}  {rejected['/cheap']:>9}  "
+              f"{len(results['/expensive']):>6}  {rejected['/expensive']:>7}")
@@ -0,0 +1,92 @@
+"""
+Per-request JWT auth overhead benchmark.
+
+Times verify_jwt_in_request(fresh=True) - what @jwt_required(fresh=True)
+runs before Item.put / Item.delete / Store.delete - inside a request
+context, with the verified-token cache off ("before") and on ("after").
+RS256 is also timed with the key passed as a PEM string, which PyJWT
+re-parses on every call, to show the cost of not loading keys up front.
+
+Run from the project root:
+
+    python -m benchmarks.bench_auth
+"""
+
+import os
+import tempfile
+import timeit
+
+from flask_jwt_extended import create_access_token, verify_jwt_in_request
+
+from app import create_app
+
+NUMBER = 5000
+
+
+def bench(app):
+    with app.app_context():
+        token = create_access_token(identity="1", fresh=True)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def verify():
+        with app.test_request_context("/item/1", method="PUT", headers=headers):
+            verify_jwt_in_request(fresh=True)
+
+    def context_only():
+        with app.test_request_context("/item/1", method="PUT", headers=headers):
+            pass
+
+    verify()
+    per_call = min(timeit.repeat(verify, number=NUMBER, repeat=3)) / NUMBER
+    baseline = min(timeit.repeat(context_only, number=NUMBER, repeat=3)) / NUMBER
+    return (per_call - baseline) * 1e6
+
+
+def make_app(algorithm="HS256", cache=True, key_files=None, pem=False):
+    os.environ["JWT_ALGORITHM"] = algorithm
+    os.environ["JWT_VERIFIED_CACHE_SIZE"] = "10000" if cache else "0"
+    if key_files:
+        os.environ["JWT_PRIVATE_KEY_FILE"], os.environ["JWT_PUBLIC_KEY_FILE"] = key_files
+    else:
+        os.environ.pop("JWT_PRIVATE_KEY_FILE", None)
+        os.environ.pop("JWT_PUBLIC_KEY_FILE", None)
+    app = create_app("sqlite://")
+    if pem:
+        with open(key_files[0]) as f:
+            app.config["JWT_PRIVATE_KEY"] = f.read()
+        with open(key_files[1]) as f:
+            app.config["JWT_PUBLIC_KEY"] = f.read()
+    return app
+
+
+def write_rsa_keys(directory):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_path = os.path.join(directory, "jwt.pem")
+    public_path = os.path.join(directory, "jwt.pub")
+    with open(private_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM,
+                                  serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    with open(public_path, "wb") as f:
+        f.write(key.public_key().public_bytes(serialization.Encoding.PEM,
+                                              serialization.PublicFormat.SubjectPublicKeyInfo))
+    return private_path, public_path
+
+
+if __name__ == "__main__":
+    print(f"HS256            no cache: {bench(make_app(cache=False)):7.1f} us/request")
+    print(f"HS256            cached:   {bench(make_app()):7.1f} us/request")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            keys = write_rsa_keys(tmp)
+            print(f"RS256 PEM string no cache: "
+                  f"{bench(make_app('RS256', False, keys, pem=True)):7.1f} us/request")
+            print(f"RS256 key object no cache: "
+                  f"{bench(make_app('RS256', False, keys)):7.1f} us/request")
+            print(f"RS256 key object cached:   "
+                  f"{bench(make_app('RS256', True, keys)):7.1f} us/request")
+    except ImportError:
+        print("RS256: skipped ('cryptography' is not installed)")
@@ -0,0 +1,101 @@
+"""
+Response compression benchmark: CPU cost against bytes saved.
+
+Builds GET /store (StoreSchema(many=True)) and GET /item bodies from a
+catalogue of synthetic stores, then for every available encoding and level
+times the compression and reports the compressed size, the bytes saved and
+the CPU time spent per KB saved. The last lines time whole GET requests
+without compression, with a cold compressed cache and with a warm one.
+
+Run from the project root:
+
+    python -m benchmarks.bench_compression [stores] [items per store]
+"""
+
+import os
+import sys
+import timeit
+
+from app import create_app
+from compress import CODECS
+from db import db
+from models import ItemModel, StoreModel, TagModel
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 6, 9, 11), "zstd": (1, 3, 9, 19)}
+
+
+def make_app(stores, items, compress=True):
+    os.environ["RATELIMIT_ENABLED"] = "False"
+    os.environ["SINGLEFLIGHT_ENABLED"] = "False"
+    app = create_app("sqlite://")
+    if not compress:
+        app.after_request_funcs[None] = [
+            f for f in app.after_request_funcs[None]
+            if getattr(f, "__self__", None) is not app.extensions["compress"]
+        ]
+    with app.app_context():
+        db.create_all()
+        for s in range(stores):
+            store = StoreModel(name=f"Store {s}")
+            tags = [TagModel(name=f"tag-{t}", store=store) for t in range(5)]
+            for i in range(items):
+                db.session.add(ItemModel(
+                    name=f"Item {s}-{i}", price=(i * 37 % 10000) / 100,
+                    description=f"Description of item {i} in store {s}",
+                    store=store, tags=tags[: i % 5],
+                ))
+        db.session.commit()
+    return app
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def bench_codecs(name, body):
+    print(f"\n{name}: {len(body) / 1024:.1f} KB uncompressed")
+    print(f"{'encoding':>8} {'level':>5} {'KB':>8} {'ratio':>6} {'ms':>8} {'MB/s':>7} {'us/KB saved':>12}")
+    for encoding, codec in CODECS.items():
+        for level in LEVELS[encoding]:
+            compressed = codec(body, level)
+            seconds = per_call(lambda: codec(body, level), 3 if level > 9 else 20)
+            saved_kb = (len(body) - len(compressed)) / 1024
+            print(f"{encoding:>8} {level:>5} {len(compressed) / 1024:8.1f} "
+                  f"{len(body) / len(compressed):6.1f} {seconds * 1e3:8.2f} "
+                  f"{len(body) / seconds / 1e6:7.0f} {seconds * 1e6 / saved_kb:12.2f}")
+
+
+def bench_requests(stores, items):
+    plain = make_app(stores, items, compress=False).test_client()
+    app = make_app(stores, items)
+    client = app.test_client()
+    cache = app.extensions["compress"].cache
+    for encoding in CODECS:
+        headers = {"Accept-Encoding": encoding}
+        assert client.get("/store", headers=headers).headers["Content-Encoding"] == encoding
+
+        def cold():
+            cache._entries.clear()
+            cache.size = 0
+            client.get("/store", headers=headers)
+
+        results = (
+            per_call(lambda: plain.get("/store", headers=headers), 5),
+            per_call(cold, 5),
+            per_call(lambda: client.get("/store", headers=headers), 5),
+        )
+        print(f"GET /store {encoding:>4}: " + ", ".join(
+            f"{label} {seconds * 1e3:.1f} ms"
+            for label, seconds in zip(("uncompressed", "cold cache", "warm cache"), results)
+        ))
+
+
+if __name__ == "__main__":
+    stores = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    app = make_app(stores, items, compress=False)
+    client = app.test_client()
+    bench_codecs("GET /store", client.get("/store").get_data())
+    bench_codecs("GET /item", client.get("/item").get_data())
+    print()
+    bench_requests(stores, items)
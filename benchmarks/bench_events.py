@@ -0,0 +1,68 @@
+"""
+SSE subscriber capacity benchmark.
+
+Opens N subscriptions to one store on a single EventBroker, each drained by
+its own thread like a streaming gthread worker would, publishes a burst of
+change events and reports fan-out latency and memory per subscriber.
+
+Run from the project root:
+
+    python -m benchmarks.bench_events [N ...]
+"""
+
+import resource
+import sys
+import threading
+import time
+
+from app import create_app
+from events import EventBroker
+
+EVENTS = 50
+
+
+def change(change_id):
+    return {"id": change_id, "entity": "item", "op": "update", "store_id": 1,
+            "entity_id": 1, "data": {"id": 1, "name": "Chair", "price": 19.5}}
+
+
+def bench(app, subscribers):
+    broker = EventBroker(app)
+    received = [0] * subscribers
+    done = threading.Barrier(subscribers + 1)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def consume(index, subscription):
+        while received[index] < EVENTS:
+            if subscription.get(5) is not None:
+                received[index] += 1
+        done.wait()
+
+    threads = []
+    for index in range(subscribers):
+        thread = threading.Thread(target=consume, args=(index, broker.subscribe(1)),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    for change_id in range(1, EVENTS + 1):
+        broker.publish(change(change_id))
+    publish = time.perf_counter() - start
+    done.wait()
+    total = time.perf_counter() - start
+
+    deliveries = subscribers * EVENTS
+    print(f"{subscribers:>6} subscribers: publish {publish / EVENTS * 1e3:7.2f} ms/event, "
+          f"all delivered in {total * 1e3:8.1f} ms "
+          f"({deliveries / total:,.0f} deliveries/s), "
+          f"~{(rss_after - rss_before) / subscribers:.0f} KiB/subscriber")
+
+
+if __name__ == "__main__":
+    counts = [int(n) for n in sys.argv[1:]] or [100, 1000, 2000]
+    app = create_app("sqlite://")
+    with app.app_context():
+        for count in counts:
+            bench(app, count)
@@ -0,0 +1,101 @@
+"""
+Response format benchmark: JSON against MessagePack and columnar forms.
+
+Dumps GET /item (ItemSchema(many=True)) and GET /store (StoreSchema(many=True))
+payloads from a catalogue of synthetic stores, then for every format
+negotiation.py offers reports the encoded size (raw and gzipped), the
+server's encode time and a client's decode time (back to a list of dicts).
+The last lines time whole GET /item requests per Accept header.
+
+Run from the project root:
+
+    python -m benchmarks.bench_formats [stores] [items per store]
+"""
+
+import gzip
+import json
+import os
+import sys
+import timeit
+
+import msgpack
+
+from app import create_app
+from db import db
+from models import ItemModel, StoreModel, TagModel
+from negotiation import (
+    COLUMNAR_JSON,
+    COLUMNAR_MSGPACK,
+    JSON,
+    MSGPACK,
+    from_columnar,
+)
+from schemas import ItemSchema, StoreSchema
+
+DECODERS = {
+    JSON: json.loads,
+    MSGPACK: msgpack.unpackb,
+    COLUMNAR_JSON: lambda body: from_columnar(json.loads(body)),
+    COLUMNAR_MSGPACK: lambda body: from_columnar(msgpack.unpackb(body)),
+}
+
+
+def make_app(stores, items):
+    os.environ["RATELIMIT_ENABLED"] = "False"
+    os.environ["SINGLEFLIGHT_ENABLED"] = "False"
+    os.environ["COMPRESS_ENABLED"] = "False"
+    app = create_app("sqlite://")
+    with app.app_context():
+        db.create_all()
+        for s in range(stores):
+            store = StoreModel(name=f"Store {s}")
+            tags = [TagModel(name=f"tag-{t}", store=store) for t in range(5)]
+            for i in range(items):
+                db.session.add(ItemModel(
+                    name=f"Item {s}-{i}", price=(i * 37 % 10000) / 100,
+                    description=f"Description of item {i} in store {s}",
+                    store=store, tags=tags[: i % 5],
+                ))
+        db.session.commit()
+    return app
+
+
+def per_call(fn, number=5):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def encode(app, media_type, data):
+    if media_type == JSON:
+        return app.json.dumps(data).encode()
+    return app.json.encode(media_type, data).get_data()
+
+
+def bench_payload(app, name, data):
+    print(f"\n{name}")
+    print(f"{'format':>32} {'KB':>8} {'gzip KB':>8} {'encode ms':>10} {'decode ms':>10}")
+    for media_type, decode in DECODERS.items():
+        body = encode(app, media_type, data)
+        assert decode(body) == json.loads(encode(app, JSON, data))
+        print(f"{media_type:>32} {len(body) / 1024:8.1f} {len(gzip.compress(body)) / 1024:8.1f} "
+              f"{per_call(lambda: encode(app, media_type, data)) * 1e3:10.2f} "
+              f"{per_call(lambda: decode(body)) * 1e3:10.2f}")
+
+
+def bench_requests(app):
+    client = app.test_client()
+    print()
+    for media_type, decode in DECODERS.items():
+        headers = {"Accept": media_type}
+        assert client.get("/item", headers=headers).mimetype == media_type
+        seconds = per_call(lambda: decode(client.get("/item", headers=headers).get_data()))
+        print(f"GET /item {media_type:>32}: {seconds * 1e3:.1f} ms (request + decode)")
+
+
+if __name__ == "__main__":
+    stores = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    app = make_app(stores, items)
+    with app.app_context():
+        bench_payload(app, "GET /item", ItemSchema(many=True).dump(ItemModel.query.all()))
+        bench_payload(app, "GET /store", StoreSchema(many=True).dump(StoreModel.query.all()))
+    bench_requests(app)
@@ -0,0 +1,93 @@
+"""
+Item update throughput benchmark: one commit per PUT against group commit.
+
+Runs PUT /item/<id> price updates from N client threads against a file
+SQLite database (so every commit really syncs), first with
+ITEM_GROUP_COMMIT off and then on, and reports requests per second, the
+number of commits and the latency percentiles. Each thread writes to a few
+"hot" items, so group commit also merges writes to the same item.
+
+Run from the project root:
+
+    python -m benchmarks.bench_group_commit [threads] [requests per thread]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import create_app
+from db import db
+from models import ItemModel, StoreModel, UserModel
+
+ITEMS = 50
+
+
+def make_app(path, group_commit):
+    os.environ["RATELIMIT_ENABLED"] = "False"
+    os.environ["ITEM_GROUP_COMMIT"] = str(group_commit)
+    app = create_app(f"sqlite:///{path}")
+    with app.app_context():
+        db.create_all()
+        if not db.session.get(UserModel, 1):
+            db.session.add(UserModel(id=1, username="bench", password="x"))
+            store = StoreModel(name="Store")
+            db.session.add_all(ItemModel(id=i, name=f"Item {i}", price=1, store=store)
+                               for i in range(1, ITEMS + 1))
+            db.session.commit()
+        token = create_access_token(identity="1", fresh=True)
+    return app, {"Authorization": f"Bearer {token}"}
+
+
+def bench(path, group_commit, threads, number):
+    app, headers = make_app(path, group_commit)
+    commits = 0
+
+    with app.app_context():
+        @event.listens_for(db.engine, "commit")
+        def count(conn):
+            nonlocal commits
+            commits += 1
+
+    latencies = []
+
+    def client(n):
+        client = app.test_client()
+        for i in range(number):
+            item_id = (n * 7 + i) % ITEMS + 1
+            started = time.perf_counter()
+            response = client.put(f"/item/{item_id}", headers=headers, json={
+                "name": f"Item {item_id}", "price": (i % 500) / 100 + 1,
+                "description": "Price feed",
+            })
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.get_data()
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    label = "group commit" if group_commit else "per request"
+    print(f"{label:>12}: {len(latencies) / elapsed:7.0f} req/s, {commits:5d} commits, "
+          f"p50 {quantiles[49] * 1e3:6.2f} ms, p99 {quantiles[98] * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        print(f"{threads} threads x {number} PUT /item/<id> on {ITEMS} items")
+        bench(path, False, threads, number)
+        bench(path, True, threads, number)
@@ -0,0 +1,40 @@
+"""
+Rate limiter overhead benchmark.
+
+Measures the cost of one token-bucket check for each backend (the part the
+limiter adds to every request, excluding identity lookup).
+
+Run from the project root:
+
+    python -m benchmarks.bench_ratelimit
+"""
+
+import os
+import tempfile
+import timeit
+
+from ratelimit import MemoryBackend, SharedBackend, parse_limit
+
+
+def bench(backend, number=200_000):
+    capacity, rate = parse_limit("1000000/second")
+    keys = [f"ip:10.0.0.{i}|GET stores.Store" for i in range(256)]
+    i = 0
+
+    def check():
+        nonlocal i
+        backend.take(keys[i & 255], capacity, rate)
+        i += 1
+
+    seconds = min(timeit.repeat(check, number=number, repeat=3))
+    return seconds / number * 1e6
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": MemoryBackend(),
+            "shared": SharedBackend(os.path.join(tmp, "ratelimit.bin")),
+        }
+        for name, backend in backends.items():
+            print(f"{name:>8}: {bench(backend):.2f} us/check")
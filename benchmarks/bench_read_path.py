@@ -0,0 +1,119 @@
+"""
+Read path benchmark: ORM instances against row records for GET /item.
+
+Fills a file SQLite database with N items (spread over 100 stores, 0-2
+tags each), then builds the GET /item response both ways:
+
+    orm   db.session.scalars(select(ItemModel)) dumped with ItemSchema,
+          loading 'store' and 'tags' per item (the handler before readpath.py)
+    rows  readpath.item_rows(), dumped with the same schema
+
+and reports the time to load and to dump, and the memory held per item
+once loaded and once dumped (tracemalloc, measured in a separate pass).
+
+Run from the project root:
+
+    python -m benchmarks.bench_read_path [items]
+
+The 'orm' pass issues one tags query per item; pass 'rows' as a second
+argument to skip it on very large datasets.
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import insert, select
+
+from app import create_app
+from db import db
+from models import ItemModel, ItemTags, StoreModel, TagModel
+from readpath import item_rows
+from schemas import ItemSchema
+from statements import items_in_price_range
+
+STORES = 100
+CHUNK = 10_000
+
+
+def make_app(path, items):
+    os.environ["RATELIMIT_ENABLED"] = "False"
+    app = create_app(f"sqlite:///{path}")
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.execute(insert(StoreModel), [{"id": s, "name": f"Store {s}"}
+                                              for s in range(1, STORES + 1)])
+            conn.execute(insert(TagModel), [
+                {"id": (s - 1) * 2 + t, "name": f"tag-{t}", "store_id": s}
+                for s in range(1, STORES + 1) for t in (1, 2)
+            ])
+            for start in range(1, items + 1, CHUNK):
+                ids = range(start, min(start + CHUNK, items + 1))
+                conn.execute(insert(ItemModel), [
+                    {"id": i, "name": f"Item {i}", "price_cents": i * 37 % 100_000,
+                     "description": f"Description of item {i}", "store_id": i % STORES + 1}
+                    for i in ids
+                ])
+                conn.execute(insert(ItemTags), [
+                    {"item_id": i, "tag_id": (i % STORES) * 2 + t}
+                    for i in ids for t in range(1, i % 3 + 1)
+                ])
+    return app
+
+
+def load_orm():
+    return db.session.scalars(select(ItemModel).order_by(ItemModel.id)).all()
+
+
+def load_rows():
+    return item_rows(items_in_price_range())
+
+
+def timed(app, load):
+    with app.app_context():
+        started = time.perf_counter()
+        rows = load()
+        loaded = time.perf_counter()
+        ItemSchema(many=True).dump(rows)
+        dumped = time.perf_counter()
+        db.session.remove()
+    return loaded - started, dumped - loaded
+
+
+def memory(app, load):
+    """Bytes held once loaded and once dumped (the dump itself excluded)."""
+    with app.app_context():
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        rows = load()
+        loaded = tracemalloc.get_traced_memory()[0] - base
+        data = ItemSchema(many=True).dump(rows)
+        del data
+        gc.collect()
+        dumped = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        del rows
+        db.session.remove()
+    return loaded, dumped
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    paths = sys.argv[2:] or ["orm", "rows"]
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"), items)
+        print(f"{items} items\n")
+        print(f"{'path':>5} {'load s':>8} {'dump s':>8} {'us/item':>8} "
+              f"{'B/item loaded':>14} {'B/item dumped':>14}")
+        for name in paths:
+            load = load_orm if name == "orm" else load_rows
+            load_s, dump_s = timed(app, load)
+            loaded, dumped = memory(app, load)
+            print(f"{name:>5} {load_s:8.2f} {dump_s:8.2f} "
+                  f"{(load_s + dump_s) / items * 1e6:8.1f} "
+                  f"{loaded / items:14.0f} {dumped / items:14.0f}")
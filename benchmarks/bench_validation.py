@@ -0,0 +1,79 @@
+"""
+Compiled vs marshmallow request body validation.
+
+For each write schema, checks that the compiled loader (validation.py)
+returns the same data or raises the same messages as Schema.load for a set
+of valid and invalid bodies, then times both on a valid and an invalid
+body.
+
+Run from the project root:
+
+    python -m benchmarks.bench_validation
+"""
+
+import timeit
+
+from marshmallow import RAISE, ValidationError
+
+from schemas import ItemSchema, ItemUpdateSchema, StoreSchema, TagSchema, UserSchema
+from validation import compile_schema
+
+
+BODIES = {
+    ItemSchema: (
+        {"name": "Chair", "price": 15.99, "store_id": 1, "description": "Oak"},
+        {"name": 3, "price": "cheap", "id": 4},
+    ),
+    ItemUpdateSchema: (
+        {"name": "Chair", "price": 17.5},
+        {"price": float("nan"), "store_id": "one"},
+    ),
+    StoreSchema: ({"name": "Hardware"}, {"items": []}),
+    TagSchema: ({"name": "Sale"}, {"name": None}),
+    UserSchema: ({"username": "jb", "password": "secret"}, {"username": ["jb"]}),
+}
+
+# Edge cases every schema must handle like marshmallow.
+EDGES = [
+    {}, [], "body", None, {"name": b"bytes"}, {"name": b"\xff"}, {"price": 10},
+    {"price": "10.5"}, {"price": 2 ** 60}, {"price": 10 ** 400}, {"price": True},
+    {"price": float("inf")}, {"store_id": 1.5}, {"store_id": "7"}, {"store_id": True},
+    {"description": None}, {"unknown": 1},
+]
+
+
+def outcome(load, data):
+    try:
+        return "ok", load(data)
+    except ValidationError as error:
+        return "error", error.messages
+
+
+def check(schema, loader):
+    for data in [*BODIES[type(schema)], *EDGES]:
+        expected = outcome(lambda d: schema.load(d, unknown=RAISE), data)
+        got = outcome(lambda d: loader(d, RAISE), data)
+        assert got == expected, (type(schema).__name__, data, got, expected)
+
+
+def bench(load, data, number=20_000):
+    def run():
+        try:
+            load(data)
+        except ValidationError:
+            pass
+
+    return min(timeit.repeat(run, number=number, repeat=3)) / number * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'schema':>16}  {'body':>7}  {'marshmallow us':>14}  {'compiled us':>11}  {'speedup':>7}")
+    for schema_class, bodies in BODIES.items():
+        schema = schema_class()
+        loader = compile_schema(schema)
+        check(schema, loader)
+        for label, data in zip(("valid", "invalid"), bodies):
+            slow = bench(lambda d: schema.load(d, unknown=RAISE), data)
+            fast = bench(lambda d: loader(d, RAISE), data)
+            print(f"{schema_class.__name__:>16}  {label:>7}  {slow:>14.2f}  {fast:>11.2f}  "
+                  f"{slow / fast:>6.1f}x")
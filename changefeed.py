@@ -0,0 +1,243 @@
+"""
+changefeed.py
+
+Change-data feed for incremental sync (GET /changes).
+
+Every flush of db.session that creates, updates or deletes an item, store or
+tag, or links/unlinks a tag to an item, appends rows to the 'changes' table
+on the same connection, so a change is logged if and only if it commits.
+Writes that bypass the ORM (importer.py, writepath.py) log their rows with
+record().
+Store and tag changes also bump the catalogue version (see snapshot.py).
+
+The cursor is the id of the last change a client has seen. With sharding
+each shard has its own log, so the cursor is one position per shard joined
+with "." (e.g. "120.87.3"); without sharding it is a plain number.
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+from blinker import Namespace
+from flask import current_app
+from sqlalchemy import event, func, inspect, insert, select, update
+
+from db import RoutingSession, db
+from models import CatalogueVersionModel, ChangeModel, ItemModel, StoreModel, TagModel
+
+
+TRACKED = {ItemModel: "item", StoreModel: "store", TagModel: "tag"}
+
+# Entities of the catalogue snapshot (snapshot.py).
+CATALOGUE = {"store", "tag"}
+
+# Wakes long-polling readers in this process as soon as a change commits.
+# Changes committed by other workers are picked up by the poll interval.
+_committed = threading.Condition()
+
+# Sent after commit with the committed change rows (see events.py).
+changes_committed = Namespace().signal("changes-committed")
+
+
+def change(entity, entity_id, op, store_id=None, data=None):
+    """Build one row for the 'changes' table."""
+    return {
+        "entity": entity,
+        "entity_id": entity_id,
+        "op": op,
+        "store_id": store_id,
+        "data": data,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def record(session, rows):
+    """Append change rows in the session's current transaction.
+
+    The rows (with their ids filled in) are kept on the session until
+    commit, when they are sent with the 'changes_committed' signal. Rows of
+    stores or tags bump the catalogue version in the same transaction.
+    """
+    if not rows:
+        return
+    table = ChangeModel.__table__
+    connection = session.connection()
+    ids = connection.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    for row, change_id in zip(rows, ids):
+        row["id"] = change_id
+    if any(row["entity"] in CATALOGUE for row in rows):
+        bump_catalogue_version(connection)
+    session.info.setdefault("changes", []).extend(rows)
+
+
+def bump_catalogue_version(connection):
+    table = CatalogueVersionModel.__table__
+    bumped = connection.execute(
+        update(table).where(table.c.id == 1).values(version=table.c.version + 1)
+    ).rowcount
+    if not bumped:  # tables made by create_all(), not by the migration
+        connection.execute(insert(table).values(id=1, version=1))
+
+
+def _columns(obj):
+    data = {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+    if "price_cents" in data:  # same shape as the API
+        data["price"] = data.pop("price_cents") / 100
+    return data
+
+
+def _store_id(obj):
+    return obj.id if isinstance(obj, StoreModel) else obj.store_id
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _record_flush(session, flush_context):
+    rows = []
+
+    for obj in session.new:
+        entity = TRACKED.get(type(obj))
+        if entity:
+            rows.append(change(entity, obj.id, "create", _store_id(obj), _columns(obj)))
+
+    for obj in session.dirty:
+        entity = TRACKED.get(type(obj))
+        if entity and session.is_modified(obj, include_collections=False):
+            rows.append(change(entity, obj.id, "update", _store_id(obj), _columns(obj)))
+
+    for obj in session.deleted:
+        entity = TRACKED.get(type(obj))
+        if entity:
+            rows.append(change(entity, obj.id, "delete", _store_id(obj)))
+
+    for obj in session.new | session.dirty:
+        if isinstance(obj, ItemModel):
+            history = inspect(obj).attrs.tags.history
+            for tag in history.added:
+                rows.append(change("item_tag", obj.id, "create", obj.store_id,
+                                   {"item_id": obj.id, "tag_id": tag.id}))
+            for tag in history.deleted:
+                rows.append(change("item_tag", obj.id, "delete", obj.store_id,
+                                   {"item_id": obj.id, "tag_id": tag.id}))
+
+    record(session, rows)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _notify_commit(session):
+    rows = session.info.pop("changes", None)
+    if rows:
+        with _committed:
+            _committed.notify_all()
+        changes_committed.send(session, changes=rows)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_rollback(session):
+    session.info.pop("changes", None)
+
+
+# ------------------------------- reading ----------------------------------- #
+
+def _engines():
+    router = current_app.extensions["sharding"]
+    if router.enabled:
+        return [router.engine(shard) for shard in router.shards()]
+    return [db.engine]
+
+
+def parse_cursor(cursor):
+    """Decode a cursor into one position per shard.
+
+    No cursor means the beginning of the log, "latest" its current end.
+    Raises ValueError on a malformed cursor.
+    """
+    shards = len(_engines())
+    if cursor in (None, ""):
+        return [0] * shards
+    if cursor == "latest":
+        return latest_positions()
+    positions = [int(part) for part in str(cursor).split(".")]
+    if len(positions) != shards or min(positions) < 0:
+        raise ValueError("Invalid cursor.")
+    return positions
+
+
+def format_cursor(positions):
+    return ".".join(str(position) for position in positions)
+
+
+def latest_positions():
+    positions = []
+    for engine in _engines():
+        with engine.connect() as conn:
+            positions.append(conn.execute(select(func.max(ChangeModel.id))).scalar() or 0)
+    return positions
+
+
+def read_changes(positions, limit=100, store_id=None):
+    """Changes after 'positions', oldest first.
+
+    Returns (changes, new positions). Each shard is read up to 'limit' rows
+    in id order; the logs are merged by time and cut back to 'limit', and a
+    shard's position only advances past the rows actually returned.
+
+    Ids are handed out before commit, so on a database with concurrent
+    writers (Postgres) a change can become visible after a later id.
+    CHANGEFEED_SETTLE_SECONDS holds back the newest rows for that long so
+    readers don't step over them.
+    """
+    table = ChangeModel.__table__
+    settle = current_app.config.get("CHANGEFEED_SETTLE_SECONDS", 0)
+    logs = []
+    for shard, engine in enumerate(_engines()):
+        query = select(table).where(table.c.id > positions[shard])
+        if store_id is not None:
+            query = query.where(table.c.store_id == store_id)
+        if settle:
+            query = query.where(
+                table.c.created_at <= datetime.utcnow() - timedelta(seconds=settle)
+            )
+        with engine.connect() as conn:
+            rows = conn.execute(query.order_by(table.c.id).limit(limit)).mappings().all()
+        logs.append([(row["created_at"], shard, row) for row in rows])
+
+    positions = list(positions)
+    changes = []
+    for _, shard, row in heapq.merge(*logs, key=lambda c: (c[0], c[1])):
+        if len(changes) == limit:
+            break
+        positions[shard] = row["id"]
+        changes.append(dict(row))
+    return changes, positions
+
+
+def read_store_changes(store_id, after_id, limit=1000):
+    """Changes of one store after a change id, read from the store's shard."""
+    router = current_app.extensions["sharding"]
+    engine = router.engine(router.shard_for_store(store_id) or 0) if router.enabled else db.engine
+    table = ChangeModel.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(table)
+            .where(table.c.store_id == store_id, table.c.id > after_id)
+            .order_by(table.c.id)
+            .limit(limit)
+        ).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def wait_for_changes(positions, limit=100, store_id=None, wait=0, poll_interval=0.5):
+    """Long-poll: like read_changes, but waits up to 'wait' seconds for the
+    first change to arrive."""
+    deadline = time.monotonic() + wait
+    while True:
+        changes, new_positions = read_changes(positions, limit, store_id)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, new_positions
+        with _committed:
+            _committed.wait(min(poll_interval, remaining))
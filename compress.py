@@ -0,0 +1,188 @@
+"""
+compress.py
+
+Response compression (Content-Encoding) negotiated from Accept-Encoding.
+
+JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed with the
+first algorithm in COMPRESS_ALGORITHMS the client accepts. gzip is always
+available; "br" needs the 'brotli' package and "zstd" the 'zstandard'
+package, and are skipped when those aren't installed. Streamed responses
+(SSE) are never compressed.
+
+Compressed bodies are kept in a bounded LRU keyed by the uncompressed
+body's hash, encoding and level, so a hot response - the same store page
+served over and over, or the copies handed out by singleflight.py - is
+compressed once and then only hashed.
+
+Config (app.config):
+
+    COMPRESS_ENABLED          -> turn compression on/off.
+    COMPRESS_MIN_SIZE         -> smaller bodies are sent as they are.
+    COMPRESS_ALGORITHMS       -> server preference, e.g. ["zstd", "br", "gzip"].
+    COMPRESS_LEVELS           -> {"gzip": 6, "br": 4, "zstd": 3}
+    COMPRESS_ENDPOINT_LEVELS  -> per endpoint overrides, keyed like the rate
+                                 limits: {"GET stores.StoreList": {"br": 9}}.
+                                 A level of None sends that endpoint
+                                 uncompressed.
+    COMPRESS_CACHE_SIZE       -> bytes of compressed bodies kept (0 = no cache).
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE = {
+    "application/json", "text/plain", "text/html", "text/csv",
+    "application/msgpack", "application/vnd.columnar+msgpack", "application/vnd.columnar+json",
+}
+
+
+def _gzip(data, level):
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+_zstd_compressors = {}
+
+
+def _zstd(data, level):
+    compressor = _zstd_compressors.get(level)
+    if compressor is None:
+        compressor = _zstd_compressors[level] = zstandard.ZstdCompressor(level=level)
+    return compressor.compress(data)
+
+
+CODECS = {"gzip": _gzip}
+if brotli is not None:
+    CODECS["br"] = _brotli
+if zstandard is not None:
+    CODECS["zstd"] = _zstd
+
+
+class CompressedCache:
+    """LRU of compressed bodies, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (encoding, level, digest) -> bytes
+        self._lock = threading.Lock()
+
+    def compress(self, encoding, level, data):
+        if not self.max_bytes:
+            return CODECS[encoding](data, level)
+
+        key = (encoding, level, hashlib.blake2b(data, digest_size=16).digest())
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+
+        body = CODECS[encoding](data, level)
+        if len(body) > self.max_bytes:
+            return body
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = body
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self.size -= len(old)
+        return body
+
+
+class Compressor:
+    """Flask extension compressing responses in after_request."""
+
+    def __init__(self, app=None):
+        self._levels = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_ENABLED", True)
+        app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESS_ALGORITHMS", ["zstd", "br", "gzip"])
+        app.config.setdefault("COMPRESS_LEVELS", {"gzip": 6, "br": 4, "zstd": 3})
+        app.config.setdefault("COMPRESS_ENDPOINT_LEVELS", {})
+        app.config.setdefault("COMPRESS_CACHE_SIZE", 32 * 1024 * 1024)
+
+        if not app.config["COMPRESS_ENABLED"]:
+            return
+
+        self.min_size = app.config["COMPRESS_MIN_SIZE"]
+        self.algorithms = [name for name in app.config["COMPRESS_ALGORITHMS"] if name in CODECS]
+        self.default_levels = app.config["COMPRESS_LEVELS"]
+        self.endpoint_levels = app.config["COMPRESS_ENDPOINT_LEVELS"]
+        self.cache = CompressedCache(app.config["COMPRESS_CACHE_SIZE"])
+        app.extensions["compress"] = self
+        app.after_request(self.after_request)
+
+    def levels_for(self, method, endpoint):
+        """Return {encoding: level} for a method/endpoint, cached per pair."""
+        try:
+            return self._levels[method, endpoint]
+        except KeyError:
+            pass
+        levels = dict(self.default_levels)
+        levels.update(self.endpoint_levels.get(endpoint, {}))
+        levels.update(self.endpoint_levels.get(f"{method} {endpoint}", {}))
+        self._levels[method, endpoint] = levels
+        return levels
+
+    def negotiate(self, levels):
+        """First server-preferred encoding the client accepts, with its level."""
+        accepted = request.accept_encodings
+        for encoding in self.algorithms:
+            if accepted.quality(encoding) > 0 and levels.get(encoding) is not None:
+                return encoding, levels[encoding]
+        return None, None
+
+    def after_request(self, response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or request.method == "HEAD"
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        encoding, level = self.negotiate(self.levels_for(request.method, request.endpoint))
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.set_data(self.cache.compress(encoding, level, data))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -1,3 +1,36 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 
-db = SQLAlchemy()
+
+class RoutingSession(Session):
+    """Session that sends queries to the shard picked for the current request.
+
+    sharding.py stores the engine of the selected shard in 'g.shard_engine'.
+    Without it (sharding disabled, CLI, migrations) the normal Flask-SQLAlchemy
+    bind lookup is used.
+
+    While 'hold_commits' is set in its info (an atomic POST /batch), commit()
+    only flushes: the batch commits or rolls back everything at the end.
+    """
+
+    def commit(self):
+        if self.info.get("hold_commits"):
+            self.flush()
+        else:
+            super().commit()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get("shard_engine")
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def commits_held():
+    """True while db.session defers its commits (see RoutingSession)."""
+    return db.session.info.get("hold_commits", False)
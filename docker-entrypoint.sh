@@ -2,4 +2,6 @@
 
 flask db upgrade
 
-exec gunicorn --bind 0.0.0.0:80 "app:create_app()"
\ No newline at end of file
+# Threaded workers, so admission control (admission.py) can queue and shed
+# requests inside each worker instead of leaving them in the socket backlog.
+exec gunicorn --bind 0.0.0.0:80 --worker-class gthread --threads "${GUNICORN_THREADS:-8}" "app:create_app()"
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+events.py
+
+Server-Sent Events push of store changes (GET /store/<store_id>/events).
+
+Frontends that poll Store.get to notice price and tag changes can subscribe
+to a store instead and receive one small event per change:
+
+    id: 42
+    event: item.update
+    data: {"id": 7, "name": "Chair", "price": 19.5, ...}
+
+Events come from the change log (changefeed.py), so the event id is the
+change id and a reconnecting client's Last-Event-ID is replayed from the log.
+
+Backends (EVENTS_BACKEND):
+
+    - "local": changes are published to subscribers straight from the commit
+      in this process. Only correct with a single worker process.
+    - "changelog": a background thread per worker tails the shared 'changes'
+      table every EVENTS_POLL_INTERVAL seconds and publishes what it finds,
+      so subscribers see writes made by any worker.
+
+Each open stream holds a thread, so run gunicorn with a threaded or async
+worker class (e.g. --worker-class gthread --threads 100) when using SSE.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from changefeed import changes_committed, latest_positions, read_changes
+
+
+class Subscription:
+    """Bounded event queue of one SSE client.
+
+    A client that falls more than 'maxlen' events behind is marked
+    'overflowed'; its stream ends and the client catches up from the change
+    log when it reconnects with Last-Event-ID.
+    """
+
+    __slots__ = ("store_id", "maxlen", "overflowed", "_events", "_cond")
+
+    def __init__(self, store_id, maxlen):
+        self.store_id = store_id
+        self.maxlen = maxlen
+        self.overflowed = False
+        self._events = deque()
+        self._cond = threading.Condition(threading.Lock())
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) >= self.maxlen:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Next (change id, message), or None after 'timeout' seconds."""
+        with self._cond:
+            if not self._events and not self.overflowed:
+                self._cond.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class EventBroker:
+    """In-process pub/sub of change rows keyed by store id."""
+
+    def __init__(self, app=None):
+        self._subscriptions = {}  # store_id -> set of Subscription
+        self._lock = threading.Lock()
+        self._tail = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENTS_BACKEND", "local")
+        app.config.setdefault("EVENTS_POLL_INTERVAL", 0.5)
+        app.config.setdefault("EVENTS_HEARTBEAT", 15)
+        app.config.setdefault("EVENTS_MAX_STREAM_SECONDS", 300)
+        app.config.setdefault("EVENTS_QUEUE_SIZE", 1000)
+
+        self.app = app
+        self.backend = app.config["EVENTS_BACKEND"]
+        app.extensions["events"] = self
+        if self.backend == "local":
+            changes_committed.connect(self._on_commit, weak=False)
+
+    # ----------------------------- pub/sub ---------------------------------- #
+
+    def subscribe(self, store_id):
+        subscription = Subscription(store_id, self.app.config["EVENTS_QUEUE_SIZE"])
+        with self._lock:
+            self._subscriptions.setdefault(store_id, set()).add(subscription)
+        if self.backend == "changelog":
+            self._ensure_tail()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.store_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.store_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscriptions.values())
+
+    def publish(self, change):
+        """Deliver one change row to the subscribers of its store."""
+        store_id = change.get("store_id")
+        with self._lock:
+            subscribers = tuple(self._subscriptions.get(store_id, ()))
+        if not subscribers:
+            return
+        event = (change["id"], format_event(change))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def _on_commit(self, session, changes):
+        if self._subscriptions:
+            for change in changes:
+                self.publish(change)
+
+    # ----------------------- "changelog" backend ---------------------------- #
+
+    def _ensure_tail(self):
+        with self._lock:
+            if self._tail is not None and self._tail.is_alive():
+                return
+            self._tail = threading.Thread(target=self._run_tail, name="events-tail",
+                                          daemon=True)
+            self._tail.start()
+
+    def _run_tail(self):
+        interval = self.app.config["EVENTS_POLL_INTERVAL"]
+        with self.app.app_context():
+            positions = latest_positions()
+            while True:
+                time.sleep(interval)
+                try:
+                    changes, positions = read_changes(positions, limit=1000)
+                    while changes:
+                        for change in changes:
+                            self.publish(change)
+                        if len(changes) < 1000:
+                            break
+                        changes, positions = read_changes(positions, limit=1000)
+                except Exception:
+                    current_app.logger.exception("Change log tail failed.")
+
+
+def format_event(change):
+    """Encode a change row as an SSE message (bytes)."""
+    if change["op"] == "delete" and change["entity"] != "item_tag":
+        data = {"id": change["entity_id"]}
+    else:
+        data = change["data"]
+    return (
+        f"id: {change['id']}\n"
+        f"event: {change['entity']}.{change['op']}\n"
+        f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+    ).encode()
+
+
+def stream(subscription, backlog=()):
+    """Generator of SSE bytes for a subscription.
+
+    Sends the replayed backlog first, then live events, with a comment line
+    as heartbeat. Ends after EVENTS_MAX_STREAM_SECONDS or on overflow; the
+    browser's EventSource reconnects with Last-Event-ID on its own.
+    """
+    broker = current_app.extensions["events"]
+    heartbeat = current_app.config["EVENTS_HEARTBEAT"]
+    deadline = time.monotonic() + current_app.config["EVENTS_MAX_STREAM_SECONDS"]
+    last_id = 0
+    try:
+        yield b"retry: 1000\n\n"
+        for change in backlog:
+            last_id = change["id"]
+            yield format_event(change)
+        while time.monotonic() < deadline and not subscription.overflowed:
+            event = subscription.get(heartbeat)
+            if event is None:
+                yield b": keep-alive\n\n"
+                continue
+            event_id, message = event
+            if event_id > last_id:  # skip events already sent from the backlog
+                yield message
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,277 @@
+"""
+groupcommit.py
+
+Write-behind group commit for item updates (PUT /item/<id>).
+
+Price feeds update items thousands of times a second. Done one by one, each
+PUT is a read, an UPDATE and a commit of its own, so throughput is bound by
+the database's fsync per commit. With ITEM_GROUP_COMMIT on, a PUT to an
+existing item instead queues its name/price/description and waits:
+
+    - Writes arriving within GROUP_COMMIT_WINDOW seconds of the first one
+      are collected. Writes to the same item are queued in order and merged
+      when the batch is written, the last one winning, so a burst of price
+      ticks becomes a single row update.
+    - A flusher thread writes the whole batch with one multi-row
+      UPDATE ... RETURNING (a CASE per column), logs the changes
+      (changefeed.py) and commits: one transaction and one fsync for up to
+      GROUP_COMMIT_MAX_ROWS items.
+    - Every request in the batch is answered once that commit has landed,
+      with the item as committed. A PUT is never acknowledged before its
+      write is durable; if the process dies first, the client gets no
+      response, never a false success.
+    - Each write waits at most GROUP_COMMIT_TIMEOUT seconds from its own
+      arrival. If it is still queued then (the flusher is stuck on an
+      earlier batch), only that write is withdrawn: TimeoutError, not
+      applied. If the flusher has taken it, it waits as long again for that
+      commit, then gives up with CommitInDoubt: it may still land.
+
+Writes that can't go this way take the normal path in the view: creating
+an item (PUT to an id that doesn't exist, or is soft-deleted), and items
+not on their home shard. If a batch fails, its items are retried one per transaction so only
+the offending write fails.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, select, update
+
+from changefeed import change, record
+from db import db
+from models import ItemModel, ItemTags, StoreModel, TagModel
+from models.item import to_cents
+from readpath import ITEM_COLUMNS
+from sharding import is_enabled, use_shard
+from snapshot import current
+
+
+items = ItemModel.__table__
+
+# PUT fields written behind, and the column each one sets.
+COLUMNS = {"name": "name", "price": "price_cents", "description": "description"}
+
+
+class CommitInDoubt(TimeoutError):
+    """The write was taken into a commit that didn't finish in time; it may
+    still land."""
+
+
+class Pending:
+    """Queued write of one request, and its outcome."""
+
+    __slots__ = ("values", "done", "item", "error")
+
+    def __init__(self, values):
+        self.values = values  # column -> value
+        self.done = threading.Event()
+        self.item = None    # committed item (dict), None if it doesn't exist
+        self.error = None
+
+
+class GroupCommitter:
+    """Flask extension batching item updates into group commits."""
+
+    def __init__(self, app=None):
+        self._pending = {}  # (shard, item id) -> [Pending, ...] in arrival order
+        self._cond = threading.Condition()
+        self._flusher = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ITEM_GROUP_COMMIT", False)
+        app.config.setdefault("GROUP_COMMIT_WINDOW", 0.005)
+        app.config.setdefault("GROUP_COMMIT_MAX_ROWS", 500)
+        app.config.setdefault("GROUP_COMMIT_TIMEOUT", 10)
+
+        self.app = app
+        self.enabled = app.config["ITEM_GROUP_COMMIT"]
+        self.window = app.config["GROUP_COMMIT_WINDOW"]
+        self.max_rows = app.config["GROUP_COMMIT_MAX_ROWS"]
+        self.timeout = app.config["GROUP_COMMIT_TIMEOUT"]
+        app.extensions["group_commit"] = self
+
+    def update(self, item_id, data):
+        """Write 'data' to item 'item_id' in the next group commit.
+
+        Blocks until the commit has landed and returns the committed item as
+        a dict shaped like ItemSchema, or None if there is no such item (on
+        its home shard). Raises the error of a failed write, TimeoutError if
+        the write is still queued after GROUP_COMMIT_TIMEOUT seconds (it is
+        withdrawn, so it is never applied), or CommitInDoubt if the commit
+        that took it hasn't finished GROUP_COMMIT_TIMEOUT seconds later.
+        """
+        if not str(item_id).isdigit():
+            return None
+        item_id = int(item_id)
+        shard = current_app.extensions["sharding"].shards_for_id(item_id)[0] if is_enabled() else 0
+        values = {COLUMNS[field]: value for field, value in data.items() if field in COLUMNS}
+        if "price_cents" in values:
+            values["price_cents"] = to_cents(values["price_cents"])
+
+        pending = Pending(values)
+        self._ensure_flusher()
+        with self._cond:
+            self._pending.setdefault((shard, item_id), []).append(pending)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                self._cond.notify()
+
+        if not pending.done.wait(self.timeout):
+            with self._cond:
+                queued = self._pending.get((shard, item_id), ())
+                if any(write is pending for write in queued):
+                    # Still queued: withdraw this write only.
+                    queued.remove(pending)
+                    if not queued:
+                        del self._pending[shard, item_id]
+                    raise TimeoutError("Item update was not committed in time.")
+            # Taken by the flusher: its commit decides, if it finishes.
+            if not pending.done.wait(self.timeout):
+                raise CommitInDoubt("Item update is still being committed.")
+        if pending.error is not None:
+            raise pending.error
+        return pending.item
+
+    # ------------------------------ flusher --------------------------------- #
+
+    def _ensure_flusher(self):
+        with self._cond:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run, name="group-commit",
+                                             daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+
+            shards = {}
+            for (shard, item_id), queued in batch.items():
+                shards.setdefault(shard, {})[item_id] = queued
+            for shard, writes in shards.items():
+                self._commit(shard, writes)
+
+    def _commit(self, shard, writes):
+        """Commit one shard's batch; on failure retry the writes one by one."""
+        with self.app.app_context():
+            use_shard(shard)
+            try:
+                committed = write_items(writes)
+            except Exception as error:
+                db.session.rollback()
+                if len(writes) > 1:
+                    for item_id, queued in writes.items():
+                        self._commit(shard, {item_id: queued})
+                    return
+                current_app.logger.exception("Group commit of item %s failed.", *writes)
+                committed, failed = {}, error
+            else:
+                failed = None
+            finally:
+                db.session.remove()
+
+        for item_id, queued in writes.items():
+            for pending in queued:
+                pending.item = committed.get(item_id)
+                pending.error = failed
+                pending.done.set()
+
+
+def write_items(writes):
+    """Update items {id: [Pending, ...]} with one statement and commit; the
+    writes to an item are merged in order, the last one winning.
+
+    Returns {id: item dict} of the live items that exist.
+    """
+    ids = list(writes)
+    merged = {}
+    for item_id, queued in writes.items():
+        merged[item_id] = {}
+        for pending in queued:
+            merged[item_id].update(pending.values)
+    values = {}
+    for column in ("name", "price_cents", "description"):
+        whens = {item_id: item_values[column]
+                 for item_id, item_values in merged.items() if column in item_values}
+        if whens:
+            values[column] = case(whens, value=items.c.id, else_=items.c[column])
+
+    session = db.session
+    if values:
+        rows = session.execute(
+            update(items).where(items.c.id.in_(ids), items.c.deleted_at.is_(None))
+            .values(values).returning(*ITEM_COLUMNS)
+        ).mappings().all()
+    else:
+        rows = session.execute(
+            select(*ITEM_COLUMNS).where(items.c.id.in_(ids), items.c.deleted_at.is_(None))
+        ).mappings().all()
+    if not rows:
+        session.rollback()
+        return {}
+
+    changed = []
+    for row in rows:
+        data = dict(row)
+        data["price"] = data.pop("price_cents") / 100
+        changed.append(change("item", row["id"], "update", row["store_id"], data))
+    if values:
+        record(session, changed)
+    committed = _render(session, rows)
+    session.commit()
+    return committed
+
+
+def _render(session, rows):
+    """Item rows -> dicts with their store and tags, in at most two queries.
+
+    Stores come from the catalogue snapshot; only those missing from it are
+    queried.
+    """
+    store_ids = {row["store_id"] for row in rows}
+    snapshot = current()
+    stores = {}
+    if snapshot is not None:
+        stores = {store_id: snapshot.store(store_id) for store_id in store_ids}
+        stores = {store_id: store for store_id, store in stores.items() if store is not None}
+    missing = store_ids - stores.keys()
+    if missing:
+        stores.update(
+            (store.id, {"id": store.id, "name": store.name})
+            for store in session.execute(
+                select(StoreModel.id, StoreModel.name).where(StoreModel.id.in_(missing))
+            )
+        )
+    tags = {}
+    for item_id, tag_id, tag_name in session.execute(
+        select(ItemTags.item_id, TagModel.id, TagModel.name)
+        .join(TagModel, TagModel.id == ItemTags.tag_id)
+        .where(ItemTags.item_id.in_([row["id"] for row in rows]))
+        .order_by(TagModel.id)
+    ):
+        tags.setdefault(item_id, []).append({"id": tag_id, "name": tag_name})
+
+    return {
+        row["id"]: {
+            "id": row["id"],
+            "name": row["name"],
+            "price": row["price_cents"] / 100,
+            "description": row["description"],
+            "store_id": row["store_id"],
+            "store": stores.get(row["store_id"]),
+            "tags": tags.get(row["id"], []),
+        }
+        for row in rows
+    }
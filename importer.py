@@ -0,0 +1,471 @@
+"""
+importer.py
+
+Streaming catalogue import used by the `flask import` CLI command and the
+POST /import endpoint (resources/catalogue.py).
+
+Bootstrapping an environment by replaying ItemList.post / TagsInStore.post
+calls means one request, one query.get and one commit per row. Instead, the
+importer:
+
+    - parses CSV or NDJSON as a stream (one row in memory at a time),
+    - validates rows in batches against ItemSchema / TagSchema,
+    - resolves store and tag names to ids through in-memory maps (creating
+      missing stores and tags in bulk),
+    - writes each batch with bulk INSERTs (or COPY on Postgres/psycopg2),
+    - commits once per batch and reports the row offset after each commit so
+      an interrupted import can be resumed with `offset`.
+
+Row format (CSV header or NDJSON keys):
+
+    store, name, price, description, tags
+
+'tags' is a "|" separated string in CSV and a list or string in NDJSON.
+"""
+
+import csv
+import io
+import json
+import os
+import time
+
+import click
+from flask.cli import with_appcontext
+from marshmallow import ValidationError
+from sqlalchemy import insert, select, text
+
+from changefeed import change, record
+from db import db
+from jobs import job
+from models import ItemModel, ItemTags, StoreModel, TagModel
+from models.item import to_cents
+from schemas import ItemSchema, TagSchema
+from sharding import is_enabled as sharding_enabled
+
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_REJECTS = 100  # only the first rejects are kept in the report
+FORMATS = ("csv", "ndjson")
+
+ITEM_FIELDS = ("name", "price", "description")
+
+
+def guess_format(filename):
+    """Guess the import format from a file name, defaulting to CSV."""
+    if filename and filename.lower().endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+def read_rows(stream, fmt):
+    """Yield one dict per row of a CSV or NDJSON text stream.
+
+    Rows that can't be parsed are yielded as {"_error": <message>} so they are
+    counted (and rejected) without stopping the import.
+    """
+    if fmt == "ndjson":
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield {"_error": f"Invalid JSON: {e}"}
+                continue
+            yield row if isinstance(row, dict) else {"_error": "Row is not an object."}
+    elif fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        raise ValueError(f"Unknown import format '{fmt}'.")
+
+
+class ImportReport:
+    """Counters for a single import run."""
+
+    def __init__(self, offset=0):
+        self.start_offset = offset
+        self.offset = offset  # rows consumed and committed so far
+        self.imported = 0
+        self.rejected = 0
+        self.rejects = []
+        self.started = time.perf_counter()
+
+    def reject(self, row_number, errors):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"row": row_number, "errors": errors})
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self):
+        rows = self.offset - self.start_offset
+        return rows / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "rows": self.offset - self.start_offset,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+            "offset": self.offset,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+        }
+
+
+class CatalogueImporter:
+    """Batch importer for items (and their stores and tags).
+
+    The name -> id maps live for the whole run, so each store and tag is
+    looked up or created at most once no matter how many rows refer to it.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, use_copy=None):
+        self.batch_size = batch_size
+        dialect = db.engine.dialect
+        if use_copy is None:
+            use_copy = dialect.name == "postgresql" and dialect.driver == "psycopg2"
+        self.use_copy = use_copy
+
+        self.store_ids = {}  # store name -> id
+        self.tag_ids = {}  # (store_id, tag name) -> id
+        self.item_keys = {}  # store_id -> {(name, description)} already present
+
+        self.item_schema = ItemSchema(many=True)
+        self.tag_schema = TagSchema()
+
+    def run(self, rows, offset=0, checkpoint=None):
+        """Import an iterable of row dicts.
+
+        :param rows: Iterable of dicts, e.g. from read_rows().
+        :param offset: Number of leading rows to skip (resume point).
+        :param checkpoint: Optional callable(offset) invoked after each commit.
+        :return: ImportReport for the run.
+        """
+        report = ImportReport(offset)
+        batch = []
+
+        for row_number, row in enumerate(rows):
+            if row_number < offset:
+                continue
+            batch.append((row_number, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch, report, checkpoint)
+                batch = []
+
+        if batch:
+            self._import_batch(batch, report, checkpoint)
+
+        return report
+
+    # ----------------------------- batch steps ------------------------------ #
+
+    def _import_batch(self, batch, report, checkpoint):
+        valid = self._validate(batch, report)
+
+        try:
+            if valid:
+                self._resolve_stores(valid)
+                valid = self._drop_duplicates(valid, report)
+                self._resolve_tags(valid)
+                self._insert_items(valid)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        report.imported += len(valid)
+        report.offset = batch[-1][0] + 1
+        if checkpoint:
+            checkpoint(report.offset)
+
+    def _validate(self, batch, report):
+        """Validate a batch with one ItemSchema(many=True).load call.
+
+        Returns a list of (row_number, store name, item data, tag names).
+        """
+        candidates = []
+        for row_number, row in batch:
+            if "_error" in row:
+                report.reject(row_number, {"_schema": [row["_error"]]})
+                continue
+
+            store_name = row.get("store")
+            if store_name is not None and not isinstance(store_name, str):
+                report.reject(row_number, {"store": ["Not a valid string."]})
+                continue
+            store_name = (store_name or "").strip()
+            if not store_name:
+                report.reject(row_number, {"store": ["Missing data for required field."]})
+                continue
+
+            tags = row.get("tags") or []
+            if isinstance(tags, str):
+                tags = [tag.strip() for tag in tags.split("|") if tag.strip()]
+            elif not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                report.reject(row_number, {"tags": ["Not a valid list of strings."]})
+                continue
+            tags = list(dict.fromkeys(tags))  # drop repeated tags, keep order
+            tag_errors = self.tag_schema.validate([{"name": tag} for tag in tags], many=True)
+            if tag_errors:
+                report.reject(row_number, {"tags": tag_errors})
+                continue
+
+            item = {key: row[key] for key in ITEM_FIELDS if row.get(key) not in (None, "")}
+            candidates.append((row_number, store_name, item, tags))
+
+        if not candidates:
+            return []
+
+        try:
+            loaded = self.item_schema.load(
+                [item for _, _, item, _ in candidates], partial=("store_id",)
+            )
+            errors = {}
+        except ValidationError as err:
+            loaded = err.valid_data
+            errors = err.messages
+
+        valid = []
+        for index, (row_number, store_name, _, tags) in enumerate(candidates):
+            if index in errors:
+                report.reject(row_number, errors[index])
+                continue
+            valid.append((row_number, store_name, loaded[index], tags))
+        return valid
+
+    def _resolve_stores(self, rows):
+        missing = {name for _, name, _, _ in rows} - self.store_ids.keys()
+        if not missing:
+            return
+
+        for store_id, name in db.session.execute(
+            select(StoreModel.id, StoreModel.name).where(StoreModel.name.in_(missing))
+        ):
+            self.store_ids[name] = store_id
+            missing.discard(name)
+
+        if missing:
+            created = db.session.execute(
+                insert(StoreModel).returning(StoreModel.id, StoreModel.name),
+                [{"name": name} for name in sorted(missing)],
+            )
+            changes = []
+            for store_id, name in created:
+                self.store_ids[name] = store_id
+                self.item_keys[store_id] = set()
+                changes.append(change("store", store_id, "create", store_id,
+                                      {"id": store_id, "name": name}))
+            record(db.session, changes)
+
+    def _drop_duplicates(self, rows, report):
+        """Reject items that ItemList.post would reject as duplicates."""
+        unseen = {self.store_ids[name] for _, name, _, _ in rows} - self.item_keys.keys()
+        for store_id in unseen:
+            self.item_keys[store_id] = set()
+        if unseen:
+            for store_id, name, description in db.session.execute(
+                select(ItemModel.store_id, ItemModel.name, ItemModel.description)
+                .where(ItemModel.store_id.in_(unseen), ItemModel.deleted_at.is_(None))
+            ):
+                self.item_keys[store_id].add((name, description))
+
+        kept = []
+        for row_number, store_name, item, tags in rows:
+            store_id = self.store_ids[store_name]
+            key = (item["name"], item.get("description"))
+            if key in self.item_keys[store_id]:
+                report.reject(
+                    row_number,
+                    {"name": ["An item with this name already exists in the store."]},
+                )
+                continue
+            self.item_keys[store_id].add(key)
+            item["store_id"] = store_id
+            kept.append((row_number, store_name, item, tags))
+        return kept
+
+    def _resolve_tags(self, rows):
+        wanted = {
+            (item["store_id"], tag) for _, _, item, tags in rows for tag in tags
+        } - self.tag_ids.keys()
+        if not wanted:
+            return
+
+        store_ids = {store_id for store_id, _ in wanted}
+        for tag_id, store_id, name in db.session.execute(
+            select(TagModel.id, TagModel.store_id, TagModel.name)
+            .where(TagModel.store_id.in_(store_ids))
+        ):
+            self.tag_ids.setdefault((store_id, name), tag_id)
+
+        missing = wanted - self.tag_ids.keys()
+        if missing:
+            created = db.session.execute(
+                insert(TagModel).returning(TagModel.id, TagModel.store_id, TagModel.name),
+                [{"store_id": store_id, "name": name} for store_id, name in sorted(missing)],
+            )
+            changes = []
+            for tag_id, store_id, name in created:
+                self.tag_ids[(store_id, name)] = tag_id
+                changes.append(change("tag", tag_id, "create", store_id,
+                                      {"id": tag_id, "name": name, "store_id": store_id}))
+            record(db.session, changes)
+
+    def _insert_items(self, rows):
+        items = [item for _, _, item, _ in rows]
+        if not items:
+            return
+
+        if self.use_copy:
+            item_ids = self._copy_items(items)
+        else:
+            item_ids = db.session.execute(
+                insert(ItemModel).returning(ItemModel.id, sort_by_parameter_order=True),
+                [
+                    {"name": i["name"], "price_cents": to_cents(i["price"]),
+                     "description": i.get("description"), "store_id": i["store_id"]}
+                    for i in items
+                ],
+            ).scalars().all()
+
+        links = [
+            {"item_id": item_id, "tag_id": self.tag_ids[(item["store_id"], tag)]}
+            for item_id, (_, _, item, tags) in zip(item_ids, rows)
+            for tag in tags
+        ]
+
+        changes = [
+            change("item", item_id, "create", item["store_id"],
+                   {"id": item_id, "name": item["name"],
+                    "price": to_cents(item["price"]) / 100,
+                    "description": item.get("description"), "store_id": item["store_id"]})
+            for item_id, item in zip(item_ids, items)
+        ]
+        store_of = {item_id: item["store_id"] for item_id, item in zip(item_ids, items)}
+        changes.extend(
+            change("item_tag", link["item_id"], "create", store_of[link["item_id"]], link)
+            for link in links
+        )
+        record(db.session, changes)
+
+        if not links:
+            return
+        if self.use_copy:
+            self._copy("items_tags", ("item_id", "tag_id"),
+                       ((link["item_id"], link["tag_id"]) for link in links))
+        else:
+            db.session.execute(insert(ItemTags), links)
+
+    # ----------------------------- Postgres COPY ---------------------------- #
+
+    def _copy_items(self, items):
+        """Insert items with COPY, pre-allocating ids from the items sequence."""
+        item_ids = db.session.execute(
+            text("SELECT nextval(pg_get_serial_sequence('items', 'id')) "
+                 "FROM generate_series(1, :n)"),
+            {"n": len(items)},
+        ).scalars().all()
+        self._copy(
+            "items",
+            ("id", "name", "price_cents", "description", "store_id"),
+            ((item_id, i["name"], to_cents(i["price"]), i.get("description"), i["store_id"])
+             for item_id, i in zip(item_ids, items)),
+        )
+        return item_ids
+
+    @staticmethod
+    def _copy(table, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            # An unquoted empty field is NULL in COPY's CSV format.
+            writer.writerow("" if value is None else value for value in row)
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+
+# ------------------------------- CLI COMMAND -------------------------------- #
+
+@job("catalogue.import")
+def import_job(ctx, path, fmt, batch_size, offset):
+    """Background import of a file uploaded with 'Prefer: respond-async'.
+
+    Progress is the committed row offset, so a rerun resumes after it.
+    """
+    def checkpoint(rows_done):
+        ctx.progress(rows_done, force=True)
+
+    with open(path, newline="", encoding="utf-8") as stream:
+        report = CatalogueImporter(batch_size=batch_size).run(
+            read_rows(stream, fmt), offset=max(offset, ctx.started_from), checkpoint=checkpoint
+        )
+    os.remove(path)
+    return report.to_dict()
+
+
+@click.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS),
+              help="Input format (guessed from the file extension by default).")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option("--offset", type=int, default=None,
+              help="Skip this many rows (defaults to the saved checkpoint).")
+@click.option("--no-copy", is_flag=True, help="Never use Postgres COPY.")
+@with_appcontext
+def import_command(path, fmt, batch_size, offset, no_copy):
+    """Import a CSV/NDJSON catalogue file.
+
+    After every committed batch the row offset is written to '<path>.offset';
+    re-running the command resumes from there. The file is removed once the
+    import completes.
+    """
+    if sharding_enabled():
+        raise click.UsageError("Catalogue import does not support sharded databases yet.")
+
+    checkpoint_path = f"{path}.offset"
+    if offset is None:
+        try:
+            with open(checkpoint_path) as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            offset = 0
+        if offset:
+            click.echo(f"Resuming from row {offset}.")
+
+    def checkpoint(rows_done):
+        with open(checkpoint_path, "w") as f:
+            f.write(str(rows_done))
+        click.echo(f"  {rows_done} rows committed", err=True)
+
+    importer = CatalogueImporter(batch_size=batch_size, use_copy=False if no_copy else None)
+    with open(path, newline="", encoding="utf-8") as stream:
+        report = importer.run(read_rows(stream, fmt or guess_format(path)),
+                              offset=offset, checkpoint=checkpoint)
+
+    try:
+        os.remove(checkpoint_path)
+    except FileNotFoundError:
+        pass
+
+    result = report.to_dict()
+    click.echo(
+        f"Imported {result['imported']} of {result['rows']} rows "
+        f"({result['rejected']} rejected) in {result['elapsed']}s "
+        f"- {result['rows_per_sec']} rows/sec."
+    )
+    for reject in result["rejects"]:
+        click.echo(f"  row {reject['row']}: {reject['errors']}", err=True)
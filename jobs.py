@@ -0,0 +1,289 @@
+"""
+jobs.py
+
+Background jobs: a queue table ('jobs'), the 'flask worker' command that runs
+them in a process pool, and helpers for views to hand work off with a 202.
+
+A job is a function registered under a name. It gets a JobContext to report
+progress and returns a JSON-able result:
+
+    @job("store.delete")
+    def delete_store_job(ctx, store_id):
+        ...
+        ctx.progress(done, total)
+        return {"deleted": done}
+
+A view enqueues it and answers right away:
+
+    if respond_async() or too_big:
+        return accepted(enqueue("store.delete", store_id=store.id))
+
+'accepted' is a 202 with the job and a Location header; clients follow
+GET /jobs/<id> until 'status' is "done" or "failed". Clients opt in with
+'Prefer: respond-async'; views may also decide on their own for inputs that
+would outlast the gunicorn worker timeout.
+
+Workers claim jobs with one UPDATE ... RETURNING (FOR UPDATE SKIP LOCKED on
+Postgres), so any number of 'flask worker' processes on any host can share
+the queue. A job whose worker stops heartbeating for JOBS_STALE_SECONDS is
+queued again, up to JOBS_MAX_ATTEMPTS runs; jobs should be safe to rerun
+(use ctx.started_from to resume). A job that raises is marked "failed".
+
+The queue is accessed with Core on db.engine, outside the request's session,
+so it lives in the default database and an enqueue commits on its own;
+except in an atomic POST /batch (commits_held()), where the job is queued in
+the batch's transaction and dropped if the batch rolls back.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, jsonify, request
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select, update
+
+from db import commits_held, db
+from models import JobModel
+from schemas import JobSchema
+
+
+JOBS = {}  # name -> function(ctx, **args)
+
+jobs_table = JobModel.__table__
+
+
+def job(name):
+    """Register a function as the job 'name'."""
+    def decorator(fn):
+        JOBS[name] = fn
+        return fn
+    return decorator
+
+
+class JobContext:
+    """Handed to a running job to report progress."""
+
+    def __init__(self, job_id, started_from=0, interval=1.0):
+        self.job_id = job_id
+        self.started_from = started_from  # progress saved by an earlier attempt
+        self.interval = interval
+        self._reported = 0
+
+    def progress(self, done, total=None, force=False):
+        """Save progress (at most once per 'interval' seconds unless 'force')."""
+        now = time.monotonic()
+        if not force and now - self._reported < self.interval:
+            return
+        self._reported = now
+        values = {"progress": done, "heartbeat_at": datetime.utcnow()}
+        if total is not None:
+            values["total"] = total
+        with db.engine.begin() as conn:
+            conn.execute(update(jobs_table).where(jobs_table.c.id == self.job_id).values(values))
+
+
+# ------------------------------ enqueueing --------------------------------- #
+
+def enqueue(kind, **args):
+    """Queue a job; returns its row as a dict.
+
+    While commits are held the row goes through db.session, so the job only
+    exists if the atomic batch around it commits.
+    """
+    if kind not in JOBS:
+        raise KeyError(f"Unknown job {kind!r}.")
+    stmt = (
+        insert(jobs_table)
+        .values(kind=kind, args=args, status="queued", progress=0, attempts=0,
+                created_at=datetime.utcnow())
+        .returning(*jobs_table.c)
+    )
+    if commits_held():
+        return dict(db.session.execute(stmt).mappings().one())
+    with db.engine.begin() as conn:
+        return dict(conn.execute(stmt).mappings().one())
+
+
+def get_job(job_id):
+    with db.engine.connect() as conn:
+        row = conn.execute(select(jobs_table).where(jobs_table.c.id == job_id)).mappings().first()
+    return dict(row) if row else None
+
+
+def respond_async():
+    """True if the client asked for a 202 with 'Prefer: respond-async'."""
+    return "respond-async" in request.headers.get("Prefer", "")
+
+
+def accepted(job_row):
+    """202 response for a queued job."""
+    response = jsonify(JobSchema().dump(job_row))
+    response.status_code = 202
+    response.headers["Location"] = f"{request.script_root}/jobs/{job_row['id']}"
+    response.headers["Preference-Applied"] = "respond-async"
+    return response
+
+
+# ------------------------------ running ------------------------------------ #
+
+def claim(worker_id):
+    """Mark the oldest queued job as running by 'worker_id'; returns its id."""
+    now = datetime.utcnow()
+    oldest = (
+        select(jobs_table.c.id)
+        .where(jobs_table.c.status == "queued")
+        .order_by(jobs_table.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    with db.engine.begin() as conn:
+        return conn.execute(
+            update(jobs_table)
+            .where(jobs_table.c.id == oldest, jobs_table.c.status == "queued")
+            .values(status="running", worker=worker_id, started_at=now, heartbeat_at=now,
+                    attempts=jobs_table.c.attempts + 1)
+            .returning(jobs_table.c.id)
+        ).scalar()
+
+
+def heartbeat(job_ids):
+    if job_ids:
+        with db.engine.begin() as conn:
+            conn.execute(update(jobs_table)
+                         .where(jobs_table.c.id.in_(job_ids), jobs_table.c.status == "running")
+                         .values(heartbeat_at=datetime.utcnow()))
+
+
+def requeue_stale(stale_seconds, max_attempts):
+    """Queue again (or fail) running jobs whose worker stopped heartbeating."""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    stale = (jobs_table.c.status == "running") & (jobs_table.c.heartbeat_at < cutoff)
+    with db.engine.begin() as conn:
+        conn.execute(update(jobs_table)
+                     .where(stale, jobs_table.c.attempts >= max_attempts)
+                     .values(status="failed", error="Worker lost.",
+                             finished_at=datetime.utcnow()))
+        return conn.execute(update(jobs_table)
+                            .where(stale, jobs_table.c.attempts < max_attempts)
+                            .values(status="queued", worker=None)).rowcount
+
+
+def release(worker_id, job_ids):
+    """Put jobs of a stopping worker back in the queue."""
+    if job_ids:
+        with db.engine.begin() as conn:
+            conn.execute(update(jobs_table)
+                         .where(jobs_table.c.id.in_(job_ids), jobs_table.c.worker == worker_id,
+                                jobs_table.c.status == "running")
+                         .values(status="queued", worker=None))
+
+
+def _finish(job_id, **values):
+    values["finished_at"] = datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(update(jobs_table).where(jobs_table.c.id == job_id).values(values))
+
+
+def execute(job_id):
+    """Run one claimed job in the current app context."""
+    row = get_job(job_id)
+    fn = JOBS.get(row["kind"])
+    if fn is None:
+        _finish(job_id, status="failed", error=f"Unknown job {row['kind']!r}.")
+        return
+    context = JobContext(job_id, started_from=row["progress"],
+                         interval=current_app.config["JOBS_PROGRESS_INTERVAL"])
+    try:
+        result = fn(context, **row["args"])
+    except Exception as error:
+        db.session.rollback()
+        current_app.logger.exception("Job %s (%s) failed.", job_id, row["kind"])
+        _finish(job_id, status="failed", error=f"{type(error).__name__}: {error}")
+    else:
+        _finish(job_id, status="done", result=result)
+    finally:
+        db.session.remove()
+
+
+# ------------------------- worker pool processes --------------------------- #
+
+_process_app = None
+
+
+def _init_process():
+    global _process_app
+    from app import create_app
+
+    _process_app = create_app()
+
+
+def _run_in_process(job_id):
+    with _process_app.app_context():
+        execute(job_id)
+
+
+@click.command("worker")
+@click.option("--processes", type=int, default=None,
+              help="Jobs run at the same time (default: number of CPUs).")
+@click.option("--poll-interval", type=float, default=1.0, show_default=True,
+              help="Seconds between queue polls when idle.")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+@with_appcontext
+def worker_command(processes, poll_interval, once):
+    """Run queued background jobs."""
+    processes = processes or os.cpu_count() or 1
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stale_seconds = current_app.config["JOBS_STALE_SECONDS"]
+    max_attempts = current_app.config["JOBS_MAX_ATTEMPTS"]
+    running = {}  # future -> job id
+
+    def make_pool():
+        return concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+        )
+
+    click.echo(f"Worker {worker_id}: {processes} processes.")
+    pool = make_pool()
+    try:
+        while True:
+            if requeue_stale(stale_seconds, max_attempts):
+                click.echo("Requeued jobs of a lost worker.")
+            heartbeat(list(running.values()))
+
+            while len(running) < processes:
+                job_id = claim(worker_id)
+                if job_id is None:
+                    break
+                click.echo(f"Job {job_id} started.")
+                running[pool.submit(_run_in_process, job_id)] = job_id
+
+            if not running:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = concurrent.futures.wait(
+                running, timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                job_id = running.pop(future)
+                error = future.exception()
+                if error is not None:  # the process running it died
+                    _finish(job_id, status="failed", error=repr(error))
+                    if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = make_pool()
+                click.echo(f"Job {job_id} finished.")
+    except KeyboardInterrupt:
+        click.echo("Stopping; unfinished jobs go back to the queue.")
+        release(worker_id, list(running.values()))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
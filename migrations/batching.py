@@ -0,0 +1,169 @@
+"""
+Helpers for migrations that must not take the API down on large tables.
+
+    from migrations.batching import backfill, create_index, drop_index
+
+backfill() replaces a single 'UPDATE ... WHERE ...' with keyset batches of
+MIGRATION_BATCH_SIZE rows on the table's integer key. Each batch is its own
+transaction, so rows are only locked for one batch and the running app
+keeps reading and writing. It sleeps MIGRATION_BATCH_PAUSE seconds between
+batches to leave the database some headroom, logs progress, and stores the
+last finished key in 'alembic_backfill', so a migration that is killed
+resumes at the next batch when 'flask db upgrade' is run again.
+
+The update must be idempotent (e.g. guarded by 'column IS NULL'): a batch
+interrupted before its checkpoint is written runs again.
+
+create_index() / drop_index() use CREATE/DROP INDEX CONCURRENTLY on
+Postgres, which doesn't block writes. Elsewhere they are plain op calls.
+
+All of them leave the migration's transaction (Alembic autocommit block),
+which is why env.py runs every revision in its own transaction.
+"""
+
+import logging
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from alembic import context, op
+from flask import current_app
+
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+PROGRESS_TABLE = "alembic_backfill"
+PROGRESS_INTERVAL = 5  # seconds between progress log lines
+
+progress = sa.Table(
+    PROGRESS_TABLE,
+    sa.MetaData(),
+    sa.Column("name", sa.String(200), primary_key=True),
+    sa.Column("last_key", sa.BigInteger, nullable=False),
+    sa.Column("updated_at", sa.DateTime, nullable=False),
+)
+
+
+def backfill(table, values, where=None, key="id", name=None, batch_size=None, pause=None):
+    """Run 'UPDATE table SET values WHERE where' in keyset batches.
+
+    :param table: A sa.table() with the key column and the columns used.
+    :param values: Dict of column name -> value or SQL expression.
+    :param where: Optional filter; should make the update idempotent.
+    :param key: Unique integer column to walk the table by.
+    :param name: Checkpoint name, unique per backfill (default
+        "<table>.<columns>").
+    :param batch_size: Rows per batch (default MIGRATION_BATCH_SIZE).
+    :param pause: Seconds to sleep between batches (default
+        MIGRATION_BATCH_PAUSE).
+    """
+    column = table.c[key]
+    statement = table.update().values(values)
+    if where is not None:
+        statement = statement.where(where)
+
+    if context.is_offline_mode():
+        op.execute(statement)  # --sql: no batches, just the statement
+        return
+
+    config = current_app.config
+    batch_size = batch_size or config.get("MIGRATION_BATCH_SIZE", 1000)
+    pause = config.get("MIGRATION_BATCH_PAUSE", 0) if pause is None else pause
+    name = name or f"{table.name}.{','.join(sorted(values))}"
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        progress.create(connection, checkfirst=True)
+
+        first, last = connection.execute(sa.select(sa.func.min(column), sa.func.max(column))).one()
+        position = connection.execute(
+            sa.select(progress.c.last_key).where(progress.c.name == name)
+        ).scalar()
+        if first is None:
+            _clear(connection, name)
+            return
+        if position is not None:
+            logger.info("Backfill %s: resuming after %s = %s.", name, key, position)
+        else:
+            position = first - 1
+
+        started = reported = time.monotonic()
+        updated = 0
+        while position < last:
+            # Upper key of this batch; the last batch runs to the end.
+            upper = connection.execute(
+                sa.select(column).where(column > position).order_by(column)
+                .offset(batch_size - 1).limit(1)
+            ).scalar()
+            if upper is None:
+                upper = last
+
+            updated += connection.execute(
+                statement.where(column > position, column <= upper)
+            ).rowcount
+            position = upper
+            _save(connection, name, position)
+
+            now = time.monotonic()
+            if now - reported >= PROGRESS_INTERVAL:
+                reported = now
+                logger.info("Backfill %s: %d rows, %.0f%% of %s range, %.0f rows/sec.",
+                            name, updated, 100 * (position - first + 1) / (last - first + 1),
+                            key, updated / (now - started))
+            if pause:
+                time.sleep(pause)
+
+        _clear(connection, name)
+        logger.info("Backfill %s: done, %d rows in %.1fs.",
+                    name, updated, time.monotonic() - started)
+
+
+def _save(connection, name, position):
+    values = {"last_key": position, "updated_at": datetime.utcnow()}
+    if not connection.execute(
+        progress.update().where(progress.c.name == name).values(values)
+    ).rowcount:
+        connection.execute(progress.insert().values(name=name, **values))
+
+
+def _clear(connection, name):
+    connection.execute(progress.delete().where(progress.c.name == name))
+
+
+def _is_postgres():
+    return op.get_context().dialect.name == "postgresql"
+
+
+def create_index(index_name, table_name, columns, unique=False):
+    """op.create_index, CONCURRENTLY on Postgres.
+
+    A CONCURRENTLY build that failed half way leaves an invalid index with
+    the same name; it is dropped and built again.
+    """
+    if not _is_postgres():
+        op.create_index(index_name, table_name, columns, unique=unique)
+        return
+
+    with op.get_context().autocommit_block():
+        if not context.is_offline_mode():
+            invalid = op.get_bind().execute(
+                sa.text("SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE c.relname = :name AND NOT i.indisvalid"),
+                {"name": index_name},
+            ).first()
+            if invalid:
+                op.drop_index(index_name, table_name=table_name,
+                              postgresql_concurrently=True, if_exists=True)
+        op.create_index(index_name, table_name, columns, unique=unique,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def drop_index(index_name, table_name):
+    """op.drop_index, CONCURRENTLY on Postgres."""
+    if not _is_postgres():
+        op.drop_index(index_name, table_name=table_name)
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index(index_name, table_name=table_name,
+                      postgresql_concurrently=True, if_exists=True)
@@ -51,6 +51,11 @@ def get_metadata():
     return target_db.metadata
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # Checkpoints of migrations/batching.py, not part of the models.
+    return not (type_ == "table" and name == "alembic_backfill")
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +70,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +99,11 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
+    # One transaction per revision: batched backfills and concurrent index
+    # builds (migrations/batching.py) commit as they go, and a revision that
+    # fails half way must not roll back the ones before it.
+    conf_args.setdefault("transaction_per_migration", True)
 
     connectable = get_engine()
 
@@ -0,0 +1,32 @@
+"""index items_tags.item_id and items_tags.tag_id
+
+Revision ID: 7a3d9c2e5b81
+Revises: 5e2f8a7c91d4
+Create Date: 2026-10-19 16:03:52.660914
+
+The tags of a list of items (readpath.py) and the items of a tag are
+looked up by these columns; without the indexes every lookup scans the
+whole link table. Built CONCURRENTLY on Postgres (migrations/batching.py).
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.batching import create_index, drop_index
+
+
+# revision identifiers, used by Alembic.
+revision = '7a3d9c2e5b81'
+down_revision = '5e2f8a7c91d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index(op.f('ix_items_tags_item_id'), 'items_tags', ['item_id'])
+    create_index(op.f('ix_items_tags_tag_id'), 'items_tags', ['tag_id'])
+
+
+def downgrade():
+    drop_index(op.f('ix_items_tags_tag_id'), 'items_tags')
+    drop_index(op.f('ix_items_tags_item_id'), 'items_tags')
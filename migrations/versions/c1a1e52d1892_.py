@@ -7,7 +7,8 @@ Create Date: 2024-01-12 14:44:33.534744
 """
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy.sql import text
+
+from migrations.batching import backfill
 
 
 # revision identifiers, used by Alembic.
@@ -21,9 +22,12 @@ def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
     with op.batch_alter_table('items', schema=None) as batch_op:
         batch_op.add_column(sa.Column('description', sa.String(length=255), nullable=True))
-    op.execute(text("UPDATE items SET description = 'Default description' WHERE description IS NULL"))
     # ### end Alembic commands ###
 
+    items = sa.table('items', sa.column('id', sa.Integer), sa.column('description', sa.String))
+    backfill(items, {'description': 'Default description'},
+             where=items.c.description.is_(None))
+
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
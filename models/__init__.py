@@ -2,4 +2,9 @@ from models.store import StoreModel
 from models.item import ItemModel
 from models.tag import TagModel
 from models.item_tags import ItemTags
+from models.archive import ItemArchiveModel, ItemTagsArchive
 from models.user import UserModel
+from models.shard import StoreShardModel, ShardMapVersionModel, ShardSequenceModel
+from models.change import ChangeModel
+from models.job import JobModel
+from models.catalogue import CatalogueVersionModel
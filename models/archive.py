@@ -0,0 +1,29 @@
+from db import db
+
+
+class ItemArchiveModel(db.Model):
+    """Items moved out of 'items' by 'flask archive' (see archive.py).
+
+    Same columns as ItemModel plus 'archived_at', without foreign keys or
+    relationships: rows are only read by '?include_archived=true' and
+    deleted with their store.
+    """
+    __tablename__ = "items_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(80), nullable=False)
+    price_cents = db.Column(db.BigInteger, nullable=False)
+    description = db.Column(db.String(255), nullable=True)
+    store_id = db.Column(db.Integer, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+
+class ItemTagsArchive(db.Model):
+    """Tag links of the archived items."""
+    __tablename__ = "items_tags_archive"
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False, index=True)
+    tag_id = db.Column(db.Integer, nullable=False)
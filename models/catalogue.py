@@ -0,0 +1,14 @@
+from db import db
+
+
+class CatalogueVersionModel(db.Model):
+    """Version of the store and tag catalogue (one row, id 1).
+
+    Bumped in the same transaction as every change to a store or a tag (see
+    changefeed.record), so a worker's in-memory snapshot (snapshot.py) knows
+    it is out of date by reading one number.
+    """
+    __tablename__ = "catalogue_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
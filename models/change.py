@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from db import db
+
+
+class ChangeModel(db.Model):
+    """Append-only change log used by GET /changes.
+
+    One row per created/updated/deleted item, store or tag and per linked or
+    unlinked item tag, written in the same transaction as the change itself
+    (see changefeed.py). 'id' is the sync cursor.
+    """
+    __tablename__ = "changes"
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # item, store, tag, item_tag
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # create, update, delete
+    store_id = db.Column(db.Integer, nullable=True, index=True)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
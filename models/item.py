@@ -1,18 +1,65 @@
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy.ext.hybrid import hybrid_property
+
 from db import db
 
 
+def to_cents(price):
+    """Convert a price (float, str or Decimal) to integer minor units.
+
+    Floats go through their shortest repr, so 19.99 becomes 1999 rather than
+    1998. More than two decimals are rounded half up.
+    """
+    return int(Decimal(str(price)).scaleb(2).quantize(Decimal(1), ROUND_HALF_UP))
+
+
 class ItemModel(db.Model):
+    """Model for the items table in the database.
+
+    Prices are stored exactly as integer minor units in 'price_cents'
+    (1999 = 19.99), so sums, averages and range filters in SQL are exact
+    integer operations on an indexed column. 'price' reads and writes the
+    same value as a Decimal, which is what the schemas and resources use:
+
+        item.price = 19.99        -> item.price_cents == 1999
+        item.price                -> Decimal("19.99")
+        ItemModel.price_cents >= to_cents(10)    # filter on the index
+
+    Deleting an item only sets 'deleted_at'; reads skip such rows. 'flask
+    archive' (archive.py) later moves them, and items not updated since
+    'updated_at' for ARCHIVE_INACTIVE_DAYS, to the archive tables.
+    """
     __tablename__ = "items"
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=False, nullable=False)
-    price = db.Column(db.Float(precision=2), unique=False, nullable=False)
+    price_cents = db.Column(db.BigInteger, unique=False, nullable=False, index=True)
     description = db.Column(db.String(255), nullable=True)  # new column for item description
     store_id = db.Column(
         db.Integer, db.ForeignKey("stores.id"), unique=False, nullable=False
     )
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=True, index=True)
 
     # One-to-many relationship: items and stores:
     store = db.relationship("StoreModel", back_populates="items")
     # Many-to-many relationship: items and tags:
     tags = db.relationship("TagModel", back_populates="items", secondary="items_tags")
+
+    @hybrid_property
+    def price(self):
+        if self.price_cents is None:
+            return None
+        return Decimal(self.price_cents).scaleb(-2)
+
+    @price.inplace.setter
+    def _price_setter(self, value):
+        self.price_cents = to_cents(value)
+
+    @price.inplace.expression
+    @classmethod
+    def _price_expression(cls):
+        return cls.price_cents / 100
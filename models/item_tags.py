@@ -5,5 +5,5 @@ class ItemTags(db.Model):
     __tablename__ = "items_tags"
 
     id = db.Column(db.Integer, primary_key=True)
-    item_id = db.Column(db.Integer, db.ForeignKey("items.id"))
-    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"))
\ No newline at end of file
+    item_id = db.Column(db.Integer, db.ForeignKey("items.id"), index=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), index=True)
\ No newline at end of file
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from db import db
+
+
+class JobModel(db.Model):
+    """Queue of background jobs run by 'flask worker' (see jobs.py).
+
+    status goes queued -> running -> done | failed. 'progress' / 'total'
+    are reported by the job while it runs; 'heartbeat_at' is refreshed by
+    the worker, so jobs of a worker that died can be queued again.
+    Always lives in the default database, also when stores are sharded.
+    """
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    args = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default="queued", index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,40 @@
+from db import db
+
+
+class StoreShardModel(db.Model):
+    """Shard map (directory) entry for a store.
+
+    Lives in the default database only. Store ids are allocated here so they
+    are unique across shards, and 'name' is unique here because the per-shard
+    'stores.name' constraint can't see the other shards. 'moving' fences
+    the store while 'flask shards move' copies it: writes to it fail.
+    """
+    __tablename__ = "store_shards"
+
+    store_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+    shard = db.Column(db.Integer, nullable=False, index=True)
+    moving = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+
+class ShardMapVersionModel(db.Model):
+    """Version of the shard map (one row, id 1), bumped by every move.
+
+    Workers check it before trusting the placements they cached.
+    """
+    __tablename__ = "shard_map_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ShardSequenceModel(db.Model):
+    """Next free id for a table on one shard.
+
+    Every shard starts its sequences at 'shard * SHARD_ID_SPAN' so item and
+    tag ids never collide, even after a store is moved to another shard.
+    """
+    __tablename__ = "shard_sequences"
+
+    name = db.Column(db.String(80), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,184 @@
+"""
+negotiation.py
+
+Response and request body formats negotiated by media type.
+
+Service-to-service consumers fetching large item and store lists spend
+their CPU on JSON: parsing floats from text and re-reading the same keys
+on every row. They can ask for a compact encoding of the same data
+instead:
+
+    Accept: application/msgpack                  MessagePack
+    Accept: application/vnd.columnar+msgpack     MessagePack, lists of
+                                                 objects as columns
+    Accept: application/vnd.columnar+json        JSON, lists of objects as
+                                                 columns
+    (anything else)                              JSON, as before
+
+"Columnar" turns every list of objects sharing the same keys into the keys
+once and a row of values per object:
+
+    [{"id": 1, "name": "Chair"}, {"id": 2, "name": "Desk"}]
+    -> {"columns": ["id", "name"], "rows": [[1, "Chair"], [2, "Desk"]]}
+
+Every response built with jsonify/app.json - all flask-smorest responses
+and errors - goes through NegotiatingJSONProvider, so the same handler
+serves every format. Request bodies may be sent in any of these formats
+too (Content-Type), for the blueprints using tracing.Blueprint, whose
+argument parser extends the Parser below (through validation.Parser).
+
+MessagePack needs the optional 'msgpack' package; without it only the
+JSON formats are offered. CONTENT_FORMATS limits the formats offered:
+["json", "msgpack", "columnar"].
+"""
+
+import json
+
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from webargs import core
+from webargs.flaskparser import FlaskParser, abort
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+COLUMNAR_MSGPACK = "application/vnd.columnar+msgpack"
+COLUMNAR_JSON = "application/vnd.columnar+json"
+
+# Other names of MessagePack understood in Accept and Content-Type.
+MSGPACK_ALIASES = ["application/x-msgpack", "application/vnd.msgpack"]
+
+# Media types offered for each CONTENT_FORMATS entry.
+FORMATS = {
+    "json": [JSON],
+    "msgpack": [MSGPACK, *MSGPACK_ALIASES] if msgpack is not None else [],
+    "columnar": [COLUMNAR_MSGPACK, COLUMNAR_JSON] if msgpack is not None else [COLUMNAR_JSON],
+}
+
+MEDIA_TYPES = {JSON, MSGPACK, *MSGPACK_ALIASES, COLUMNAR_MSGPACK, COLUMNAR_JSON}
+
+
+CONTAINERS = (dict, list, tuple)
+
+
+def _nested_columns(rows, width):
+    """Indexes of the columns holding objects or lists in any row."""
+    return [index for index in range(width)
+            if any(isinstance(row[index], CONTAINERS) for row in rows)]
+
+
+def to_columnar(data):
+    """Turn lists of objects with the same keys into columns, recursively.
+
+    Only columns holding objects or lists are walked again, so flat rows
+    cost one pass.
+    """
+    if isinstance(data, dict):
+        return {key: to_columnar(value) if isinstance(value, CONTAINERS) else value
+                for key, value in data.items()}
+    if not isinstance(data, (list, tuple)):
+        return data
+    if data and all(isinstance(row, dict) for row in data):
+        keys = data[0].keys()
+        if all(row.keys() == keys for row in data):
+            columns = list(keys)
+            rows = [list(row.values()) for row in data]
+            for index in _nested_columns(rows, len(columns)):
+                for row in rows:
+                    row[index] = to_columnar(row[index])
+            return {"columns": columns, "rows": rows}
+    return [to_columnar(value) if isinstance(value, CONTAINERS) else value for value in data]
+
+
+def from_columnar(data):
+    """Inverse of to_columnar()."""
+    if isinstance(data, dict):
+        if data.keys() == {"columns", "rows"}:
+            columns, rows = data["columns"], data["rows"]
+            nested = _nested_columns(rows, len(columns))
+            if nested:
+                rows = [list(row) for row in rows]
+                for index in nested:
+                    for row in rows:
+                        row[index] = from_columnar(row[index])
+            return [dict(zip(columns, row)) for row in rows]
+        return {key: from_columnar(value) if isinstance(value, CONTAINERS) else value
+                for key, value in data.items()}
+    if isinstance(data, list):
+        return [from_columnar(value) if isinstance(value, CONTAINERS) else value
+                for value in data]
+    return data
+
+
+def response_type(offered):
+    """Media type of the response: the best of 'offered' for the client."""
+    if not has_request_context() or len(offered) == 1:
+        return JSON
+    accept = request.accept_mimetypes
+    if not accept.provided:
+        return JSON
+    # JSON is listed first, so "*/*" (e.g. curl) keeps getting JSON.
+    return accept.best_match(offered, default=JSON)
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    """JSON provider answering in the format the client accepts."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        formats = app.config.get("CONTENT_FORMATS", list(FORMATS))
+        self.offered = [JSON] + [
+            media_type for name in formats if name != "json" for media_type in FORMATS[name]
+        ]
+
+    def response(self, *args, **kwargs):
+        media_type = response_type(self.offered)
+        if media_type == JSON:
+            response = super().response(*args, **kwargs)
+        else:
+            response = self.encode(media_type, self._prepare_response_obj(args, kwargs))
+        if len(self.offered) > 1:
+            response.vary.add("Accept")
+        return response
+
+    def encode(self, media_type, obj):
+        if media_type in (COLUMNAR_JSON, COLUMNAR_MSGPACK):
+            obj = to_columnar(obj)
+        if media_type == COLUMNAR_JSON:
+            body = json.dumps(obj, default=self.default, separators=(",", ":"))
+            return self._app.response_class(f"{body}\n", mimetype=COLUMNAR_JSON)
+        body = msgpack.packb(obj, default=self.default)
+        # The MessagePack aliases are answered as "application/msgpack".
+        return self._app.response_class(
+            body, mimetype=COLUMNAR_MSGPACK if media_type == COLUMNAR_MSGPACK else MSGPACK
+        )
+
+
+class Parser(FlaskParser):
+    """webargs parser also reading MessagePack and columnar request bodies."""
+
+    def load_json(self, req, schema):
+        mimetype = req.mimetype
+        if mimetype == JSON or mimetype not in MEDIA_TYPES:
+            return super().load_json(req, schema)
+
+        body = req.get_data(cache=True)
+        if not body:
+            return core.missing
+        try:
+            if mimetype == COLUMNAR_JSON:
+                data = json.loads(body)
+            elif msgpack is None:
+                abort(415, messages={"json": [f"{mimetype} is not supported."]})
+            else:
+                data = msgpack.unpackb(body)
+        except ValueError as error:  # also msgpack's errors and bad UTF-8
+            abort(400, exc=error, messages={"json": ["Invalid request body."]})
+        if mimetype in (COLUMNAR_JSON, COLUMNAR_MSGPACK):
+            data = from_columnar(data)
+        return data
@@ -0,0 +1,150 @@
+"""
+pagination.py
+
+Caps the nested collections in store and tag responses.
+
+GET /store/<id> used to nest every item and tag of the store and GET
+/tag/<id> every item carrying the tag. Now each nested collection holds at
+most '<name>_limit' rows (NESTED_LIMIT by default), in id order, next to
+its total and a link to the following slice:
+
+    {"id": 1, "name": "...",
+     "items": [...50 items...], "items_count": 1234,
+     "items_next": "/store/1?items_after=50&items_limit=50",
+     "tags": [...], "tags_count": 3, "tags_next": null}
+
+'expand=items,tags' returns the full collections instead. Only the returned
+slice is loaded, as plain row records (readpath.py): the collection is
+queried with LIMIT, and the COUNT is skipped when the first slice already
+holds every row. GET /store pages the collections of every store at once
+(NestedPager.pages): one ROW_NUMBER() query per collection loads each
+store's slice, and one grouped COUNT covers the stores with more rows.
+"""
+
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from sqlalchemy import func, select
+
+from db import db
+
+
+class NestedPager:
+    """Pages the nested collections of one request.
+
+    Built in the view, before any fan_out(), since it reads the request.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.expand = set(args.get("expand") or ())
+        self.default_limit = current_app.config.get("NESTED_LIMIT", 50)
+        self.root = request.script_root
+        self.query_args = request.args.to_dict(flat=False)
+
+    def page(self, name, stmt, key, path, record):
+        """Return (rows, count, next link) of one nested collection.
+
+        :param name: Collection name ("items", "tags"), prefix of its args.
+        :param stmt: select() of the columns of the whole collection.
+        :param key: Unique column to order and page by.
+        :param path: Path of the resource the "next" link points to.
+        :param record: Builds a row object (see readpath.py) from the columns.
+        """
+        if name in self.expand:
+            rows = self._rows(stmt.order_by(key), record)
+            return rows, len(rows), None
+
+        limit = self.args.get(f"{name}_limit") or self.default_limit
+        after = self.args.get(f"{name}_after")
+        page = stmt.order_by(key)
+        if after is not None:
+            page = page.where(key > after)
+        rows = self._rows(page.limit(limit + 1), record)
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after is None and not more:
+            count = len(rows)
+        else:
+            count = db.session.scalar(
+                stmt.with_only_columns(func.count(), maintain_column_froms=True)
+            )
+        return rows, count, self.link(path, name, rows[-1].id, limit) if more else None
+
+    def pages(self, name, stmt, parent, key, paths, record):
+        """Like page(), for the collections of many parents at once.
+
+        Returns {parent id: (rows, count, next link)} with a fixed number of
+        queries: rows are numbered per parent (ROW_NUMBER() OVER (PARTITION
+        BY parent ORDER BY key)) and the first limit + 1 of each kept.
+
+        :param stmt: select() of the columns of every parent's collection.
+        :param parent: Column holding the parent id.
+        :param paths: Parent id -> path its "next" link points to; only
+            these parents are returned.
+        """
+        if not paths:
+            return {}
+        found = defaultdict(list)
+
+        if name in self.expand:
+            for *row, owner in db.session.execute(stmt.add_columns(parent).order_by(parent, key)):
+                found[owner].append(record(*row))
+            return {owner: (found[owner], len(found[owner]), None) for owner in paths}
+
+        limit = self.args.get(f"{name}_limit") or self.default_limit
+        after = self.args.get(f"{name}_after")
+        numbered = stmt.add_columns(
+            parent.label("parent"),
+            func.row_number().over(partition_by=parent, order_by=key).label("position"),
+        )
+        if after is not None:
+            numbered = numbered.where(key > after)
+        numbered = numbered.subquery()
+        first = select(numbered).where(numbered.c.position <= limit + 1).order_by(
+            numbered.c.parent, numbered.c.position
+        )
+        for *row, owner, _ in db.session.execute(first):
+            found[owner].append(record(*row))
+
+        counted = [owner for owner in paths if after is not None or len(found[owner]) > limit]
+        counts = {}
+        if counted:
+            counts = dict(db.session.execute(
+                stmt.with_only_columns(parent, func.count(), maintain_column_froms=True)
+                .group_by(parent)
+            ).all())
+
+        result = {}
+        for owner, path in paths.items():
+            rows = found[owner]
+            more = len(rows) > limit
+            rows = rows[:limit]
+            count = counts.get(owner, 0) if owner in counted else len(rows)
+            result[owner] = (rows, count, self.link(path, name, rows[-1].id, limit) if more else None)
+        return result
+
+    @staticmethod
+    def _rows(stmt, record):
+        return [record(*row) for row in db.session.execute(stmt)]
+
+    def page_rows(self, name, rows, path):
+        """Like page(), for a collection already in memory: dicts in id
+        order (e.g. a store's tags from the catalogue snapshot)."""
+        if name in self.expand:
+            return rows, len(rows), None
+
+        limit = self.args.get(f"{name}_limit") or self.default_limit
+        after = self.args.get(f"{name}_after")
+        rest = rows if after is None else [row for row in rows if row["id"] > after]
+        page = rest[:limit]
+        more = len(rest) > limit
+        return page, len(rows), self.link(path, name, page[-1]["id"], limit) if more else None
+
+    def link(self, path, name, after, limit):
+        args = dict(self.query_args)
+        args[f"{name}_after"] = [after]
+        args[f"{name}_limit"] = [limit]
+        return f"{self.root}{path}?{urlencode(args, doseq=True)}"
@@ -0,0 +1,250 @@
+"""
+profiler.py
+
+On-demand profiling of single requests (PROFILER_ENABLED).
+
+When one endpoint regresses, profile a few of its requests in production
+and look at where the time goes: JWT checks, SQL, marshmallow, JSON. A
+request is profiled when:
+
+    - it carries 'X-Profile: 1' and an admin's access token (see
+      ADMIN_USER_IDS), or
+    - it is picked by sampling: one request in PROFILER_SAMPLE_RATE
+      (0 = only on request).
+
+The profile covers the request from the first before_request hook to the
+last after_request hook (compression included). Its id is returned in the
+'X-Profile-Id' response header. Profiles are kept in PROFILER_PATH, a ring
+of the last PROFILER_RING_SIZE profiles shared by the worker processes, and
+listed by GET /profiles (admins only).
+
+Modes (PROFILER_MODE):
+
+    - "sample": a thread samples the request thread's stack every
+      PROFILER_INTERVAL seconds. Saved as folded stacks ("a;b;c 12" per
+      line), the input of flamegraph.pl and speedscope. Low overhead, so
+      also fine for sampling.
+    - "cprofile": deterministic cProfile of the request thread, saved as a
+      .pstats file for pstats/snakeviz. Exact call counts, but slows the
+      profiled request down considerably.
+
+With PROFILER_ENABLED off no hook is installed at all. When on, a request
+that isn't profiled costs a counter increment and a header lookup.
+"""
+
+import cProfile
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_jwt_extended import verify_jwt_in_request
+
+from tokens import is_admin
+
+
+PROFILE_ID = re.compile(r"^[0-9T]+-[0-9a-f]{8}$")
+EXTENSIONS = {"sample": "folded", "cprofile": "pstats"}
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # "outer;...;inner" -> samples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                             f"{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def save(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class CProfiler:
+    """cProfile of the current thread."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def samples(self):
+        return None
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class Profiler:
+    """Flask extension profiling selected requests into an on-disk ring."""
+
+    def __init__(self, app=None):
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PROFILER_ENABLED", False)
+        app.config.setdefault("PROFILER_SAMPLE_RATE", 0)
+        app.config.setdefault("PROFILER_MODE", "sample")
+        app.config.setdefault("PROFILER_INTERVAL", 0.001)
+        app.config.setdefault("PROFILER_RING_SIZE", 100)
+        app.config.setdefault("PROFILER_PATH", os.path.join(app.instance_path, "profiles"))
+
+        self.enabled = app.config["PROFILER_ENABLED"]
+        self.sample_rate = app.config["PROFILER_SAMPLE_RATE"]
+        self.mode = app.config["PROFILER_MODE"]
+        self.interval = app.config["PROFILER_INTERVAL"]
+        self.ring_size = app.config["PROFILER_RING_SIZE"]
+        self.path = app.config["PROFILER_PATH"]
+        app.extensions["profiler"] = self
+        if not self.enabled:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        # First before_request hook and, since they run in reverse, last
+        # after_request hook: the profile covers the other hooks too.
+        app.before_request_funcs.setdefault(None, []).insert(0, self.start)
+        app.after_request_funcs.setdefault(None, []).insert(0, self.stop)
+        app.teardown_request(self.discard)
+
+    # ------------------------------ hooks ----------------------------------- #
+
+    def wanted(self):
+        """Should this request be profiled? Returns the trigger or None."""
+        if request.headers.get("X-Profile"):
+            try:
+                verify_jwt_in_request(optional=True)
+                if is_admin():
+                    return "header"
+            except Exception:
+                pass  # bad token: the view reports it, we just don't profile
+        if self.sample_rate and next(self._counter) % self.sample_rate == 0:
+            return "sample"
+        return None
+
+    def start(self):
+        trigger = self.wanted()
+        if trigger is None:
+            return
+        if self.mode == "cprofile":
+            profile = CProfiler()
+        else:
+            profile = StackSampler(threading.get_ident(), self.interval)
+        g.profile = (profile, trigger, time.perf_counter())
+        profile.start()
+
+    def stop(self, response):
+        running = g.pop("profile", None)
+        if running is None:
+            return response
+        profile, trigger, started = running
+        profile.stop()
+        duration = time.perf_counter() - started
+        try:
+            response.headers["X-Profile-Id"] = self.save(profile, trigger, duration, response)
+        except OSError:
+            current_app.logger.exception("Could not save profile.")
+        return response
+
+    def discard(self, error=None):
+        running = g.pop("profile", None)
+        if running is not None:  # the request failed before after_request
+            running[0].stop()
+
+    # ------------------------------ the ring -------------------------------- #
+
+    def save(self, profile, trigger, duration, response):
+        profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        extension = EXTENSIONS[self.mode]
+        profile.save(os.path.join(self.path, f"{profile_id}.{extension}"))
+        meta = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "mode": self.mode,
+            "format": extension,
+            "trigger": trigger,
+            "samples": profile.samples(),
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        with open(os.path.join(self.path, f"{profile_id}.json"), "w") as f:
+            json.dump(meta, f)
+        self.prune()
+        return profile_id
+
+    def prune(self):
+        """Drop the oldest profiles beyond PROFILER_RING_SIZE."""
+        with self._lock:
+            ids = sorted(name[:-5] for name in os.listdir(self.path) if name.endswith(".json"))
+            for profile_id in ids[: max(len(ids) - self.ring_size, 0)]:
+                for extension in ("json", *EXTENSIONS.values()):
+                    try:
+                        os.remove(os.path.join(self.path, f"{profile_id}.{extension}"))
+                    except FileNotFoundError:
+                        pass
+
+    def list(self, limit=None):
+        """Metadata of the saved profiles, newest first."""
+        profiles = []
+        for name in sorted(os.listdir(self.path), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned or being written by another worker
+            if limit and len(profiles) >= limit:
+                break
+        return profiles
+
+    def file(self, profile_id):
+        """(directory, file name) of a saved profile, or None."""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        for extension in EXTENSIONS.values():
+            name = f"{profile_id}.{extension}"
+            if os.path.exists(os.path.join(self.path, name)):
+                return self.path, name
+        return None
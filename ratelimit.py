@@ -0,0 +1,236 @@
+"""
+ratelimit.py
+
+Per-client, per-endpoint token-bucket rate limiting.
+
+A client is identified by the JWT 'sub' when the request carries a valid
+token, otherwise by its IP address (request.remote_addr). The token goes
+through the verified claims cache of tokens.py, so it is decoded at most
+once per request. Behind a reverse proxy every anonymous client has the
+proxy's address: set PROXY_FIX_X_FOR (app.py, werkzeug's ProxyFix) to the
+number of proxies so remote_addr is the client's. Each (client, endpoint)
+pair has its own bucket. Limits are written as "<count>/<period>" (e.g. "100/minute"): the
+bucket holds up to <count> tokens and refills at <count> per <period>.
+
+Two backends:
+
+    - "memory": a dict guarded by a lock. Only correct with one process.
+    - "shared": a fixed-size hash table in a memory-mapped file, locked with
+      lockf, so every gunicorn worker on the host shares the same buckets.
+
+Requests over the limit get a 429 with a Retry-After header.
+
+Config (app.config):
+
+    RATELIMIT_ENABLED        -> turn the limiter on (off by default).
+    RATELIMIT_DEFAULT        -> limit for endpoints without their own limit
+                                (None = unlimited).
+    RATELIMIT_ENDPOINTS      -> {"stores.StoreList": "10/minute",
+                                 "GET stores.Store": "5/second", ...}
+    RATELIMIT_BACKEND        -> "memory" or "shared".
+    RATELIMIT_SHARED_PATH    -> file backing the shared table.
+    RATELIMIT_SHARED_SLOTS   -> number of buckets in the shared table.
+"""
+
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from flask import current_app, jsonify, request
+
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_limit(spec):
+    """Parse "<count>/<period>" into (capacity, refill rate per second).
+
+    Raises ValueError unless the count and the period are positive.
+    """
+    if spec is None:
+        return None
+    count, _, period = spec.partition("/")
+    count = int(count)
+    period = period.strip().rstrip("s") or "second"
+    seconds = PERIODS[period] if period in PERIODS else float(period)
+    if count <= 0 or not seconds > 0:
+        raise ValueError(f"Rate limit {spec!r}: count and period must be positive.")
+    return count, count / seconds
+
+
+class MemoryBackend:
+    """Token buckets held in this process only.
+
+    At most 'max_keys' buckets are kept; the oldest-created bucket is dropped
+    first, which simply gives that client a full bucket again.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Take one token. Returns 0 if allowed, else seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+
+class SharedBackend:
+    """Token buckets in a memory-mapped file shared by all local workers.
+
+    The file is an open-addressing hash table of fixed-size slots:
+    (key hash, tokens, last refill). A full probe window evicts the slot
+    that was refilled longest ago, which just resets that client's bucket.
+    """
+
+    SLOT = struct.Struct("Qdd")
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        size = self.SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._thread_lock = threading.Lock()  # lockf doesn't lock between threads
+
+    def take(self, key, capacity, rate):
+        raw = key.encode()
+        digest = (zlib.crc32(raw) << 32 | zlib.adler32(raw)) or 1  # 0 = empty slot
+        start = digest % self.slots
+        now = time.monotonic()
+        slot_size, unpack, pack = self.SLOT.size, self.SLOT.unpack_from, self.SLOT.pack_into
+
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                target, oldest = None, None
+                for probe in range(self.PROBES):
+                    offset = (start + probe) % self.slots * slot_size
+                    slot_key, tokens, last = unpack(self._map, offset)
+                    if slot_key == digest:
+                        target = offset
+                        tokens = min(capacity, tokens + (now - last) * rate)
+                        break
+                    if slot_key == 0:
+                        target, tokens = offset, capacity
+                        break
+                    if oldest is None or last < oldest[1]:
+                        oldest = (offset, last)
+                else:
+                    target, tokens = oldest[0], capacity
+
+                if tokens >= 1:
+                    pack(self._map, target, digest, tokens - 1, now)
+                    return 0
+                pack(self._map, target, digest, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return (1 - tokens) / rate
+
+
+class RateLimiter:
+    """Flask extension checking the token bucket before every request."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", False)
+        app.config.setdefault("RATELIMIT_DEFAULT", None)
+        app.config.setdefault("RATELIMIT_ENDPOINTS", {})
+        app.config.setdefault("RATELIMIT_BACKEND", "memory")
+        app.config.setdefault("RATELIMIT_SHARED_PATH",
+                              os.path.join(app.instance_path, "ratelimit.bin"))
+        app.config.setdefault("RATELIMIT_SHARED_SLOTS", 65536)
+
+        if not app.config["RATELIMIT_ENABLED"]:
+            return
+
+        if app.config["RATELIMIT_BACKEND"] == "shared":
+            os.makedirs(os.path.dirname(app.config["RATELIMIT_SHARED_PATH"]), exist_ok=True)
+            self.backend = SharedBackend(app.config["RATELIMIT_SHARED_PATH"],
+                                         app.config["RATELIMIT_SHARED_SLOTS"])
+        else:
+            self.backend = MemoryBackend()
+
+        self._default = parse_limit(app.config["RATELIMIT_DEFAULT"])
+        self._configured = {
+            name: parse_limit(spec)
+            for name, spec in app.config["RATELIMIT_ENDPOINTS"].items()
+        }
+        app.extensions["ratelimit"] = self
+        app.before_request(self.check)
+
+    def limit_for(self, method, endpoint):
+        """Return (capacity, rate) for a method/endpoint, cached per pair."""
+        try:
+            return self._limits[method, endpoint]
+        except KeyError:
+            pass
+        if endpoint is None or endpoint.startswith("api-docs."):
+            limit = None  # 404s and the swagger-ui / openapi.json pages
+        else:
+            limit = self._configured.get(
+                f"{method} {endpoint}", self._configured.get(endpoint, self._default)
+            )
+        self._limits[method, endpoint] = limit
+        return limit
+
+    @staticmethod
+    def identity():
+        """JWT 'sub' if the request has a valid token, otherwise the client IP."""
+        header = request.headers.get("Authorization")
+        if header:
+            manager = current_app.extensions.get("flask-jwt-extended")
+            verified = getattr(manager, "verified_claims", None)
+            claims = verified(header.partition(" ")[2]) if verified else None
+            if claims is not None and claims.get("sub") is not None:
+                return f"user:{claims['sub']}"
+        return f"ip:{request.remote_addr}"
+
+    def check(self):
+        limit = self.limit_for(request.method, request.endpoint)
+        if limit is None:
+            return None
+
+        capacity, rate = limit
+        key = f"{self.identity()}|{request.method} {request.endpoint}"
+        wait = self.backend.take(key, capacity, rate)
+        if not wait:
+            return None
+
+        response = jsonify(
+            {
+                "code": 429,
+                "status": "Too Many Requests",
+                "message": "Rate limit exceeded. Try again later.",
+            }
+        )
+        response.status_code = 429
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response
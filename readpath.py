@@ -0,0 +1,205 @@
+"""
+readpath.py
+
+ORM-free reads for the list and detail GETs.
+
+Dumping ItemModel instances means building, per row, an instance with its
+__dict__, an InstanceState for change tracking and an identity map entry,
+then loading 'store' and 'tags' one item at a time, only for the schema to
+read a few attributes once. Here the GETs select just the columns the
+schemas dump and wrap each row in a small __slots__ record:
+
+    PlainItemRow  id, name, price, description   (items nested in stores/tags)
+    ItemRow       + store_id, store, tags        (ItemSchema)
+    ArchivedItemRow + deleted_at, archived_at    (?include_archived=true)
+    TagRow        id, name                       (PlainTagSchema)
+
+    rows = item_rows(items_in_price_range(min_cents, max_cents))
+
+Only live items are read (LIVE: 'deleted_at' IS NULL). archived_item_rows()
+reads the soft-deleted ones and those 'flask archive' moved to the archive
+tables (archive.py), for the GETs asked to include them.
+
+A list of items costs one query for the items and one per
+TAG_CHUNK_SIZE items for their tags. Tags and stores are shared between
+the rows that have them. Stores come from the catalogue snapshot
+(snapshot.py), with one more query for the ones it misses.
+
+The records are plain read-only values, not attached to any session: use
+the models or writepath.py to write. Compare both paths with
+'python -m benchmarks.bench_read_path'.
+"""
+
+from sqlalchemy import null, select
+
+from db import db
+from models import ItemArchiveModel, ItemModel, ItemTags, ItemTagsArchive, StoreModel, TagModel
+from snapshot import current
+
+
+# Columns read for ItemRow / PlainItemRow / TagRow, in their constructor's
+# order.
+ITEM_COLUMNS = (ItemModel.id, ItemModel.name, ItemModel.price_cents,
+                ItemModel.description, ItemModel.store_id)
+PLAIN_ITEM_COLUMNS = ITEM_COLUMNS[:4]
+TAG_COLUMNS = (TagModel.id, TagModel.name)
+
+# Items that are not soft-deleted.
+LIVE = ItemModel.deleted_at.is_(None)
+
+# Item ids per query loading the tags of a list of items.
+TAG_CHUNK_SIZE = 500
+
+
+class PlainItemRow:
+    """An item as PlainItemSchema dumps it."""
+
+    __slots__ = ("id", "name", "price", "description")
+
+    def __init__(self, id, name, price_cents, description):
+        self.id = id
+        self.name = name
+        self.price = price_cents / 100
+        self.description = description
+
+
+class ItemRow:
+    """An item as ItemSchema dumps it, with its store and tags."""
+
+    __slots__ = ("id", "name", "price", "description", "store_id", "store", "tags")
+
+    def __init__(self, id, name, price_cents, description, store_id):
+        self.id = id
+        self.name = name
+        self.price = price_cents / 100
+        self.description = description
+        self.store_id = store_id
+        self.store = None
+        self.tags = ()
+
+
+class ArchivedItemRow(ItemRow):
+    """A soft-deleted or archived item, with when that happened."""
+
+    __slots__ = ("deleted_at", "archived_at")
+
+    def __init__(self, id, name, price_cents, description, store_id, deleted_at, archived_at):
+        super().__init__(id, name, price_cents, description, store_id)
+        self.deleted_at = deleted_at
+        self.archived_at = archived_at
+
+
+class TagRow:
+    """A tag as PlainTagSchema dumps it."""
+
+    __slots__ = ("id", "name")
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+def item_rows(stmt):
+    """ItemRows, with their stores and tags, of a select of ITEM_COLUMNS."""
+    return attach([ItemRow(*row) for row in db.session.execute(stmt)])
+
+
+def item_row(item_id):
+    """The ItemRow of one live item, or None."""
+    rows = item_rows(select(*ITEM_COLUMNS).where(ItemModel.id == item_id, LIVE))
+    return rows[0] if rows else None
+
+
+def archived_item_rows(item_id=None, min_cents=None, max_cents=None):
+    """ArchivedItemRows of the soft-deleted and the archived items, in id
+    order, optionally of one id or an inclusive price range."""
+    archive = ItemArchiveModel
+    deleted = select(*ITEM_COLUMNS, ItemModel.deleted_at, null()).where(~LIVE)
+    archived = select(archive.id, archive.name, archive.price_cents, archive.description,
+                      archive.store_id, archive.deleted_at, archive.archived_at)
+    rows = {}
+    for model, stmt in ((ItemModel, deleted), (archive, archived)):
+        if item_id is not None:
+            stmt = stmt.where(model.id == item_id)
+        if min_cents is not None:
+            stmt = stmt.where(model.price_cents >= min_cents)
+        if max_cents is not None:
+            stmt = stmt.where(model.price_cents <= max_cents)
+        found = [ArchivedItemRow(*row) for row in db.session.execute(stmt)]
+        # Soft-deleted items keep their links in items_tags until archived.
+        _attach_tags(found, ItemTags if model is ItemModel else ItemTagsArchive)
+        rows.update((row.id, row) for row in found)
+    rows = [rows[ident] for ident in sorted(rows)]
+    if rows:
+        _attach_stores(rows)
+    return rows
+
+
+def archived_item_row(item_id):
+    """The ArchivedItemRow of one soft-deleted or archived item, or None."""
+    if not str(item_id).isdigit():
+        return None
+    rows = archived_item_rows(item_id=int(item_id))
+    return rows[0] if rows else None
+
+
+def tag_row(tag_id):
+    """(id, name, store_id) of one tag, or None."""
+    return db.session.execute(
+        select(TagModel.id, TagModel.name, TagModel.store_id).where(TagModel.id == tag_id)
+    ).first()
+
+
+def attach(rows):
+    """Load the tags, and the stores missing from the snapshot, of ItemRows
+    built from other statements (e.g. a RETURNING, see writepath.py)."""
+    if rows:
+        _attach_tags(rows)
+        _attach_stores(rows)
+    return rows
+
+
+def _attach_tags(rows, links=ItemTags):
+    """Set 'tags' on the rows from 'links' (ItemTags, or ItemTagsArchive
+    for archived items)."""
+    by_id = {row.id: row for row in rows}
+    ids = list(by_id)
+    tags = {}  # tag id -> TagRow, shared by the items carrying it
+    for start in range(0, len(ids), TAG_CHUNK_SIZE):
+        found = db.session.execute(
+            select(links.item_id, TagModel.id, TagModel.name)
+            .join(TagModel, TagModel.id == links.tag_id)
+            .where(links.item_id.in_(ids[start:start + TAG_CHUNK_SIZE]))
+            .order_by(links.item_id, TagModel.id)
+        )
+        for item_id, tag_id, tag_name in found:
+            tag = tags.get(tag_id)
+            if tag is None:
+                tag = tags[tag_id] = TagRow(tag_id, tag_name)
+            row = by_id[item_id]
+            if row.tags:
+                row.tags.append(tag)
+            else:
+                row.tags = [tag]
+
+
+def _attach_stores(rows):
+    """Set 'store' on the rows whose store isn't in the snapshot.
+
+    Rows found in the snapshot are left alone: schemas.CatalogueStore
+    renders their store from it.
+    """
+    snapshot = current()
+    missing = {row.store_id for row in rows}
+    if snapshot is not None:
+        missing = {store_id for store_id in missing if not snapshot.has_store(store_id)}
+    if not missing:
+        return
+    stores = {
+        store_id: {"id": store_id, "name": name}
+        for store_id, name in db.session.execute(
+            select(StoreModel.id, StoreModel.name).where(StoreModel.id.in_(missing))
+        )
+    }
+    for row in rows:
+        row.store = stores.get(row.store_id)
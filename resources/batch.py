@@ -0,0 +1,211 @@
+import json
+import re
+
+from flask import current_app, g, request
+from flask.views import MethodView
+from flask_smorest import abort
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError
+
+from db import db
+from schemas import BatchResultSchema, BatchSchema
+from sharding import is_enabled as sharding_enabled
+from tracing import Blueprint, span
+
+
+blp = Blueprint("Batch", "batch", description="Several requests in one round trip")
+
+# Blueprints whose routes can be part of a batch, and exceptions.
+BATCHABLE = {"Items", "stores", "Tags"}
+NOT_BATCHABLE = {"stores.StoreEvents"}
+
+# "{store.id}": field 'id' of the response to the request named "store".
+REFERENCE = re.compile(r"\{(\w+)((?:\.\w+)+)\}")
+
+
+class Unresolved(Exception):
+    """A reference to a request that failed or to a missing field."""
+
+
+def references(value):
+    """Names referred to in a path or body."""
+    if isinstance(value, dict):
+        return {name for item in value.values() for name in references(item)}
+    if isinstance(value, list):
+        return {name for item in value for name in references(item)}
+    if isinstance(value, str):
+        return {match.group(1) for match in REFERENCE.finditer(value)}
+    return set()
+
+
+def _lookup(match, results):
+    value = results[match.group(1)]
+    if value is None:
+        raise Unresolved(f"Request '{match.group(1)}' failed.")
+    for key in match.group(2)[1:].split("."):
+        if not isinstance(value, dict) or key not in value:
+            raise Unresolved(f"{match.group(0)} is not in the response.")
+        value = value[key]
+    return value
+
+
+def resolve(value, results):
+    """Replace the references to earlier responses in a path or body.
+
+    A string that is only a reference becomes the referenced value with its
+    type (e.g. an integer id); references inside longer strings are
+    formatted in. Names that aren't requests of the batch are left alone.
+    """
+    if isinstance(value, dict):
+        return {key: resolve(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, results) for item in value]
+    if not isinstance(value, str):
+        return value
+    match = REFERENCE.fullmatch(value)
+    if match and match.group(1) in results:
+        return _lookup(match, results)
+    return REFERENCE.sub(
+        lambda m: str(_lookup(m, results)) if m.group(1) in results else m.group(0), value
+    )
+
+
+def check_references(requests):
+    """Reject duplicate names and references to later requests (422)."""
+    names = [sub["id"] for sub in requests if "id" in sub]
+    if len(names) != len(set(names)):
+        abort(422, message="Request ids must be unique within a batch.")
+    seen = set()
+    for index, sub in enumerate(requests):
+        ahead = (references(sub["path"]) | references(sub.get("body"))) & set(names) - seen
+        if ahead:
+            abort(422, message=f"Request {index} refers to later request(s): "
+                               f"{', '.join(sorted(ahead))}.")
+        if "id" in sub:
+            seen.add(sub["id"])
+
+
+def dispatch(method, path, body, headers):
+    """Run one request of the batch in-process. Returns (status, body).
+
+    The URL is routed and the view called like for a real request, but
+    only the rate limit of the before_request hooks applies, and 'g' is
+    emptied for the sub-request so it can't see or end the batch's own
+    profile or trace.
+    """
+    app = current_app._get_current_object()
+    state = vars(g._get_current_object())
+    saved = dict(state)
+    state.clear()
+    try:
+        with app.test_request_context(
+            path,
+            base_url=request.url_root,
+            method=method,
+            headers=headers,
+            data=None if body is None else json.dumps(body),
+            content_type="application/json",
+            environ_base={"REMOTE_ADDR": request.remote_addr},
+        ):
+            try:
+                limiter = app.extensions.get("ratelimit")
+                rv = limiter.check() if limiter is not None else None
+                if rv is None:
+                    if request.routing_exception is None and (
+                        request.blueprint not in BATCHABLE or request.endpoint in NOT_BATCHABLE
+                    ):
+                        abort(400, message=f"{method} {request.path} can't be part of a batch.")
+                    rv = app.dispatch_request()
+            except Exception as error:
+                try:
+                    # HTTP errors and the app's error handlers (JWT, StoreMoving).
+                    rv = app.handle_user_exception(error)
+                except Exception:
+                    app.log_exception(error)
+                    rv = app.handle_user_exception(InternalServerError(original_exception=error))
+            response = app.make_response(rv)
+            return response.status_code, response.get_json(silent=True)
+    finally:
+        state.clear()
+        state.update(saved)
+
+
+@blp.route("/batch")
+class Batch(MethodView):
+    @blp.arguments(BatchSchema)
+    @blp.response(200, BatchResultSchema)
+    @blp.alt_response(400, schema=BatchResultSchema,
+                      description="An atomic batch failed and was rolled back.")
+    def post(self, batch):
+        """Run several requests:
+
+        Runs the requests in order, in this process, and returns their
+        responses ('status' and 'body', under their 'id'). Only the item,
+        store and tag routes can be batched. The caller's Authorization
+        header is used for every request.
+
+        A later request can use the result of an earlier one: with
+        {"id": "store", ...} creating a store, "{store.id}" in a later path
+        or body is its id. A request referring to a failed one is answered
+        424 without running.
+
+        By default each request commits on its own and the batch goes on
+        after a failure. With "atomic": true the writes share one
+        transaction: the first failure stops the batch and rolls everything
+        back, 'committed' is false and the response has that request's
+        status. Atomic batches don't support sharded databases.
+
+        :param batch: 'requests' to run and the 'atomic' flag.
+        :return: One response per request run, and whether they committed.
+        """
+        requests = batch["requests"]
+        if len(requests) > current_app.config["BATCH_MAX_REQUESTS"]:
+            abort(400, message=f"At most {current_app.config['BATCH_MAX_REQUESTS']} "
+                               f"requests per batch.")
+        atomic = batch["atomic"]
+        if atomic and sharding_enabled():
+            abort(501, message="Atomic batches do not support sharded databases yet.")
+        check_references(requests)
+
+        headers = {"Accept": "application/json"}
+        if "Authorization" in request.headers:
+            headers["Authorization"] = request.headers["Authorization"]
+
+        results = {}  # request id -> response body, None if it failed
+        responses = []
+        failed = None
+        db.session.info["hold_commits"] = atomic
+        try:
+            for sub in requests:
+                try:
+                    path = resolve(sub["path"], results)
+                    body = resolve(sub.get("body"), results)
+                except Unresolved as error:
+                    status, body = 424, {"code": 424, "status": "Failed Dependency",
+                                         "message": str(error)}
+                else:
+                    with span("batch.request", method=sub["method"], path=path):
+                        status, body = dispatch(sub["method"], path, body,
+                                                {**headers, **sub.get("headers", {})})
+                    if not atomic:
+                        db.session.close()  # like the end of a request
+                responses.append({"id": sub.get("id"), "status": status, "body": body})
+                if "id" in sub:
+                    results[sub["id"]] = body if status < 400 else None
+                if atomic and status >= 400:
+                    failed = status
+                    break
+        finally:
+            db.session.info.pop("hold_commits", None)
+
+        if not atomic:
+            return {"committed": True, "responses": responses}
+        if failed is not None:
+            db.session.rollback()
+            return {"committed": False, "responses": responses}, failed
+        try:
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(500, message="An error occurred committing the batch.")
+        return {"committed": True, "responses": responses}
@@ -0,0 +1,85 @@
+import io
+import os
+import shutil
+import uuid
+
+from flask import current_app, request
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import SQLAlchemyError
+
+from importer import CatalogueImporter, guess_format, read_rows
+from jobs import accepted, enqueue, respond_async
+from schemas import ImportArgsSchema, ImportReportSchema, JobSchema
+from sharding import is_enabled as sharding_enabled
+
+
+blp = Blueprint("Catalogue", "catalogue", description="Bulk catalogue operations")
+
+
+@blp.route("/import")
+class CatalogueImport(MethodView):
+    @jwt_required(fresh=True)
+    @blp.arguments(ImportArgsSchema, location="query")
+    @blp.response(200, ImportReportSchema)
+    @blp.alt_response(202, schema=JobSchema, description="Import queued as a job.")
+    def post(self, args):
+        """Import a CSV/NDJSON catalogue:
+
+        The file is sent either as multipart form data (field 'file') or as the
+        raw request body, and is parsed as a stream. Rows are validated and
+        written in batches of 'batch_size'; each batch is committed on its own.
+
+        If the import fails part way, the error message contains the 'offset'
+        of the last committed row. Sending the same file again with that
+        '?offset=' resumes the import without duplicating rows.
+
+        With 'Prefer: respond-async' the file is saved to JOBS_UPLOAD_DIR and
+        imported by a background job instead: the response is a 202 with the
+        job, whose 'result' is the import report once it is done.
+
+        :param args: format, batch_size and offset query parameters.
+        :return: Import report (rows/sec, rejected rows, resume offset), or the job.
+        """
+        if sharding_enabled():
+            abort(501, message="Catalogue import does not support sharded databases yet.")
+
+        upload = request.files.get("file")
+        if upload:
+            stream, filename = upload.stream, upload.filename
+        else:
+            stream, filename = request.stream, None
+
+        fmt = args.get("format") or (
+            "ndjson" if "ndjson" in (request.mimetype or "") else guess_format(filename)
+        )
+
+        if respond_async():
+            upload_dir = current_app.config["JOBS_UPLOAD_DIR"]
+            os.makedirs(upload_dir, exist_ok=True)
+            path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.{fmt}")
+            with open(path, "wb") as f:
+                shutil.copyfileobj(stream, f)
+            return accepted(enqueue("catalogue.import", path=path, fmt=fmt,
+                                    batch_size=args["batch_size"], offset=args["offset"]))
+
+        text_stream = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+        importer = CatalogueImporter(batch_size=args["batch_size"])
+        committed = {"offset": args["offset"]}
+
+        def checkpoint(offset):
+            committed["offset"] = offset
+
+        try:
+            report = importer.run(read_rows(text_stream, fmt),
+                                  offset=args["offset"], checkpoint=checkpoint)
+        except SQLAlchemyError:
+            abort(
+                500,
+                message="An error occurred while importing the catalogue.",
+                errors={"offset": committed["offset"]},
+            )
+
+        return report.to_dict()
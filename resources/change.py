@@ -0,0 +1,44 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+
+from changefeed import format_cursor, parse_cursor, wait_for_changes
+from schemas import ChangeFeedSchema, ChangeQuerySchema
+
+
+blp = Blueprint("Changes", "changes", description="Change feed for incremental sync")
+
+
+@blp.route("/changes")
+class ChangeFeed(MethodView):
+    @blp.arguments(ChangeQuerySchema, location="query")
+    @blp.response(200, ChangeFeedSchema)
+    def get(self, args):
+        """Get changes since a cursor:
+
+        Returns the item, store, tag and item-tag changes committed after
+        'since', oldest first, and the cursor to pass as 'since' next time.
+        Mirrors do one full download, then keep calling this endpoint, so
+        the work per sync is proportional to the number of changes.
+
+        With 'wait' the request is held open (long-poll) until a change
+        arrives or 'wait' seconds pass.
+
+        :param args: since, limit, store_id and wait query parameters.
+        :return: The changes, the next cursor and whether more are pending.
+        """
+        try:
+            positions = parse_cursor(args.get("since"))
+        except ValueError:
+            abort(400, message="Invalid cursor.")
+
+        changes, positions = wait_for_changes(
+            positions,
+            limit=args["limit"],
+            store_id=args.get("store_id"),
+            wait=args["wait"],
+        )
+        return {
+            "changes": changes,
+            "cursor": format_cursor(positions),
+            "has_more": len(changes) == args["limit"],
+        }
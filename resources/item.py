@@ -1,13 +1,29 @@
 # Library and package imports
+from flask import current_app
 from flask.views import MethodView
-from flask_smorest import Blueprint, abort
+from flask_smorest import abort
 from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import SQLAlchemyError
 
 # Local imports
-from db import db
-from models import ItemModel, StoreModel
-from schemas import ItemSchema, ItemUpdateSchema
+from db import commits_held, db
+from groupcommit import CommitInDoubt
+from models import ItemModel
+from models.item import to_cents
+from readpath import archived_item_row, archived_item_rows, item_row, item_rows
+from schemas import (
+    ArchiveArgsSchema,
+    ArchivedItemSchema,
+    ItemQuerySchema,
+    ItemSchema,
+    ItemUpdateSchema,
+)
+from sharding import fan_out, find_sharded, get_sharded_or_404, use_store
+from singleflight import coalesce
+from snapshot import find_store, missing_store
+from statements import items_in_price_range
+from tracing import Blueprint
+from writepath import create_item, delete_item, update_item, upsert_item
 
 
 blp = Blueprint("Items", __name__, description="Operations on items")
@@ -21,19 +37,27 @@ class Item(MethodView):
     and updating items in an existing store.
     """
 
-    @blp.response(200, ItemSchema)
-    def get(self, item_id):
+    @coalesce
+    @blp.arguments(ArchiveArgsSchema, location="query")
+    @blp.response(200, ArchivedItemSchema)
+    def get(self, args, item_id):
         """Get item by ID:
 
-        Retrieves item from the database using the item's primary key.
-        If the item doesn't exist, returns a 404 Not Found error automatically
-        using 'query.get_or_404()' from SQLAlchemy. Don't need to check if
-        item exists or not as SQLAlchemy does it for us.
+        Retrieves item from the database using the item's primary key, as a
+        read-only row record (see readpath.py). If the item doesn't exist,
+        returns a 404 Not Found error. Deleted and archived items are only
+        returned with 'include_archived=true', with their 'deleted_at' and
+        'archived_at'.
 
+        :param args: 'include_archived' from the query string.
         :param item_id: The ID of the item to retrieve.
         :return: The item identified by 'item_id' or a 404 error if it does not exist.
         """
-        item = ItemModel.query.get_or_404(item_id)
+        load = item_row
+        if args["include_archived"]:
+            def load(ident):
+                return item_row(ident) or archived_item_row(ident)
+        item = get_sharded_or_404(ItemModel, item_id, load=load)
         return item
 
     @jwt_required(fresh=True)  # fresh access token needed
@@ -42,15 +66,21 @@ class Item(MethodView):
 
         Method handles the HTTP DELETE request for a specific item
         identified by its 'item_id'.
-        It deletes the item from the database and returns a success message.
-        If the item does not exist, it returns a 404 error.
+        It soft-deletes the item (sets its 'deleted_at', see writepath.py)
+        and returns a success message; 'flask archive' moves it out of the
+        items table later. If the item does not exist, it returns a 404 error.
 
         :param item_id: The ID of the item to delete.
         :return: A success message or a 404 error if the item does not exist.
         """
-        item = ItemModel.query.get_or_404(item_id)
-        db.session.delete(item)
-        db.session.commit()
+        try:
+            deleted = find_sharded(ItemModel, item_id, load=delete_item)
+            if deleted is not None:
+                db.session.commit()
+        except SQLAlchemyError:
+            abort(500, message="An error occurred while deleting the item.")
+        if deleted is None:
+            abort(404)
         return {"message": "Item deleted."}
 
     @jwt_required(fresh=True)  # fresh access token needed
@@ -67,21 +97,49 @@ class Item(MethodView):
         matter how many times it is repeated. In other words, multiple identical
         requests will have the same effect as a single request.
 
+        With ITEM_GROUP_COMMIT on, updates of existing items are batched with
+        other concurrent updates into one commit (see groupcommit.py) and
+        answered once that commit has landed. If it is still queued after
+        GROUP_COMMIT_TIMEOUT, it is withdrawn and the 503 says it was not
+        applied; if its commit is still running, the 503 says to check. Not
+        inside an atomic POST /batch, whose writes must share its
+        transaction.
+
+        Otherwise the item is written with one UPDATE ... RETURNING, or for
+        a new id created with one upsert, and returned from that row (see
+        writepath.py). Creating needs 'name', 'price' and 'store_id'.
+
         :param item_data: The new data for the item.
         :param item_id: The ID of the item to update.
         :return: The updated item or a new item if it did not exist.
         """
-        item = ItemModel.query.get(item_id)
-
-        if item:
-            item.price = item_data["price"]
-            item.name = item_data["name"]
-            item.description = item_data["description"]
-        else:
-            item = ItemModel(id=item_id, **item_data)
+        group_commit = current_app.extensions.get("group_commit")
+        if group_commit is not None and group_commit.enabled and not commits_held():
+            try:
+                item = group_commit.update(item_id, item_data)
+            except CommitInDoubt:
+                abort(503, message="The update may not have been applied. "
+                                   "Read the item to check before trying again.")
+            except TimeoutError:
+                abort(503, message="The update was not applied in time. Try again.")
+            except SQLAlchemyError:
+                abort(500, message="An error occurred while updating the item.")
+            if item is not None:
+                return item
 
-        db.session.add(item)
-        db.session.commit()
+        try:
+            item = find_sharded(ItemModel, item_id,
+                                load=lambda ident: update_item(ident, item_data))
+            if item is None:
+                if not item_id.isdigit():
+                    abort(400, message="Item ids are integers.")
+                if not {"name", "price", "store_id"} <= item_data.keys():
+                    abort(400, message="Creating an item needs its name, price and store_id.")
+                use_store(item_data["store_id"])
+                item = upsert_item(item_id, item_data)
+            db.session.commit()
+        except SQLAlchemyError:
+            abort(500, message="An error occurred while updating the item.")
 
         return item
 
@@ -93,16 +151,35 @@ class ItemList(MethodView):
     ItemList class representing the ItemList resource, used for retrieving all
     items in the database and creating a new item in an existing store.
     """
-    @blp.response(200, ItemSchema(many=True))
-    def get(self):
+    @coalesce
+    @blp.arguments(ItemQuerySchema, location="query")
+    @blp.response(200, ArchivedItemSchema(many=True))
+    def get(self, args):
         """Get all items:
 
         Method handles the HTTP GET request for all items. It retrieves all
         items from the database( all items in all stores) and returns them.
+        'min_price' / 'max_price' narrow the list with an exact integer
+        comparison on the indexed 'price_cents' column.
+        'include_archived=true' adds the deleted and archived items.
 
+        :param args: The optional price range from the query string.
         :return: A list of all items in the database.
         """
-        return ItemModel.query.all()
+        min_cents = to_cents(args["min_price"]) if "min_price" in args else None
+        max_cents = to_cents(args["max_price"]) if "max_price" in args else None
+
+        def items():
+            rows = item_rows(items_in_price_range(min_cents, max_cents))
+            if args["include_archived"]:
+                # A live item wins over an archived one with the same id.
+                live = {row.id for row in rows}
+                rows += [row for row in archived_item_rows(min_cents=min_cents, max_cents=max_cents)
+                         if row.id not in live]
+                rows.sort(key=lambda row: row.id)
+            return rows
+
+        return fan_out(items, ArchivedItemSchema(many=True))
 
     # @jwt_required()
     @blp.arguments(ItemSchema)
@@ -115,7 +192,8 @@ class ItemList(MethodView):
         the same store. If the store does not exist or the item already exists,
         it aborts with a 400 error. If the item is successfully created, it
         returns the new item. If an error occurs while inserting the item, it
-        aborts with a 500 error.
+        aborts with a 500 error. The duplicate check is part of the INSERT,
+        which returns the new item (see writepath.py).
 
         SQLALCHEMY ISSUE: SQLAlchemy does not enforce key value constraints
         on the database. It only enforces constraints on the object model.
@@ -133,25 +211,23 @@ class ItemList(MethodView):
         """
 
         # Check if store exists before creating the item
-        store = StoreModel.query.get(item_data["store_id"])
-        if not store:
+        use_store(item_data["store_id"])
+        store = find_store(item_data["store_id"])
+        if store is None:
             abort(400, message="Store does not exist.")
 
-        # Check if item with same name exists in same store
-        item = ItemModel.query.filter_by(name=item_data["name"],
-                                         store_id=item_data["store_id"],
-                                         description=item_data["description"]).first()
-
-        if item:
-            abort(400,
-                  message="An item with this name already exists in the store.")
-
-        item = ItemModel(**item_data)
-
+        # Not inserted if an item with same name exists in same store, or
+        # the store was deleted since the snapshot saw it
         try:
-            db.session.add(item)
+            item = create_item(item_data)
+            if item is None:
+                if missing_store(item_data["store_id"]):
+                    abort(400, message="Store does not exist.")
+                abort(400,
+                      message="An item with this name already exists in the store.")
             db.session.commit()
         except SQLAlchemyError:
             abort(500, message="An error occurred while inserting the item.")
 
+        item.store = store
         return item
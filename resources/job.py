@@ -0,0 +1,51 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from flask_jwt_extended import jwt_required
+from sqlalchemy import select
+
+from db import db
+from jobs import get_job, jobs_table
+from schemas import JobQuerySchema, JobSchema
+
+
+blp = Blueprint("Jobs", "jobs", description="Status of background jobs")
+
+
+@blp.route("/jobs/<int:job_id>")
+class Job(MethodView):
+    @jwt_required()
+    @blp.response(200, JobSchema)
+    def get(self, job_id):
+        """Get job status:
+
+        Long operations answer 202 with a job and a Location header pointing
+        here. Poll until 'status' is "done" (see 'result') or "failed" (see
+        'error'); 'progress' of 'total' shows how far it got.
+
+        :param job_id: The ID of the job.
+        :return: The job or a 404 error if it does not exist.
+        """
+        job = get_job(job_id)
+        if job is None:
+            abort(404, message="Job not found.")
+        return job
+
+
+@blp.route("/jobs")
+class JobList(MethodView):
+    @jwt_required()
+    @blp.arguments(JobQuerySchema, location="query")
+    @blp.response(200, JobSchema(many=True))
+    def get(self, args):
+        """List jobs:
+
+        Most recent jobs first, optionally only those with a given 'status'.
+
+        :param args: status and limit query parameters.
+        :return: A list of jobs.
+        """
+        query = select(jobs_table).order_by(jobs_table.c.id.desc()).limit(args["limit"])
+        if "status" in args:
+            query = query.where(jobs_table.c.status == args["status"])
+        with db.engine.connect() as conn:
+            return conn.execute(query).mappings().all()
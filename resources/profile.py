@@ -0,0 +1,58 @@
+from flask import current_app, send_from_directory
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+
+from schemas import ProfileQuerySchema, ProfileSchema
+from tokens import admin_required
+
+
+blp = Blueprint("Profiles", "profiles", description="Saved request profiles")
+
+
+def profiler():
+    profiler = current_app.extensions["profiler"]
+    if not profiler.enabled:
+        abort(404, message="Profiling is off (PROFILER_ENABLED).")
+    return profiler
+
+
+@blp.route("/profiles")
+class ProfileList(MethodView):
+    @admin_required
+    @blp.arguments(ProfileQuerySchema, location="query")
+    @blp.response(200, ProfileSchema(many=True))
+    def get(self, args):
+        """List saved profiles:
+
+        Newest first, optionally only those of one endpoint (e.g.
+        "stores.Store"). Send a request with 'X-Profile: 1' and an admin
+        token to add one; its id comes back in 'X-Profile-Id'.
+
+        :param args: Optional 'endpoint' filter and 'limit'.
+        :return: Metadata of the saved profiles.
+        """
+        profiles = profiler().list()
+        if "endpoint" in args:
+            profiles = [p for p in profiles if p["endpoint"] == args["endpoint"]]
+        return profiles[: args["limit"]]
+
+
+@blp.route("/profiles/<string:profile_id>")
+class Profile(MethodView):
+    @admin_required
+    @blp.response(200, description="Folded stacks (text) or a .pstats file.")
+    def get(self, profile_id):
+        """Download a profile:
+
+        Folded stacks ("sample" mode) feed flamegraph.pl or speedscope;
+        .pstats files ("cprofile" mode) open with pstats or snakeviz.
+
+        :param profile_id: The ID of the profile.
+        :return: The profile file or a 404 error if it does not exist.
+        """
+        found = profiler().file(profile_id)
+        if found is None:
+            abort(404, message="Profile not found.")
+        directory, name = found
+        return send_from_directory(directory, name, as_attachment=True,
+                                   mimetype="text/plain" if name.endswith(".folded") else None)
@@ -0,0 +1,61 @@
+from flask import current_app
+from flask.views import MethodView
+from flask_smorest import Blueprint, abort
+from flask_jwt_extended import jwt_required
+
+from schemas import AdmissionStatsSchema, HealthSchema, SqlStatsSchema
+from statements import report
+
+
+blp = Blueprint("Stats", "stats", description="Runtime statistics")
+
+
+@blp.route("/stats/sql")
+class SqlStats(MethodView):
+    @jwt_required()
+    @blp.response(200, SqlStatsSchema)
+    def get(self):
+        """Get SQL compile cache statistics:
+
+        Hits, misses and hit rate of each engine's compiled statement cache
+        since this worker process started, and how full the caches are. A
+        low hit rate with a full cache means SQL_COMPILED_CACHE_SIZE is too
+        small. Counts are per process.
+
+        :return: The statistics of this worker process.
+        """
+        return report()
+
+
+@blp.route("/stats/admission")
+class AdmissionStats(MethodView):
+    @jwt_required()
+    @blp.response(200, AdmissionStatsSchema)
+    def get(self):
+        """Get admission control statistics:
+
+        For each cost class, and each endpoint with a limit of its own: the
+        slots, the requests running and waiting now, and since this worker
+        process started the requests admitted, rejected after waiting,
+        rejected on arrival because their deadline had passed ('expired'),
+        their wait for a slot and how long they held it. Counts are per
+        process.
+
+        :return: The statistics of this worker process.
+        """
+        controller = current_app.extensions.get("admission")
+        if controller is None:
+            abort(404, message="Admission control is off.")
+        return controller.report()
+
+
+@blp.route("/health")
+class Health(MethodView):
+    @blp.response(200, HealthSchema)
+    def get(self):
+        """Health check:
+
+        Answers without touching the database, in the priority lane of
+        admission control, so it succeeds while the worker sheds load.
+        """
+        return {"status": "ok"}
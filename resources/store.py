@@ -1,17 +1,148 @@
 # Libraries and package imports
+from flask import Response, current_app, request, stream_with_context
 from flask.views import MethodView
-from flask_smorest import Blueprint, abort
+from flask_smorest import abort
 from flask_jwt_extended import jwt_required
+from sqlalchemy import delete, select
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 
 # Local imports
+from changefeed import change, read_store_changes, record
 from db import db
-from models import StoreModel
-from schemas import StoreSchema
+from events import stream
+from jobs import accepted, enqueue, job, respond_async
+from models import ItemArchiveModel, ItemModel, ItemTags, ItemTagsArchive, StoreModel, TagModel
+from pagination import NestedPager
+from readpath import LIVE, PLAIN_ITEM_COLUMNS, TAG_COLUMNS, PlainItemRow, TagRow
+from schemas import JobSchema, StorePageArgsSchema, StoreSchema
+from sharding import fan_out, forget_store, place_store, use_store
+from singleflight import coalesce
+from snapshot import current, get_store_or_404
+from tracing import Blueprint
+from writepath import create_store
 
 
 blp = Blueprint("stores", __name__, description="Operations on stores")
 
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_store(store_id, progress=None):
+    """Delete a store with all its items, archived items and tags.
+
+    Items go in batches of DELETE_BATCH_SIZE, each in its own transaction,
+    so a store with many items neither holds one huge transaction nor loads
+    every item into the session. Safe to run again after a failure.
+
+    :param progress: Called with (items deleted, total items) per batch.
+    """
+    use_store(store_id)
+    store = StoreModel.query.get(store_id)
+    if store is None:
+        return 0
+
+    total = store.items.count()
+    deleted = 0
+    while True:
+        item_ids = db.session.scalars(
+            select(ItemModel.id).where(ItemModel.store_id == store.id)
+            .order_by(ItemModel.id).limit(DELETE_BATCH_SIZE)
+        ).all()
+        if not item_ids:
+            break
+        db.session.execute(delete(ItemTags).where(ItemTags.item_id.in_(item_ids)))
+        db.session.execute(delete(ItemModel).where(ItemModel.id.in_(item_ids)))
+        record(db.session, [change("item", item_id, "delete", store.id) for item_id in item_ids])
+        db.session.commit()
+        deleted += len(item_ids)
+        if progress:
+            progress(deleted, total)
+
+    while True:
+        item_ids = db.session.scalars(
+            select(ItemArchiveModel.id).where(ItemArchiveModel.store_id == store.id)
+            .order_by(ItemArchiveModel.id).limit(DELETE_BATCH_SIZE)
+        ).all()
+        if not item_ids:
+            break
+        db.session.execute(delete(ItemTagsArchive).where(ItemTagsArchive.item_id.in_(item_ids)))
+        db.session.execute(delete(ItemArchiveModel).where(ItemArchiveModel.id.in_(item_ids)))
+        db.session.commit()
+
+    tag_ids = db.session.scalars(select(TagModel.id).where(TagModel.store_id == store.id)).all()
+    if tag_ids:
+        db.session.execute(delete(ItemTags).where(ItemTags.tag_id.in_(tag_ids)))
+        db.session.execute(delete(TagModel).where(TagModel.id.in_(tag_ids)))
+        record(db.session, [change("tag", tag_id, "delete", store.id) for tag_id in tag_ids])
+
+    db.session.delete(store)
+    db.session.commit()
+    forget_store(store.id)
+    return deleted
+
+
+@job("store.delete")
+def delete_store_job(ctx, store_id):
+    deleted = delete_store(store_id, lambda done, total: ctx.progress(done, total))
+    return {"store_id": store_id, "items_deleted": deleted}
+
+
+def store_page(store_id, name, pager):
+    """Store as a dict for StoreSchema, with its items and tags paged.
+
+    The tags come from the catalogue snapshot when it has the store.
+    """
+    path = f"/store/{store_id}"
+    items = pager.page(
+        "items", select(*PLAIN_ITEM_COLUMNS).where(ItemModel.store_id == store_id, LIVE),
+        ItemModel.id, path, PlainItemRow,
+    )
+    snapshot = current()
+    if snapshot is not None and snapshot.has_store(store_id):
+        tags = pager.page_rows("tags", snapshot.tags_of(store_id), path)
+    else:
+        tags = pager.page(
+            "tags", select(*TAG_COLUMNS).where(TagModel.store_id == store_id),
+            TagModel.id, path, TagRow,
+        )
+    return _store_dict(store_id, name, items, tags)
+
+
+def store_pages(stores, pager):
+    """Like store_page() for a list of (id, name), in a fixed number of
+    queries instead of a few per store (see NestedPager.pages)."""
+    paths = {store_id: f"/store/{store_id}" for store_id, _ in stores}
+    items = pager.pages(
+        "items", select(*PLAIN_ITEM_COLUMNS).where(LIVE),
+        ItemModel.store_id, ItemModel.id, paths, PlainItemRow,
+    )
+    snapshot = current()
+    tags = {}
+    if snapshot is not None:
+        tags = {store_id: pager.page_rows("tags", snapshot.tags_of(store_id), path)
+                for store_id, path in paths.items() if snapshot.has_store(store_id)}
+    tags.update(pager.pages(
+        "tags", select(*TAG_COLUMNS), TagModel.store_id, TagModel.id,
+        {store_id: path for store_id, path in paths.items() if store_id not in tags}, TagRow,
+    ))
+    return [_store_dict(store_id, name, items[store_id], tags[store_id])
+            for store_id, name in stores]
+
+
+def _store_dict(store_id, name, items, tags):
+    items, items_count, items_next = items
+    tags, tags_count, tags_next = tags
+    return {
+        "id": store_id,
+        "name": name,
+        "items": items,
+        "items_count": items_count,
+        "items_next": items_next,
+        "tags": tags,
+        "tags_count": tags_count,
+        "tags_next": tags_next,
+    }
+
 
 @blp.route("/store/<string:store_id>")
 class Store(MethodView):
@@ -20,37 +151,93 @@ class Store(MethodView):
     Store class representing a single store.
     Two methods: get and delete.
     """
+    @coalesce
+    @blp.arguments(StorePageArgsSchema, location="query")
     @blp.response(200, StoreSchema)
-    def get(self, store_id):
+    def get(self, args, store_id):
         """Get Store by ID:
 
-        method retrieves a store by its ID.
+        method retrieves a store by its ID. Its items and tags are capped at
+        'items_limit' / 'tags_limit' with counts and "next" links;
+        'expand=items,tags' returns them all.
 
+        :param args: Paging of the nested collections (query string).
+        :type args: dict
         :param store_id: The ID of the store to retrieve.
         :type store_id: str
-        :return: The store object associated with the given ID.
-        :rtype: StoreModel
+        :return: The store associated with the given ID.
+        :rtype: dict
         """
-        store = StoreModel.query.get_or_404(store_id)
-        return store
+        use_store(store_id)
+        store = get_store_or_404(store_id)
+        return store_page(store["id"], store["name"], NestedPager(args))
 
     @jwt_required(fresh=True)   # Oooh shit!, fresh access token needed here
+    @blp.alt_response(202, schema=JobSchema, description="Deletion queued as a job.")
     def delete(self, store_id):
         """Delete Store by ID:
 
-        method deletes a store by its ID.
+        method deletes a store by its ID, with its items and tags. Stores
+        with more than JOBS_ASYNC_ITEMS items, or any store when the client
+        sends 'Prefer: respond-async', are deleted by a background job: the
+        response is then a 202 with the job (see GET /jobs/<id>).
 
         :param store_id: The ID of the store to delete.
         :type store_id: str
-        :return: A message indicating the store has been deleted.
+        :return: A message indicating the store has been deleted, or the job.
         :rtype: dict
         """
+        use_store(store_id)
         store = StoreModel.query.get_or_404(store_id)
-        db.session.delete(store)
-        db.session.commit()
+        if respond_async() or store.items.count() > current_app.config["JOBS_ASYNC_ITEMS"]:
+            return accepted(enqueue("store.delete", store_id=store.id))
+
+        delete_store(store.id)
         return {"message": "Store deleted"}, 200
 
 
+@blp.route("/store/<string:store_id>/events")
+class StoreEvents(MethodView):
+    """
+
+    StoreEvents class streams the changes of a single store as Server-Sent
+    Events, so clients don't have to poll Store.get.
+    """
+    @blp.response(200, description="Server-Sent Events stream of the store's changes.",
+                  content_type="text/event-stream")
+    def get(self, store_id):
+        """Subscribe to store changes:
+
+        method opens an SSE stream with one event per item, tag or item-tag
+        change in the store ('item.update', 'tag.create', ...). Event data
+        is the changed row only. A client reconnecting with Last-Event-ID
+        first receives the changes it missed.
+
+        :param store_id: The ID of the store to follow.
+        :type store_id: str
+        :return: text/event-stream response.
+        :rtype: Response
+        """
+        use_store(store_id)
+        store = StoreModel.query.get_or_404(store_id)
+        store_id = store.id
+
+        # Subscribe before reading the backlog so nothing falls in between.
+        subscription = current_app.extensions["events"].subscribe(store_id)
+        last_event_id = request.headers.get("Last-Event-ID", "")
+        backlog = (read_store_changes(store_id, int(last_event_id))
+                   if last_event_id.isdigit() else [])
+
+        # Don't hold a pooled connection for the lifetime of the stream.
+        db.session.close()
+
+        return Response(
+            stream_with_context(stream(subscription, backlog)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
 @blp.route("/store")
 class StoreList(MethodView):
     """
@@ -60,44 +247,63 @@ class StoreList(MethodView):
 
     Two methods: get and post.
     """
+    @coalesce
+    @blp.arguments(StorePageArgsSchema, location="query")
     @blp.response(200, StoreSchema(many=True))
-    def get(self):
+    def get(self, args):
         """Get all Store data:
 
         Method retrieves all the stores in the database including:
-        store ID, items in stores, name of store and store tag.
+        store ID, items in stores, name of store and store tag. Each
+        store's items and tags are paged like in Store.get, all stores
+        together (store_pages).
 
-        :return: A list of all the store objects in the database.
+        :param args: Paging of the nested collections (query string).
+        :type args: dict
+        :return: A list of all the stores in the database.
         :rtype: list
         """
-        return StoreModel.query.all()
+        pager = NestedPager(args)
+        stores = select(StoreModel.id, StoreModel.name).order_by(StoreModel.id)
+        return fan_out(
+            lambda: store_pages(db.session.execute(stores).all(), pager),
+            StoreSchema(many=True),
+        )
 
     @blp.arguments(StoreSchema)
     @blp.response(201, StoreSchema)
     def post(self, store_data):
         """Create new Store:
 
-        Method creates a new store with the provided data:
+        Method creates a new store with the provided data, with one
+        INSERT ... ON CONFLICT (name) DO NOTHING RETURNING, and returns it
+        from that row (see writepath.py).
 
         :param store_data: The data for the new store.
         :type store_data: dict
-        :return: The newly created store object.
-        :rtype: StoreModel
+        :return: The newly created store.
+        :rtype: dict
         :raises IntegrityError: If a store with the same name already exists.
         :raises SQLAlchemyError: If an error occurred while creating the store.
         """
 
-        store = StoreModel(**store_data)
-
+        store_id = store = None
         try:
-            db.session.add(store)
-            db.session.commit()
+            # id and shard from the shard map, if sharded
+            store_id = place_store(store_data["name"])
+            store = create_store(store_data["name"], store_id)
+            if store is not None:
+                db.session.commit()
         except IntegrityError:
+            store = None
+        except SQLAlchemyError:
+            forget_store(store_id)
+            abort(500, message="An error occurred creating the store.")
+
+        if store is None:  # the name is taken
+            forget_store(store_id)
             abort(
                 400,
                 message="A store with that name already exists.",
             )
-        except SQLAlchemyError:
-            abort(500, message="An error occurred creating the store.")
-
         return store
@@ -1,41 +1,83 @@
 from flask.views import MethodView
-from flask_smorest import Blueprint, abort
+from flask_smorest import abort
+from sqlalchemy import delete, exists, select
 from sqlalchemy.exc import SQLAlchemyError
 
 from db import db
-from models import TagModel, StoreModel, ItemModel
-from schemas import TagSchema, TagAndItemSchema
+from models import TagModel, ItemModel, ItemTags, ItemTagsArchive
+from pagination import NestedPager
+from readpath import LIVE, PLAIN_ITEM_COLUMNS, TAG_COLUMNS, PlainItemRow, tag_row
+from schemas import TagSchema, TagAndItemSchema, TagPageArgsSchema
+from sharding import get_sharded_or_404, use_store
+from singleflight import coalesce
+from snapshot import current, find_store, get_store_or_404, missing_store
+from tracing import Blueprint
+from writepath import create_tag, link_tag, unlink_tag
 
 
 blp = Blueprint("Tags", "tags", description="Operations on tags")
 
 
+def tag_page(tag_id, name, store, pager):
+    """Tag as a dict for TagSchema, with its items paged."""
+    items, items_count, items_next = pager.page(
+        "items",
+        select(*PLAIN_ITEM_COLUMNS).join(ItemTags, ItemTags.item_id == ItemModel.id)
+        .where(ItemTags.tag_id == tag_id, LIVE),
+        ItemModel.id,
+        f"/tag/{tag_id}",
+        PlainItemRow,
+    )
+    return {
+        "id": tag_id,
+        "name": name,
+        "store": store,
+        "items": items,
+        "items_count": items_count,
+        "items_next": items_next,
+    }
+
+
 @blp.route("/store/<string:store_id>/tag")
 class TagsInStore(MethodView):
+    @coalesce
+    @blp.arguments(TagPageArgsSchema, location="query")
     @blp.response(200, TagSchema(many=True))
-    def get(self, store_id):
-        store = StoreModel.query.get_or_404(store_id)
-
-        return store.tags.all()
+    def get(self, args, store_id):
+        use_store(store_id)
+        store = get_store_or_404(store_id)
+
+        pager = NestedPager(args)
+        snapshot = current()
+        if snapshot is not None and snapshot.has_store(store["id"]):
+            tags = snapshot.tags_of(store["id"])
+        else:
+            tags = db.session.execute(
+                select(*TAG_COLUMNS).where(TagModel.store_id == store["id"]).order_by(TagModel.id)
+            ).mappings()
+        return [tag_page(tag["id"], tag["name"], store, pager) for tag in tags]
 
     @blp.arguments(TagSchema)
     @blp.response(201, TagSchema)
     def post(self, tag_data, store_id):
-        if TagModel.query.filter(TagModel.store_id == store_id,
-                                 TagModel.name == tag_data["name"]).first():
-            abort(400,
-                  message="A tag with that name already exists in that store.")
-
-        tag = TagModel(**tag_data, store_id=store_id)
-
+        use_store(store_id)
+        store = get_store_or_404(store_id)
+        # The INSERT checks the name and that the store still exists (see
+        # writepath.py); the snapshot may not have seen other workers' writes.
         try:
-            db.session.add(tag)
-            db.session.commit()
+            tag = create_tag(store, tag_data["name"])
+            if tag is not None:
+                db.session.commit()
         except SQLAlchemyError as e:
             abort(
                 500,
                 message=str(e),
             )
+        if tag is None:
+            if missing_store(store["id"]):
+                abort(404)
+            abort(400,
+                  message="A tag with that name already exists in that store.")
 
         return tag
 
@@ -44,42 +86,52 @@ class TagsInStore(MethodView):
 class LinkTagsToItem(MethodView):
     @blp.response(201, TagSchema)
     def post(self, item_id, tag_id):
-        item = ItemModel.query.get_or_404(item_id)
-        tag = TagModel.query.get_or_404(tag_id)
-
-        item.tags.append(tag)
+        # The item is on its tag's shard (same store).
+        snapshot = current()
+        tag = snapshot.tag(tag_id) if snapshot is not None else None
+        if tag is not None:
+            use_store(tag["store_id"])
+        else:
+            tag = get_sharded_or_404(TagModel, tag_id, load=tag_row)._asdict()
 
         try:
-            db.session.add(item)
-            db.session.commit()
+            tag = link_tag(item_id, {"id": tag["id"], "name": tag["name"],
+                                     "store": find_store(tag["store_id"])})
+            if tag is not None:
+                db.session.commit()
         except SQLAlchemyError:
             abort(500, message="An error occurred while inserting the tag.")
+        if tag is None:
+            abort(404)
 
         return tag
 
     @blp.response(200, TagAndItemSchema)
     def delete(self, item_id, tag_id):
-        item = ItemModel.query.get_or_404(item_id)
-        tag = TagModel.query.get_or_404(tag_id)
-
-        item.tags.remove(tag)
+        # The item is on its tag's shard (same store).
+        tag = get_sharded_or_404(TagModel, tag_id, load=tag_row)
 
         try:
-            # item.tags.remove(tag)
-            db.session.add(item)
-            db.session.commit()
+            item = unlink_tag(item_id, tag.id)
+            if item is not None:
+                db.session.commit()
         except SQLAlchemyError:
-            abort(500, message="An error occurred while inserting the tag.")
+            abort(500, message="An error occurred while removing the tag.")
+        if item is None:
+            abort(404, message="The item doesn't exist or isn't linked to that tag.")
 
+        tag = tag_page(tag.id, tag.name, find_store(tag.store_id), NestedPager({}))
         return {"message": "Item removed from tag", "item": item, "tag": tag}
 
 
 @blp.route("/tag/<string:tag_id>")
 class Tag(MethodView):
+    @coalesce
+    @blp.arguments(TagPageArgsSchema, location="query")
     @blp.response(200, TagSchema)
-    def get(self, tag_id):
-        tag = TagModel.query.get_or_404(tag_id)
-        return tag
+    def get(self, args, tag_id):
+        tag = get_sharded_or_404(TagModel, tag_id, load=tag_row)
+        return tag_page(tag.id, tag.name, find_store(tag.store_id), NestedPager(args))
 
     @blp.response(
         202,
@@ -92,13 +144,22 @@ class Tag(MethodView):
         description="Returned if the tag is assigned to one or more items. In this case, the tag is not deleted.",
     )
     def delete(self, tag_id):
-        tag = TagModel.query.get_or_404(tag_id)
-
-        if not tag.items:
-            db.session.delete(tag)
-            db.session.commit()
-            return {"message": "Tag deleted."}
-        abort(
-            400,
-            message="Could not delete tag. Make sure tag is not associated with any items, then try again.",
-        )
+        tag = get_sharded_or_404(TagModel, tag_id)
+
+        # Only live items keep a tag alive.
+        in_use = db.session.execute(select(exists().where(
+            ItemTags.tag_id == tag.id,
+            ItemTags.item_id.in_(select(ItemModel.id).where(LIVE)),
+        ))).scalar()
+        if in_use:
+            abort(
+                400,
+                message="Could not delete tag. Make sure tag is not associated with any items, then try again.",
+            )
+
+        # The links of deleted and archived items go with the tag.
+        db.session.execute(delete(ItemTags).where(ItemTags.tag_id == tag.id))
+        db.session.execute(delete(ItemTagsArchive).where(ItemTagsArchive.tag_id == tag.id))
+        db.session.delete(tag)
+        db.session.commit()
+        return {"message": "Tag deleted."}
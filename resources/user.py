@@ -19,7 +19,7 @@ database through SQLAlchemy ORM.
 
 # Libraries and package imports
 from flask.views import MethodView
-from flask_smorest import Blueprint, abort
+from flask_smorest import abort
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
@@ -34,6 +34,8 @@ from blocklist import BLOCKLIST
 from db import db
 from models import UserModel
 from schemas import UserSchema
+from statements import login_by_username, user_id_by_username
+from tracing import Blueprint
 
 blp = Blueprint("Users", "users", description="Operations on users")
 
@@ -81,8 +83,7 @@ class UserRegister(MethodView):
             A 409 HTTPException is raised when a user with the same username
             already exists in the database.
         """
-        if UserModel.query.filter(
-                UserModel.username == user_data["username"]).first():
+        if db.session.scalar(user_id_by_username(user_data["username"])):
             abort(409, message="A user with that username already exists.")
 
         user = UserModel(
@@ -101,9 +102,8 @@ class UserRegister(MethodView):
 class UserLogin(MethodView):
     @blp.arguments(UserSchema)
     def post(self, user_data):
-        user = UserModel.query.filter(
-            UserModel.username == user_data["username"]
-        ).first()
+        # Only the two columns needed, no ORM instance.
+        user = db.session.execute(login_by_username(user_data["username"])).first()
 
         # Check if the user exists and the password is correct:
         #   For the body of the if statement to run, the user must exist
@@ -207,7 +207,11 @@ class User(MethodView):
         return user
 
     def delete(self, user_id):
-        """Delete user by ID:"""
+        """Delete user by ID:
+
+        The user's cached identity (user_cache.py) is dropped on commit, so
+        its tokens stop working immediately in this process.
+        """
         user = UserModel.query.get_or_404(user_id)
         db.session.delete(user)
         db.session.commit()
@@ -1,4 +1,8 @@
-from marshmallow import Schema, fields
+from flask import has_app_context
+from marshmallow import Schema, fields, missing, validate
+from webargs.fields import DelimitedList
+
+from snapshot import store_of
 
 
 class PlainItemSchema(Schema):
@@ -25,6 +29,17 @@ class PlainTagSchema(Schema):
     name = fields.Str()
 
 
+class CatalogueStore(fields.Nested):
+    """Nested 'store' of an item or tag model, taken from the catalogue
+    snapshot (snapshot.py) so the relationship isn't loaded per row. Dicts
+    are read as usual: they already hold their store."""
+
+    def get_value(self, obj, attr, accessor=None, default=missing):
+        if isinstance(obj, dict) or not has_app_context():
+            return super().get_value(obj, attr, accessor, default)
+        return store_of(obj)
+
+
 class ItemSchema(PlainItemSchema):
     """Schema for item with store info:
 
@@ -40,11 +55,19 @@ class ItemSchema(PlainItemSchema):
      'dump_only=True' -> include 'store' when sending data to client.
     """
     store_id = fields.Int(required=True, load_only=True)
-    store = fields.Nested(PlainStoreSchema(), dump_only=True)
+    store = CatalogueStore(PlainStoreSchema(), dump_only=True)
     tags = fields.List(fields.Nested(PlainTagSchema()), dump_only=True)
     description = fields.Str()  # new field for item description
 
 
+class ArchivedItemSchema(ItemSchema):
+    """Schema of the item GETs, which take '?include_archived=true' (see
+    archive.py): deleted and archived items also carry 'deleted_at' and
+    'archived_at'. Live items (readpath.ItemRow) have neither."""
+    deleted_at = fields.DateTime(dump_only=True, allow_none=True)
+    archived_at = fields.DateTime(dump_only=True, allow_none=True)
+
+
 class ItemUpdateSchema(Schema):
     name = fields.Str()
     price = fields.Float()
@@ -54,6 +77,17 @@ class ItemUpdateSchema(Schema):
     store_id = fields.Int()
 
 
+class ArchiveArgsSchema(Schema):
+    """Query string of the item GETs: also return deleted and archived items."""
+    include_archived = fields.Bool(load_default=False)
+
+
+class ItemQuerySchema(ArchiveArgsSchema):
+    """Query string for GET /item: optional inclusive price range."""
+    min_price = fields.Float()
+    max_price = fields.Float()
+
+
 class StoreSchema(PlainStoreSchema):
     """Schema for store with items:
 
@@ -63,12 +97,38 @@ class StoreSchema(PlainStoreSchema):
     """
     items = fields.List(fields.Nested(PlainItemSchema()), dump_only=True)
     tags = fields.List(fields.Nested(PlainTagSchema()), dump_only=True)
+    # Set when the collections are paged (see pagination.py):
+    items_count = fields.Int(dump_only=True)
+    items_next = fields.Str(dump_only=True, allow_none=True)
+    tags_count = fields.Int(dump_only=True)
+    tags_next = fields.Str(dump_only=True, allow_none=True)
 
 
 class TagSchema(PlainTagSchema):
     store_id = fields.Int(load_only=True)
-    store = fields.Nested(PlainStoreSchema(), dump_only=True)
+    store = CatalogueStore(PlainStoreSchema(), dump_only=True)
     items = fields.List(fields.Nested(PlainItemSchema()), dump_only=True)
+    items_count = fields.Int(dump_only=True)
+    items_next = fields.Str(dump_only=True, allow_none=True)
+
+
+class TagPageArgsSchema(Schema):
+    """Query string of GET /tag/<id> and GET /store/<id>/tag:
+
+    At most 'items_limit' items after id 'items_after' are nested in each
+    tag; 'expand=items' nests all of them.
+    """
+    items_limit = fields.Int(validate=validate.Range(min=1, max=1000))
+    items_after = fields.Int()
+    expand = DelimitedList(fields.Str(validate=validate.OneOf(["items"])))
+
+
+class StorePageArgsSchema(TagPageArgsSchema):
+    """Query string of GET /store/<id> and GET /store: like
+    TagPageArgsSchema, for the store's items and tags."""
+    tags_limit = fields.Int(validate=validate.Range(min=1, max=1000))
+    tags_after = fields.Int()
+    expand = DelimitedList(fields.Str(validate=validate.OneOf(["items", "tags"])))
 
 
 class TagAndItemSchema(Schema):
@@ -81,3 +141,161 @@ class UserSchema(Schema):
     id = fields.Int(dump_only=True)
     username = fields.Str(required=True)
     password = fields.Str(required=True)
+
+
+class ImportArgsSchema(Schema):
+    """Query string for POST /import:
+
+    'offset' is the resume point returned by a previous (interrupted) import.
+    """
+    format = fields.Str(validate=validate.OneOf(["csv", "ndjson"]))
+    batch_size = fields.Int(load_default=1000, validate=validate.Range(min=1))
+    offset = fields.Int(load_default=0, validate=validate.Range(min=0))
+
+
+class ImportReportSchema(Schema):
+    rows = fields.Int()
+    imported = fields.Int()
+    rejected = fields.Int()
+    rejects = fields.List(fields.Dict())
+    offset = fields.Int()
+    elapsed = fields.Float()
+    rows_per_sec = fields.Float()
+
+
+class ChangeSchema(Schema):
+    id = fields.Int()
+    entity = fields.Str()  # item, store, tag or item_tag
+    entity_id = fields.Int()
+    op = fields.Str()  # create, update or delete
+    store_id = fields.Int(allow_none=True)
+    data = fields.Dict(allow_none=True)
+    created_at = fields.DateTime()
+
+
+class ChangeQuerySchema(Schema):
+    """Query string for GET /changes:
+
+    'since' is the cursor returned by the previous call ("latest" to start
+    from now). 'wait' > 0 long-polls for up to that many seconds.
+    """
+    since = fields.Str()
+    limit = fields.Int(load_default=100, validate=validate.Range(min=1, max=1000))
+    store_id = fields.Int()
+    wait = fields.Float(load_default=0, validate=validate.Range(min=0, max=30))
+
+
+class ChangeFeedSchema(Schema):
+    changes = fields.List(fields.Nested(ChangeSchema()))
+    cursor = fields.Str()
+    has_more = fields.Bool()
+
+
+class JobSchema(Schema):
+    """Background job (see jobs.py). 'progress' of 'total' is in the job's
+    own unit (items deleted, rows imported, ...)."""
+    id = fields.Int()
+    kind = fields.Str()
+    status = fields.Str()  # queued, running, done or failed
+    progress = fields.Int()
+    total = fields.Int(allow_none=True)
+    result = fields.Raw(allow_none=True)
+    error = fields.Str(allow_none=True)
+    attempts = fields.Int()
+    created_at = fields.DateTime()
+    started_at = fields.DateTime(allow_none=True)
+    finished_at = fields.DateTime(allow_none=True)
+
+
+class JobQuerySchema(Schema):
+    status = fields.Str(validate=validate.OneOf(["queued", "running", "done", "failed"]))
+    limit = fields.Int(load_default=50, validate=validate.Range(min=1, max=500))
+
+
+class SqlEngineStatsSchema(Schema):
+    engine = fields.Str()
+    hits = fields.Int()
+    misses = fields.Int()
+    uncached = fields.Int()
+    hit_rate = fields.Float(allow_none=True)
+    compiled_cache_size = fields.Int()
+    compiled_cache_capacity = fields.Int()
+
+
+class SqlStatsSchema(Schema):
+    """Compile cache statistics of this worker process (see statements.py)."""
+    lambda_cache_size = fields.Int()
+    lambda_cache_capacity = fields.Int()
+    engines = fields.List(fields.Nested(SqlEngineStatsSchema()))
+
+
+class AdmissionGateStatsSchema(Schema):
+    name = fields.Str()
+    slots = fields.Int(allow_none=True)
+    queue = fields.Int(allow_none=True)
+    in_flight = fields.Int()
+    waiting = fields.Int()
+    admitted = fields.Int()
+    rejected = fields.Int()
+    expired = fields.Int()
+    mean_wait_ms = fields.Float(allow_none=True)
+    max_wait_ms = fields.Float()
+    mean_service_ms = fields.Float()
+
+
+class AdmissionStatsSchema(Schema):
+    """Admission counters of this worker process (see admission.py)."""
+    classes = fields.List(fields.Nested(AdmissionGateStatsSchema()))
+    endpoints = fields.List(fields.Nested(AdmissionGateStatsSchema()))
+
+
+class HealthSchema(Schema):
+    status = fields.Str()
+
+
+class ProfileSchema(Schema):
+    """A saved request profile (see profiler.py)."""
+    id = fields.Str()
+    method = fields.Str()
+    path = fields.Str()
+    endpoint = fields.Str(allow_none=True)
+    status = fields.Int()
+    duration_ms = fields.Float()
+    mode = fields.Str()
+    format = fields.Str()
+    trigger = fields.Str()
+    samples = fields.Int(allow_none=True)
+    created_at = fields.Str()
+
+
+class ProfileQuerySchema(Schema):
+    endpoint = fields.Str()
+    limit = fields.Int(load_default=50, validate=validate.Range(min=1, max=1000))
+
+
+class BatchRequestSchema(Schema):
+    """One request of POST /batch. 'id' names it for later references:
+    "{<id>.<field>}" in a later path or body is replaced by that field of
+    its response body."""
+    id = fields.Str()
+    method = fields.Str(required=True, validate=validate.OneOf(["GET", "POST", "PUT", "DELETE"]))
+    path = fields.Str(required=True)
+    body = fields.Raw(allow_none=True)
+    headers = fields.Dict(keys=fields.Str(), values=fields.Str())
+
+
+class BatchSchema(Schema):
+    atomic = fields.Bool(load_default=False)
+    requests = fields.List(fields.Nested(BatchRequestSchema()), required=True,
+                           validate=validate.Length(min=1))
+
+
+class BatchResponseSchema(Schema):
+    id = fields.Str(allow_none=True)
+    status = fields.Int()
+    body = fields.Raw(allow_none=True)
+
+
+class BatchResultSchema(Schema):
+    committed = fields.Bool()
+    responses = fields.List(fields.Nested(BatchResponseSchema()))
@@ -0,0 +1,577 @@
+"""
+sharding.py
+
+Horizontal sharding of the catalogue by store.
+
+With SHARD_DATABASE_URLS empty (the default) nothing here changes behaviour:
+every helper falls straight through to the default database.
+
+When extra databases are configured:
+
+    - The default database is shard 0 and also holds the shard map
+      ('store_shards': store id -> shard) and allocates store ids.
+    - A store, its items, its tags and their links all live on one shard.
+      Store-scoped requests select that shard with use_store(); the
+      RoutingSession in db.py then sends every query of the request there.
+    - Item and tag ids come from per-shard sequences ('shard_sequences')
+      starting at shard * SHARD_ID_SPAN, so an id tells us which shard
+      created it. get_sharded_or_404() tries that shard first and falls back
+      to the others for rows that were moved by a rebalance.
+    - List endpoints fan_out() to every shard in parallel and merge by id.
+    - Moving a store fences it first ('store_shards.moving'). A commit that
+      wrote to a store reads the store's map entry FOR SHARE and raises
+      StoreMoving (a 503, see app.py) if the store is being moved or no
+      longer lives on the shard it wrote to (_fence_writes). Setting the fence waits on Postgres for the
+      writes that passed that check to commit. A move bumps the shard map
+      version, which every request checks before trusting cached
+      placements.
+
+`flask shards init|status|move|rebalance` manage the shards.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import AppGroup
+from flask_smorest import abort
+from sqlalchemy import delete, event, func, insert, select, update
+
+from db import RoutingSession, db
+from models import (
+    ItemArchiveModel,
+    ItemModel,
+    ItemTags,
+    ItemTagsArchive,
+    ShardMapVersionModel,
+    ShardSequenceModel,
+    StoreModel,
+    StoreShardModel,
+    TagModel,
+)
+
+
+# Tables whose ids are allocated from 'shard_sequences'.
+SEQUENCE_MODELS = (ItemModel, TagModel)
+
+
+class StoreMoving(Exception):
+    """A commit wrote to a store that is being moved, or that was moved off
+    the shard it wrote to. Nothing was committed: roll back and retry once
+    the move is done."""
+
+
+class ShardRouter:
+    """Flask extension holding the shard engines and the cached shard map.
+
+    Must be initialised before 'db.init_app' since it adds the shards to
+    SQLALCHEMY_BINDS.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config.setdefault("SHARD_DATABASE_URLS", [])
+        self.id_span = app.config.setdefault("SHARD_ID_SPAN", 100_000_000)
+        self.map_ttl = app.config.setdefault("SHARD_MAP_TTL", 30)
+        self.move_grace = app.config.setdefault("SHARD_MOVE_GRACE", 2.0)
+        app.extensions["sharding"] = self
+
+        self.enabled = bool(urls)
+        if not self.enabled:
+            return
+
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        for index, url in enumerate(urls, start=1):
+            binds[f"shard{index}"] = url
+        self.count = len(urls) + 1
+        self._map = {}  # store_id -> (shard, expires)
+        self._version = None  # shard map version the cached entries belong to
+        self._pool = ThreadPoolExecutor(max_workers=self.count,
+                                        thread_name_prefix="shard-fan-out")
+
+        for model in SEQUENCE_MODELS:
+            if not event.contains(model, "before_insert", _allocate_id):
+                event.listen(model, "before_insert", _allocate_id)
+
+    # ------------------------------ lookups --------------------------------- #
+
+    def engine(self, shard):
+        return db.engine if shard == 0 else db.engines[f"shard{shard}"]
+
+    def shards(self):
+        return range(self.count)
+
+    def shard_of(self, engine):
+        """Shard of an engine; None (no shard selected) is shard 0."""
+        for shard in self.shards():
+            if self.engine(shard) is engine:
+                return shard
+        return 0
+
+    def shard_for_store(self, store_id, cached=True):
+        """Shard holding a store, or None if the store is not in the map."""
+        store_id = int(store_id)
+        now = time.monotonic()
+        if cached:
+            self._check_version()
+            hit = self._map.get(store_id)
+            if hit and hit[1] > now:
+                return hit[0]
+
+        with db.engine.connect() as conn:
+            shard = conn.execute(
+                select(StoreShardModel.shard).where(StoreShardModel.store_id == store_id)
+            ).scalar()
+        if shard is not None:
+            self._map[store_id] = (shard, now + self.map_ttl)
+        return shard
+
+    def shards_for_id(self, ident):
+        """Shards to search for an item/tag id, most likely first."""
+        home = min(max(int(ident) // self.id_span, 0), self.count - 1)
+        return [home] + [shard for shard in self.shards() if shard != home]
+
+    def forget(self, store_id):
+        self._map.pop(int(store_id), None)
+
+    def _check_version(self):
+        """Drop the cached placements if a move bumped the shard map
+        version since they were read. One read per request."""
+        if g.get("shard_map_checked"):
+            return
+        g.shard_map_checked = True
+        with db.engine.connect() as conn:
+            version = conn.execute(
+                select(ShardMapVersionModel.version).where(ShardMapVersionModel.id == 1)
+            ).scalar()
+        if version != self._version:
+            self._map.clear()
+            self._version = version
+
+
+def _router():
+    return current_app.extensions["sharding"]
+
+
+def _take_id(connection, table):
+    sequences = ShardSequenceModel.__table__
+    return connection.execute(
+        update(sequences)
+        .where(sequences.c.name == table.name)
+        .values(next_id=sequences.c.next_id + 1)
+        .returning(sequences.c.next_id)
+    ).scalar_one() - 1
+
+
+@event.listens_for(RoutingSession, "before_commit")
+def _fence_writes(session):
+    """Refuse to commit writes to a store that is being moved, or that a
+    move took off the shard this session wrote to.
+
+    The stores written are those of the transaction's change rows
+    (changefeed.record). Their map entries are read FOR SHARE on the
+    default database and the lock is held until this commit ends, so a
+    move's fence (UPDATE ... SET moving) waits for the writes that passed.
+    """
+    if not has_app_context():
+        return
+    router = current_app.extensions.get("sharding")
+    if router is None or not router.enabled:
+        return
+    session.flush()  # ORM writes log their changes on flush
+    store_ids = {row["store_id"] for row in session.info.get("changes", ())
+                 if row["store_id"] is not None}
+    if not store_ids:
+        return
+
+    shard = router.shard_of(g.get("shard_engine"))
+    fence = db.engine.connect()
+    try:
+        fence.begin()
+        entries = fence.execute(
+            select(StoreShardModel.shard, StoreShardModel.moving)
+            .where(StoreShardModel.store_id.in_(store_ids))
+            .with_for_update(read=True)
+        ).all()
+    except Exception:
+        fence.close()
+        raise
+    if any(moving or placed != shard for placed, moving in entries):
+        fence.close()
+        raise StoreMoving("The store is being moved to another shard. Try again shortly.")
+    session.info["shard_fence"] = fence
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_fence(session, transaction):
+    if transaction.parent is None:
+        fence = session.info.pop("shard_fence", None)
+        if fence is not None:
+            fence.close()
+
+
+def _allocate_id(mapper, connection, target):
+    """before_insert hook: take the next id from this shard's sequence."""
+    if target.id is not None or not _router().enabled:
+        return
+    target.id = _take_id(connection, mapper.local_table)
+
+
+def next_id(table):
+    """Id for a Core insert into the items or tags table, which skips
+    _allocate_id: the next one from this shard's sequence, or None without
+    sharding (the database assigns it)."""
+    if not _router().enabled:
+        return None
+    return _take_id(db.session.connection(), table)
+
+
+# ------------------------- helpers for the resources ------------------------ #
+
+def is_enabled():
+    return _router().enabled
+
+
+def use_shard(shard):
+    router = _router()
+    g.shard_engine = router.engine(shard) if router.enabled else None
+
+
+def check_placement(store_id):
+    """Raise StoreMoving if a move took 'store_id' off the shard this
+    request was routed to (by a placement cached before the move). The
+    map entry is read again, so a retry goes to the new shard."""
+    router = _router()
+    if not router.enabled:
+        return
+    shard = router.shard_for_store(store_id, cached=False)
+    if shard is not None and shard != router.shard_of(g.get("shard_engine")):
+        raise StoreMoving("The store was moved to another shard. Try again.")
+
+
+def use_store(store_id):
+    """Route the rest of the request to the shard holding 'store_id'."""
+    router = _router()
+    if router.enabled and str(store_id).isdigit():
+        use_shard(router.shard_for_store(store_id) or 0)
+
+
+def find_sharded(model, ident, load=None):
+    """Like 'model.query.get' for items and tags, searching the shards.
+
+    'load(ident)' replaces 'model.query.get', e.g. to read a row record
+    (readpath.py) instead of an instance. Leaves the request routed to the
+    shard the row was found on.
+    """
+    load = load or model.query.get
+    router = _router()
+    if not router.enabled:
+        return load(ident)
+    if not str(ident).isdigit():
+        return None
+
+    for shard in router.shards_for_id(ident):
+        use_shard(shard)
+        instance = load(ident)
+        if instance is not None:
+            return instance
+    use_shard(router.shards_for_id(ident)[0])
+    return None
+
+
+def get_sharded_or_404(model, ident, load=None):
+    instance = find_sharded(model, ident, load)
+    if instance is None:
+        abort(404)
+    return instance
+
+
+def fan_out(query, schema):
+    """Run 'query' on every shard in parallel and merge the results by id.
+
+    Without sharding the ORM objects are returned as-is. With sharding each
+    shard dumps its rows with 'schema' (a many=True schema) inside its own
+    app context, since the instances can't outlive their session.
+    """
+    router = _router()
+    if not router.enabled:
+        return query()
+
+    app = current_app._get_current_object()
+
+    def run(shard):
+        with app.app_context():
+            g.shard_engine = router.engine(shard)
+            return schema.dump(query())
+
+    results = router._pool.map(run, router.shards())
+    return sorted((row for rows in results for row in rows), key=lambda row: row["id"])
+
+
+def place_store(name):
+    """Id and shard of a new store from the shard map; None without sharding.
+
+    Routes the request to the store's shard. Raises IntegrityError if the
+    name is taken on any shard.
+    """
+    router = _router()
+    if not router.enabled:
+        return None
+
+    with db.engine.begin() as conn:
+        counts = dict(conn.execute(
+            select(StoreShardModel.shard, func.count()).group_by(StoreShardModel.shard)
+        ).all())
+        shard = min(router.shards(), key=lambda s: counts.get(s, 0))
+        store_id = conn.execute(
+            insert(StoreShardModel)
+            .values(name=name, shard=shard)
+            .returning(StoreShardModel.store_id)
+        ).scalar_one()
+    use_shard(shard)
+    return store_id
+
+
+def forget_store(store_id):
+    """Remove a deleted (or never created) store from the shard map."""
+    router = _router()
+    if not router.enabled or store_id is None:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(delete(StoreShardModel).where(StoreShardModel.store_id == store_id))
+    router.forget(store_id)
+
+
+# ------------------------------ rebalancing --------------------------------- #
+
+def _store_rows(conn, store_id):
+    """Every row of a store, as dicts in key order, by table."""
+    items, tags, stores = ItemModel.__table__, TagModel.__table__, StoreModel.__table__
+    links = ItemTags.__table__
+    archive, archive_links = ItemArchiveModel.__table__, ItemTagsArchive.__table__
+    item_ids = select(items.c.id).where(items.c.store_id == store_id)
+    archived_ids = select(archive.c.id).where(archive.c.store_id == store_id)
+    statements = {
+        "stores": select(stores).where(stores.c.id == store_id),
+        "items": select(items).where(items.c.store_id == store_id).order_by(items.c.id),
+        "tags": select(tags).where(tags.c.store_id == store_id).order_by(tags.c.id),
+        # Link ids are per shard; only the pairs are copied.
+        "items_tags": select(links.c.item_id, links.c.tag_id)
+        .where(links.c.item_id.in_(item_ids)).order_by(links.c.item_id, links.c.tag_id),
+        "items_archive": select(archive).where(archive.c.store_id == store_id)
+        .order_by(archive.c.id),
+        "items_tags_archive": select(archive_links.c.item_id, archive_links.c.tag_id)
+        .where(archive_links.c.item_id.in_(archived_ids))
+        .order_by(archive_links.c.item_id, archive_links.c.tag_id),
+    }
+    return {table: [dict(row) for row in conn.execute(stmt).mappings()]
+            for table, stmt in statements.items()}
+
+
+def _delete_store_rows(conn, store_id):
+    items, tags, stores = ItemModel.__table__, TagModel.__table__, StoreModel.__table__
+    links = ItemTags.__table__
+    archive, archive_links = ItemArchiveModel.__table__, ItemTagsArchive.__table__
+    item_ids = select(items.c.id).where(items.c.store_id == store_id)
+    archived_ids = select(archive.c.id).where(archive.c.store_id == store_id)
+    conn.execute(delete(archive_links).where(archive_links.c.item_id.in_(archived_ids)))
+    conn.execute(delete(archive).where(archive.c.store_id == store_id))
+    conn.execute(delete(links).where(links.c.item_id.in_(item_ids)))
+    conn.execute(delete(items).where(items.c.store_id == store_id))
+    conn.execute(delete(tags).where(tags.c.store_id == store_id))
+    conn.execute(delete(stores).where(stores.c.id == store_id))
+
+
+def _place(store_id, shard, moving):
+    """Set a store's shard and fence in the shard map and bump the map
+    version, so every worker drops its cached placements.
+
+    Setting the fence waits (on Postgres) for the writes to the store that
+    hold its entry FOR SHARE (_fence_writes) to commit.
+    """
+    table = ShardMapVersionModel.__table__
+    with db.engine.begin() as conn:
+        conn.execute(update(StoreShardModel)
+                     .where(StoreShardModel.store_id == store_id)
+                     .values(shard=shard, moving=moving))
+        bumped = conn.execute(
+            update(table).where(table.c.id == 1).values(version=table.c.version + 1)
+        ).rowcount
+        if not bumped:  # tables made by create_all(), not by the migration
+            conn.execute(insert(table).values(id=1, version=1))
+    _router().forget(store_id)
+
+
+def move_store(store_id, target):
+    """Copy a store with its items, tags and links to 'target', repoint the
+    shard map, then delete it from the source shard.
+
+    Commits writing to the store raise StoreMoving from the fence until the
+    shard map points to 'target'. If the store's rows on the source changed anyway
+    while they were copied (writes that don't go through the API), the
+    move is rolled back and RuntimeError is raised; just run it again.
+    The source rows are deleted SHARD_MOVE_GRACE seconds after the repoint,
+    so reads that were routed to the source before it finish first.
+    """
+    router = _router()
+    source = router.shard_for_store(store_id, cached=False)
+    if source is None:
+        raise RuntimeError(f"Store {store_id} is not in the shard map.")
+    if source == target:
+        return 0
+
+    _place(store_id, source, moving=True)
+    try:
+        with router.engine(source).connect() as conn:
+            rows = _store_rows(conn, store_id)
+
+        with router.engine(target).begin() as conn:
+            for table, table_rows in rows.items():
+                if table_rows:
+                    conn.execute(insert(db.metadata.tables[table]), table_rows)
+
+        with router.engine(source).connect() as conn:
+            changed = _store_rows(conn, store_id) != rows
+        if changed:
+            with router.engine(target).begin() as conn:
+                _delete_store_rows(conn, store_id)
+            raise RuntimeError(f"Store {store_id} changed during the move; rolled back.")
+
+        _place(store_id, target, moving=False)
+    except BaseException:
+        _place(store_id, source, moving=False)
+        raise
+
+    time.sleep(router.move_grace)
+    with router.engine(source).begin() as conn:
+        _delete_store_rows(conn, store_id)
+
+    return len(rows["items"])
+
+
+def plan_rebalance(tolerance=0.1):
+    """Greedy plan of (store_id, source, target, items) moves that brings
+    every shard within 'tolerance' of the average item count."""
+    router = _router()
+    sizes = {}  # shard -> {store_id: items}
+    for shard in router.shards():
+        with router.engine(shard).connect() as conn:
+            stores = dict.fromkeys(conn.execute(select(StoreModel.id)).scalars(), 0)
+            stores.update(conn.execute(
+                select(ItemModel.store_id, func.count()).group_by(ItemModel.store_id)
+            ).all())
+        sizes[shard] = stores
+
+    totals = {shard: sum(stores.values()) for shard, stores in sizes.items()}
+    average = sum(totals.values()) / len(totals)
+    plan = []
+
+    while True:
+        heavy = max(totals, key=totals.get)
+        light = min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        if totals[heavy] - average <= tolerance * average or gap <= 1:
+            break
+        # The store that best closes half the gap without overshooting.
+        movable = [(s, n) for s, n in sizes[heavy].items() if 0 < n < gap]
+        if not movable:
+            break
+        store_id, items = min(movable, key=lambda sn: abs(sn[1] - gap / 2))
+        plan.append((store_id, heavy, light, items))
+        sizes[light][store_id] = sizes[heavy].pop(store_id)
+        totals[heavy] -= items
+        totals[light] += items
+
+    return plan
+
+
+# --------------------------------- CLI -------------------------------------- #
+
+shards_cli = AppGroup("shards", help="Manage store shards.")
+
+
+@shards_cli.command("init")
+def init_command():
+    """Create the tables on every shard, register existing stores in the
+    shard map and seed the id sequences. Safe to run again."""
+    router = _router()
+    if not router.enabled:
+        raise click.UsageError("SHARD_DATABASE_URLS is not set.")
+
+    for shard in router.shards():
+        engine = router.engine(shard)
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            stores = conn.execute(select(StoreModel.id, StoreModel.name)).all()
+            seeded = set(conn.execute(select(ShardSequenceModel.name)).scalars())
+            for model in SEQUENCE_MODELS:
+                table = model.__tablename__
+                if table in seeded:
+                    continue
+                start = max(conn.execute(select(func.max(model.id))).scalar() or 0,
+                            shard * router.id_span) + 1
+                if start >= (shard + 1) * router.id_span:
+                    raise click.ClickException(
+                        f"Shard {shard}: '{table}' ids exceed SHARD_ID_SPAN.")
+                conn.execute(insert(ShardSequenceModel).values(name=table, next_id=start))
+
+        with db.engine.begin() as conn:
+            known = set(conn.execute(select(StoreShardModel.store_id)).scalars())
+            new = [{"store_id": i, "name": n, "shard": shard}
+                   for i, n in stores if i not in known]
+            if new:
+                conn.execute(insert(StoreShardModel), new)
+        click.echo(f"shard {shard}: ready ({len(stores)} stores)")
+
+
+@shards_cli.command("status")
+def status_command():
+    """Show stores, items and tags per shard."""
+    router = _router()
+    if not router.enabled:
+        raise click.UsageError("SHARD_DATABASE_URLS is not set.")
+    for shard in router.shards():
+        with router.engine(shard).connect() as conn:
+            counts = [conn.execute(select(func.count()).select_from(m)).scalar()
+                      for m in (StoreModel, ItemModel, TagModel)]
+        click.echo(f"shard {shard}: {counts[0]} stores, {counts[1]} items, {counts[2]} tags")
+
+
+@shards_cli.command("move")
+@click.argument("store_id", type=int)
+@click.argument("target", type=int)
+def move_command(store_id, target):
+    """Move STORE_ID to shard TARGET."""
+    router = _router()
+    if not router.enabled or target not in router.shards():
+        raise click.UsageError("Unknown target shard.")
+    try:
+        items = move_store(store_id, target)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Moved store {store_id} ({items} items) to shard {target}.")
+
+
+@shards_cli.command("rebalance")
+@click.option("--tolerance", default=0.1, show_default=True,
+              help="Allowed deviation from the average items per shard.")
+@click.option("--dry-run", is_flag=True, help="Only print the plan.")
+def rebalance_command(tolerance, dry_run):
+    """Move stores until item counts are even across shards."""
+    if not is_enabled():
+        raise click.UsageError("SHARD_DATABASE_URLS is not set.")
+    plan = plan_rebalance(tolerance)
+    if not plan:
+        click.echo("Shards are balanced.")
+    for store_id, source, target, items in plan:
+        click.echo(f"store {store_id}: shard {source} -> {target} ({items} items)")
+        if not dry_run:
+            try:
+                move_store(store_id, target)
+            except RuntimeError as e:
+                click.echo(f"  skipped: {e}", err=True)
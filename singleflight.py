@@ -0,0 +1,216 @@
+"""
+singleflight.py
+
+Request coalescing for public read endpoints.
+
+When many identical GET requests arrive together (a popular store falling
+out of client caches), only the first one runs the queries, the schema dump
+and the JSON encoding. The others wait for it and get a copy of the same
+response bytes:
+
+    @blp.route("/store/<string:store_id>")
+    class Store(MethodView):
+        @coalesce
+        @blp.response(200, StoreSchema)
+        def get(self, store_id):
+            ...
+
+'coalesce' must be the outermost decorator. Requests are identical when
+method, path, query string and Accept header match, so only use it on
+endpoints whose response doesn't depend on who is asking.
+
+A commit with changes in this process (changefeed.changes_committed) lets
+new requests start a fresh computation instead of joining one that began
+before the commit, so a client reading its own write never gets the old
+data from this worker.
+
+Backends (SINGLEFLIGHT_BACKEND):
+
+    - "local": coalesce requests within this worker process.
+    - "shared": additionally coalesce across the workers on this host. The
+      first worker to take a per-key lockf lock computes the response and
+      writes it to a slot file; workers waiting on the lock read it from
+      there. A response computed in another worker may miss a write
+      committed while it was running.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.exceptions import HTTPException
+
+from changefeed import changes_committed
+from db import commits_held
+
+
+class Flight:
+    """One in-flight computation and the requests waiting for it."""
+
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None  # (status, headers, body)
+        self.error = None     # HTTPException raised by the leader
+
+
+class SharedBackend:
+    """Coalesces a key across processes with lockf on slot files."""
+
+    def __init__(self, directory, slots=4096, timeout=10):
+        self.directory = directory
+        self.slots = slots
+        self.timeout = timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self, key, compute):
+        slot = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+        path = os.path.join(self.directory, str(slot % self.slots))
+        arrived = time.time()
+
+        fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if not self._lock(fd, arrived + self.timeout):
+                return compute()  # the other worker is too slow: don't wait on it
+            # We waited for another worker: use its result if it is for
+            # this key and was written after we arrived.
+            response = self._read(path, key, arrived)
+            if response is None:
+                response = compute()
+                self._write(path, key, response)
+            return response
+        finally:
+            os.close(fd)  # also releases the lock
+
+    @staticmethod
+    def _lock(fd, deadline):
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            pass
+        while time.time() < deadline:
+            time.sleep(0.002)
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                continue
+        return False
+
+    @staticmethod
+    def _read(path, key, arrived):
+        try:
+            with open(path + ".resp", "rb") as f:
+                header = json.loads(f.readline())
+                if header["key"] != key or header["written"] < arrived:
+                    return None
+                return header["status"], header["headers"], f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _write(path, key, response):
+        status, headers, body = response
+        header = {"key": key, "written": time.time(), "status": status,
+                  "headers": headers}
+        tmp = f"{path}.resp.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(body)
+        os.replace(tmp, path + ".resp")
+
+
+class SingleFlight:
+    """Shares one response between identical concurrent requests."""
+
+    def __init__(self, app=None):
+        self._flights = {}  # key -> Flight
+        self._lock = threading.Lock()
+        self.shared = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SINGLEFLIGHT_ENABLED", True)
+        app.config.setdefault("SINGLEFLIGHT_BACKEND", "local")
+        app.config.setdefault("SINGLEFLIGHT_TIMEOUT", 10)
+        app.config.setdefault("SINGLEFLIGHT_SHARED_PATH",
+                              os.path.join(app.instance_path, "singleflight"))
+        app.config.setdefault("SINGLEFLIGHT_SHARED_SLOTS", 4096)
+
+        self.enabled = app.config["SINGLEFLIGHT_ENABLED"]
+        self.timeout = app.config["SINGLEFLIGHT_TIMEOUT"]
+        if app.config["SINGLEFLIGHT_BACKEND"] == "shared":
+            self.shared = SharedBackend(app.config["SINGLEFLIGHT_SHARED_PATH"],
+                                        app.config["SINGLEFLIGHT_SHARED_SLOTS"],
+                                        self.timeout)
+        app.extensions["singleflight"] = self
+        changes_committed.connect(self._on_commit, weak=False)
+
+    def _on_commit(self, session, changes):
+        with self._lock:
+            self._flights.clear()  # running leaders still answer their followers
+
+    def run(self, key, view):
+        """Return view()'s response, or a copy of the one already in flight."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(self.timeout):
+                if flight.error is not None:
+                    raise flight.error
+                if flight.response is not None:
+                    return build_response(flight.response)
+            return view()  # the leader failed or timed out: compute on our own
+
+        def compute():
+            return freeze(view())
+
+        try:
+            response = self.shared.run(key, compute) if self.shared else compute()
+            flight.response = response
+            return build_response(response)
+        except HTTPException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+
+def freeze(rv):
+    """View return value -> (status, headers, body) that can be shared."""
+    response = current_app.make_response(rv)
+    return response.status_code, list(response.headers.items()), response.get_data()
+
+
+def build_response(frozen):
+    status, headers, body = frozen
+    return current_app.response_class(body, status=status, headers=headers)
+
+
+def coalesce(view):
+    """Decorator: coalesce identical concurrent requests to a read view."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        flights = current_app.extensions.get("singleflight")
+        if flights is None or not flights.enabled or commits_held():
+            # Inside an atomic batch the view sees uncommitted writes: don't share.
+            return view(*args, **kwargs)
+        key = f"{request.method} {request.full_path} {request.headers.get('Accept', '')}"
+        return flights.run(key, lambda: view(*args, **kwargs))
+
+    return wrapper
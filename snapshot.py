@@ -0,0 +1,279 @@
+"""
+snapshot.py
+
+In-memory snapshot of the store and tag catalogue.
+
+Stores and tags are few and rarely change, yet nearly every request reads
+them: "does store 3 exist?" before creating an item, the nested 'store' of
+every item and tag in a response, the tag list of a store. Each worker
+keeps a read-only copy of both tables instead, loaded at worker start, and
+answers those from memory:
+
+    snapshot = current()
+    if snapshot is not None and snapshot.has_store(store_id):
+        ...
+
+The copy is compact: ids in sorted arrays searched with bisect, names in
+parallel lists, plus name -> id dicts for the uniqueness checks.
+
+Every change to a store or a tag bumps the 'catalogue_version' row in the
+same transaction (changefeed.record). A worker re-reads that one number at
+most every SNAPSHOT_CHECK_INTERVAL seconds and reloads the whole snapshot
+when it moved; its own commits mark the snapshot stale right away. A
+snapshot is replaced, never modified, so readers need no lock.
+
+Changes by other workers are seen up to SNAPSHOT_CHECK_INTERVAL late, so
+a lookup that misses the snapshot is not trusted: callers fall back to the
+database (see find_store) and only hits skip SQL. Writes don't trust hits
+either: their INSERT requires the store or tag to still exist
+(writepath.py), and when it returns nothing missing_store() asks the
+database why.
+
+With SNAPSHOT_ENABLED off, current() returns None and every caller uses
+the database as before.
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app
+from flask_smorest import abort
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from changefeed import CATALOGUE, changes_committed
+from db import db
+from models import CatalogueVersionModel, StoreModel, TagModel
+from sharding import check_placement
+
+
+def _find(ids, ident):
+    """Index of 'ident' in the sorted array 'ids', or -1."""
+    try:
+        ident = int(ident)
+    except (TypeError, ValueError):
+        return -1
+    index = bisect_left(ids, ident)
+    return index if index < len(ids) and ids[index] == ident else -1
+
+
+class Snapshot:
+    """Read-only copy of the stores and tags, indexed by id and by name."""
+
+    __slots__ = ("versions", "store_ids", "store_names", "store_by_name",
+                 "tag_ids", "tag_names", "tag_store_ids", "tag_by_name", "store_tags")
+
+    def __init__(self, versions, stores, tags):
+        """
+        :param versions: Catalogue version of each database read.
+        :param stores: (id, name) rows.
+        :param tags: (id, store_id, name) rows.
+        """
+        self.versions = versions
+        # A store being moved between shards is read twice: set() drops one.
+        stores = sorted(set(stores))
+        tags = sorted(set(tags))
+
+        self.store_ids = array("q", (row[0] for row in stores))
+        self.store_names = [row[1] for row in stores]
+        self.store_by_name = {name: store_id for store_id, name in stores}
+
+        self.tag_ids = array("q", (row[0] for row in tags))
+        self.tag_store_ids = array("q", (row[1] for row in tags))
+        self.tag_names = [row[2] for row in tags]
+        self.tag_by_name = {(store_id, name): tag_id for tag_id, store_id, name in tags}
+        self.store_tags = {}  # store id -> indexes of its tags, in id order
+        for index, (_, store_id, _) in enumerate(tags):
+            self.store_tags.setdefault(store_id, []).append(index)
+
+    # ------------------------------- stores --------------------------------- #
+
+    def has_store(self, store_id):
+        return _find(self.store_ids, store_id) >= 0
+
+    def store(self, store_id):
+        """The store as {"id", "name"}, or None."""
+        index = _find(self.store_ids, store_id)
+        if index < 0:
+            return None
+        return {"id": self.store_ids[index], "name": self.store_names[index]}
+
+    def stores(self):
+        return [{"id": store_id, "name": name}
+                for store_id, name in zip(self.store_ids, self.store_names)]
+
+    def store_id(self, name):
+        return self.store_by_name.get(name)
+
+    # -------------------------------- tags ---------------------------------- #
+
+    def tag(self, tag_id):
+        """The tag as {"id", "name", "store_id"}, or None."""
+        index = _find(self.tag_ids, tag_id)
+        if index < 0:
+            return None
+        return {"id": self.tag_ids[index], "name": self.tag_names[index],
+                "store_id": self.tag_store_ids[index]}
+
+    def tags_of(self, store_id):
+        """Tags of a store as {"id", "name"}, in id order."""
+        return [{"id": self.tag_ids[index], "name": self.tag_names[index]}
+                for index in self.store_tags.get(int(store_id), ())]
+
+    def tag_id(self, store_id, name):
+        return self.tag_by_name.get((int(store_id), name))
+
+
+class Catalogue:
+    """Flask extension keeping this worker's catalogue Snapshot current.
+
+    Must be initialised after 'db.init_app' and ShardRouter.
+    """
+
+    def __init__(self, app=None):
+        self.snapshot = None
+        self.enabled = False
+        self._stale = True
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SNAPSHOT_ENABLED", True)
+        app.config.setdefault("SNAPSHOT_CHECK_INTERVAL", 1.0)
+
+        self.enabled = app.config["SNAPSHOT_ENABLED"]
+        self.check_interval = app.config["SNAPSHOT_CHECK_INTERVAL"]
+        app.extensions["snapshot"] = self
+        if not self.enabled:
+            return
+
+        changes_committed.connect(self._on_commit, weak=False)
+        with app.app_context():
+            try:
+                self.refresh()
+            except SQLAlchemyError:
+                # No tables yet (e.g. 'flask db upgrade'): loaded on first use.
+                self.snapshot = None
+
+    def _on_commit(self, session, changes):
+        if any(row["entity"] in CATALOGUE for row in changes):
+            self._stale = True
+
+    def _engines(self):
+        router = current_app.extensions["sharding"]
+        if router.enabled:
+            return [router.engine(shard) for shard in router.shards()]
+        return [db.engine]
+
+    def _version(self, conn):
+        return conn.execute(
+            select(CatalogueVersionModel.version).where(CatalogueVersionModel.id == 1)
+        ).scalar() or 0
+
+    def _versions(self):
+        versions = []
+        for engine in self._engines():
+            with engine.connect() as conn:
+                versions.append(self._version(conn))
+        return tuple(versions)
+
+    def refresh(self):
+        """Load a new snapshot from every database (one per shard)."""
+        # Cleared before reading, so a commit from now on marks it again.
+        self._stale = False
+        versions, stores, tags = [], [], []
+        for engine in self._engines():
+            with engine.connect() as conn:
+                # Version first: a change committed in between only makes
+                # the next check reload again.
+                versions.append(self._version(conn))
+                stores.extend(conn.execute(select(StoreModel.id, StoreModel.name)).tuples())
+                tags.extend(conn.execute(
+                    select(TagModel.id, TagModel.store_id, TagModel.name)
+                ).tuples())
+        self._checked = time.monotonic()
+        self.snapshot = Snapshot(tuple(versions), stores, tags)
+        return self.snapshot
+
+    def get(self):
+        """The current snapshot, reloaded first if it is out of date.
+
+        Returns the previous snapshot (or None) if the database can't be
+        read.
+        """
+        snapshot = self.snapshot
+        if (snapshot is not None and not self._stale
+                and time.monotonic() - self._checked < self.check_interval):
+            return snapshot
+
+        with self._lock:
+            if self.snapshot is not snapshot:  # reloaded while we waited
+                return self.snapshot
+            try:
+                if (snapshot is None or self._stale
+                        or self._versions() != snapshot.versions):
+                    return self.refresh()
+                self._checked = time.monotonic()
+            except SQLAlchemyError:
+                self._stale = True  # try again on the next call
+                current_app.logger.exception("Could not load the catalogue snapshot.")
+            return snapshot
+
+    def invalidate(self):
+        self._stale = True
+
+
+def current():
+    """This worker's catalogue snapshot, or None when disabled/unavailable."""
+    catalogue = current_app.extensions.get("snapshot")
+    if catalogue is None or not catalogue.enabled:
+        return None
+    return catalogue.get()
+
+
+def missing_store(store_id):
+    """Whether the store is missing from the database, asked after a write
+    that requires it returned nothing. A snapshot that still has it is
+    stale (another worker deleted it) and is reloaded. Raises StoreMoving
+    if the store was moved off the shard the request was routed to."""
+    if StoreModel.query.get(store_id) is not None:
+        return False
+    check_placement(store_id)
+    snapshot = current()
+    if snapshot is not None and snapshot.store(store_id) is not None:
+        current_app.extensions["snapshot"].invalidate()
+    return True
+
+
+def store_of(obj):
+    """The store of an item or tag as {"id", "name"}: from the snapshot if
+    it is there, else the 'store' relationship (loading it)."""
+    snapshot = current()
+    store = snapshot.store(obj.store_id) if snapshot is not None else None
+    return store if store is not None else obj.store
+
+
+def find_store(store_id):
+    """The store as {"id", "name"}, or None. Only a snapshot miss costs a
+    query (on the shard 'use_store' routed the request to)."""
+    snapshot = current()
+    store = snapshot.store(store_id) if snapshot is not None else None
+    if store is not None:
+        return store
+    store = StoreModel.query.get(store_id)
+    if store is None:
+        return None
+    if snapshot is not None:
+        current_app.extensions["snapshot"].invalidate()  # created by another worker
+    return {"id": store.id, "name": store.name}
+
+
+def get_store_or_404(store_id):
+    store = find_store(store_id)
+    if store is None:
+        abort(404)
+    return store
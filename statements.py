@@ -0,0 +1,154 @@
+"""
+statements.py
+
+Cached statements for the hot queries of the resources, and compile cache
+statistics (GET /stats/sql).
+
+SQLAlchemy caches the compiled SQL of every statement per engine, keyed by
+the statement's structure. What a handler building a Query on every request
+still pays is constructing it and computing that key. The statements here
+are lambda_stmt()s: the lambdas' code is the key and the variables they
+close over become bound parameters, so after the first call a lookup is a
+cache hit without rebuilding anything:
+
+    user_id = db.session.scalar(user_id_by_username(username))
+
+Config (app.config):
+
+    SQL_COMPILED_CACHE_SIZE  -> compiled statements kept per engine
+                                (create_engine's query_cache_size). Set in
+                                SQLALCHEMY_ENGINE_OPTIONS before db.init_app.
+    SQL_LAMBDA_CACHE_SIZE    -> statements kept for the lambdas below.
+    SQL_PREPARE_THRESHOLD    -> on Postgres with the psycopg (3) driver
+                                ("postgresql+psycopg://"), executions of a
+                                query before it becomes a server-side
+                                prepared statement; None turns preparing
+                                off (e.g. behind pgbouncer in transaction
+                                mode). psycopg2 has no server-side prepares.
+"""
+
+import threading
+
+from flask import current_app
+from sqlalchemy import event, lambda_stmt, select
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+from sqlalchemy.util import LRUCache
+
+from db import db
+from models import ItemModel, UserModel
+
+
+# Shared by every statement below; resized by StatementCache.init_app.
+LAMBDA_CACHE = LRUCache(1000)
+
+
+class EngineStats:
+    """Compile cache outcomes of one engine's executions."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0  # statements that can't be cached (e.g. raw text)
+        self._lock = threading.Lock()
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        outcome = getattr(context, "cache_hit", None)
+        with self._lock:
+            if outcome is CACHE_HIT:
+                self.hits += 1
+            elif outcome is CACHE_MISS:
+                self.misses += 1
+            else:
+                self.uncached += 1
+
+    def report(self, name):
+        cached = self.hits + self.misses
+        cache = self.engine._compiled_cache
+        return {
+            "engine": name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncached": self.uncached,
+            "hit_rate": round(self.hits / cached, 4) if cached else None,
+            "compiled_cache_size": len(cache) if cache is not None else 0,
+            "compiled_cache_capacity": cache.capacity if cache is not None else 0,
+        }
+
+
+class StatementCache:
+    """Flask extension: statement cache sizing, prepares and statistics.
+
+    Must be initialised after 'db.init_app', since it hooks the engines.
+    """
+
+    def __init__(self, app=None):
+        self._stats = {}  # bind key -> EngineStats
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SQL_LAMBDA_CACHE_SIZE", 1000)
+        app.config.setdefault("SQL_PREPARE_THRESHOLD", 5)
+
+        LAMBDA_CACHE.capacity = app.config["SQL_LAMBDA_CACHE_SIZE"]
+        threshold = app.config["SQL_PREPARE_THRESHOLD"]
+        with app.app_context():
+            engines = dict(db.engines)
+        for key, engine in engines.items():
+            stats = self._stats[key or "default"] = EngineStats(engine)
+            event.listen(engine, "after_cursor_execute", stats.count)
+            if engine.dialect.driver == "psycopg":
+                event.listen(engine, "connect", _prepare_threshold(threshold))
+        app.extensions["statements"] = self
+
+    def report(self):
+        return {
+            "lambda_cache_size": len(LAMBDA_CACHE),
+            "lambda_cache_capacity": LAMBDA_CACHE.capacity,
+            "engines": [stats.report(name) for name, stats in self._stats.items()],
+        }
+
+
+def _prepare_threshold(threshold):
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.prepare_threshold = threshold
+    return connect
+
+
+def report():
+    return current_app.extensions["statements"].report()
+
+
+# ------------------------------ statements --------------------------------- #
+
+def items_in_price_range(min_cents=None, max_cents=None):
+    """readpath.ITEM_COLUMNS of the live items with price_cents in the
+    inclusive range, in id order (ItemList.get)."""
+    stmt = lambda_stmt(
+        lambda: select(ItemModel.id, ItemModel.name, ItemModel.price_cents,
+                       ItemModel.description, ItemModel.store_id)
+        .where(ItemModel.deleted_at.is_(None)).order_by(ItemModel.id),
+        lambda_cache=LAMBDA_CACHE,
+    )
+    if min_cents is not None:
+        stmt += lambda s: s.where(ItemModel.price_cents >= min_cents)
+    if max_cents is not None:
+        stmt += lambda s: s.where(ItemModel.price_cents <= max_cents)
+    return stmt
+
+
+def user_id_by_username(username):
+    """Id of the user with this username (UserRegister.post)."""
+    return lambda_stmt(
+        lambda: select(UserModel.id).where(UserModel.username == username).limit(1),
+        lambda_cache=LAMBDA_CACHE,
+    )
+
+
+def login_by_username(username):
+    """Id and password hash of a user (UserLogin.post)."""
+    return lambda_stmt(
+        lambda: select(UserModel.id, UserModel.password).where(UserModel.username == username),
+        lambda_cache=LAMBDA_CACHE,
+    )
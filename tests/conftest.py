@@ -0,0 +1,55 @@
+"""
+Fixtures shared by the tests: an app on a fresh SQLite database per test,
+its test client, and the headers of a logged-in user with a fresh token.
+"""
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from db import db
+from models import UserModel
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    """Settings read by create_app; test modules override them with an
+    autouse fixture of their own."""
+    monkeypatch.setenv("RATELIMIT_ENABLED", "False")
+    monkeypatch.setenv("JOBS_UPLOAD_DIR", str(tmp_path / "uploads"))
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(f"sqlite:///{tmp_path / 'data.db'}")
+    app.config["TESTING"] = True
+    with app.app_context():
+        # The default database only: shard binds left on the shared db by
+        # an earlier sharded app have no engine here (see test_sharding).
+        db.create_all(bind_key=None)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(app):
+    """Authorization header of a user with a fresh access token."""
+    with app.app_context():
+        user = UserModel(username="tester", password="secret")
+        db.session.add(user)
+        db.session.commit()
+        token = create_access_token(identity=str(user.id), fresh=True)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def store(client):
+    """A store with no items, as returned by POST /store."""
+    return client.post("/store", json={"name": "Shop"}).get_json()
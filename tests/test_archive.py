@@ -0,0 +1,127 @@
+from archive import archive_items
+from db import db
+from models import ItemTags, ItemTagsArchive
+
+
+def create_item(client, store, name):
+    response = client.post("/item", json={"name": name, "price": 2.5, "store_id": store["id"]})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def create_tag(client, store, name="sale"):
+    response = client.post(f"/store/{store['id']}/tag", json={"name": name})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_deleted_item_is_hidden_unless_include_archived(client, auth, store):
+    item = create_item(client, store, "Chair")
+
+    assert client.delete(f"/item/{item['id']}", headers=auth).status_code == 200
+
+    assert client.get(f"/item/{item['id']}").status_code == 404
+    assert client.get("/item").get_json() == []
+    archived = client.get(f"/item/{item['id']}?include_archived=true").get_json()
+    assert archived["deleted_at"] is not None
+    assert archived["archived_at"] is None
+
+
+def test_live_items_have_no_archive_fields(client, store):
+    item = create_item(client, store, "Chair")
+
+    for body in (item, client.get(f"/item/{item['id']}").get_json(),
+                 client.get("/item?include_archived=true").get_json()[0]):
+        assert "deleted_at" not in body
+        assert "archived_at" not in body
+
+
+def test_archive_moves_deleted_items(app, client, auth, store):
+    old = create_item(client, store, "Old")
+    create_item(client, store, "New")  # the newest item is never archived
+    client.delete(f"/item/{old['id']}", headers=auth)
+
+    with app.app_context():
+        assert archive_items(pause=0) == 1
+
+    archived = client.get(f"/item/{old['id']}?include_archived=true").get_json()
+    assert archived["archived_at"] is not None
+    assert [item["name"] for item in client.get("/item").get_json()] == ["New"]
+
+
+def test_delete_tag_of_deleted_item(app, client, auth, store):
+    item = create_item(client, store, "Chair")
+    tag = create_tag(client, store)
+    client.post(f"/item/{item['id']}/tag/{tag['id']}")
+    client.delete(f"/item/{item['id']}", headers=auth)
+
+    assert client.delete(f"/tag/{tag['id']}").status_code == 202
+
+    archived = client.get(f"/item/{item['id']}?include_archived=true").get_json()
+    assert archived["deleted_at"] is not None
+    assert archived["tags"] == []
+    with app.app_context():
+        assert db.session.query(ItemTags).count() == 0
+
+
+def test_tag_in_use_keeps_links_of_deleted_items(client, auth, store):
+    live = create_item(client, store, "Chair")
+    deleted = create_item(client, store, "Table")
+    tag = create_tag(client, store)
+    client.post(f"/item/{live['id']}/tag/{tag['id']}")
+    client.post(f"/item/{deleted['id']}/tag/{tag['id']}")
+    client.delete(f"/item/{deleted['id']}", headers=auth)
+
+    assert client.delete(f"/tag/{tag['id']}").status_code == 400
+
+    archived = client.get(f"/item/{deleted['id']}?include_archived=true").get_json()
+    assert archived["tags"] == [{"id": tag["id"], "name": tag["name"]}]
+
+
+def test_delete_tag_of_archived_item(app, client, auth, store):
+    old = create_item(client, store, "Old")
+    create_item(client, store, "New")
+    tag = create_tag(client, store)
+    client.post(f"/item/{old['id']}/tag/{tag['id']}")
+    client.delete(f"/item/{old['id']}", headers=auth)
+    with app.app_context():
+        archive_items(pause=0)
+        assert db.session.query(ItemTagsArchive).count() == 1
+
+    assert client.delete(f"/tag/{tag['id']}").status_code == 202
+
+    with app.app_context():
+        assert db.session.query(ItemTagsArchive).count() == 0
+    assert client.get(f"/item/{old['id']}?include_archived=true").get_json()["tags"] == []
+
+
+def test_unlink_tag(client, auth, store):
+    item = create_item(client, store, "Chair")
+    tag = create_tag(client, store)
+    client.post(f"/item/{item['id']}/tag/{tag['id']}")
+
+    response = client.delete(f"/item/{item['id']}/tag/{tag['id']}")
+    assert response.status_code == 200
+    assert response.get_json()["item"]["tags"] == []
+    assert client.delete(f"/item/{item['id']}/tag/{tag['id']}").status_code == 404
+
+
+def test_unlink_tag_of_deleted_item(client, auth, store):
+    item = create_item(client, store, "Chair")
+    tag = create_tag(client, store)
+    client.post(f"/item/{item['id']}/tag/{tag['id']}")
+    client.delete(f"/item/{item['id']}", headers=auth)
+
+    assert client.delete(f"/item/{item['id']}/tag/{tag['id']}").status_code == 404
+
+
+def test_put_recreates_deleted_item(app, client, auth, store):
+    item = create_item(client, store, "Chair")
+    client.delete(f"/item/{item['id']}", headers=auth)
+
+    response = client.put(f"/item/{item['id']}",
+                          json={"name": "Chair", "price": 3, "store_id": store["id"]},
+                          headers=auth)
+
+    assert response.status_code == 200
+    assert client.get(f"/item/{item['id']}").get_json()["price"] == 3.0
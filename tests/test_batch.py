@@ -0,0 +1,83 @@
+"""
+POST /batch: references between requests, and atomic batches rolling back
+every write, including the jobs their requests queue.
+"""
+
+from sqlalchemy import func, select
+
+from db import db
+from jobs import jobs_table
+from models import StoreModel
+
+
+def count(app, stmt):
+    with app.app_context():
+        return db.session.scalar(stmt)
+
+
+def stores(app):
+    return count(app, select(func.count()).select_from(StoreModel))
+
+
+def jobs(app):
+    return count(app, select(func.count()).select_from(jobs_table))
+
+
+def test_later_requests_use_earlier_results(client):
+    response = client.post("/batch", json={"requests": [
+        {"id": "store", "method": "POST", "path": "/store", "body": {"name": "Shop"}},
+        {"method": "POST", "path": "/item",
+         "body": {"name": "Chair", "price": 9.5, "store_id": "{store.id}"}},
+    ]})
+
+    assert response.status_code == 200
+    created, item = response.get_json()["responses"]
+    assert (created["status"], item["status"]) == (201, 201)
+    assert item["body"]["store"]["id"] == created["body"]["id"]
+
+
+def test_atomic_batch_rolls_back_on_failure(app, client):
+    response = client.post("/batch", json={"atomic": True, "requests": [
+        {"method": "POST", "path": "/store", "body": {"name": "Shop"}},
+        {"method": "POST", "path": "/store", "body": {"name": "Shop"}},
+    ]})
+
+    assert response.status_code == 400
+    assert response.get_json()["committed"] is False
+    assert stores(app) == 0
+
+
+def test_error_handlers_answer_sub_requests(client, store):
+    response = client.post("/batch", json={"requests": [
+        {"method": "DELETE", "path": f"/store/{store['id']}"},
+    ]})
+
+    (deleted,) = response.get_json()["responses"]
+    assert deleted["status"] == 401  # not a 500: the JWT error handler ran
+    assert deleted["body"]["error"] == "authorization_required"
+
+
+def test_atomic_batch_rolls_back_queued_jobs(app, client, auth, store):
+    response = client.post("/batch", headers=auth, json={"atomic": True, "requests": [
+        {"method": "DELETE", "path": f"/store/{store['id']}",
+         "headers": {"Prefer": "respond-async"}},
+        {"method": "POST", "path": "/store", "body": {"name": store["name"]}},
+    ]})
+
+    responses = response.get_json()["responses"]
+    assert [sub["status"] for sub in responses] == [202, 400]
+    assert response.get_json()["committed"] is False
+    assert jobs(app) == 0
+
+
+def test_atomic_batch_commits_queued_jobs(app, client, auth, store):
+    response = client.post("/batch", headers=auth, json={"atomic": True, "requests": [
+        {"method": "POST", "path": "/store", "body": {"name": "Other"}},
+        {"method": "DELETE", "path": f"/store/{store['id']}",
+         "headers": {"Prefer": "respond-async"}},
+    ]})
+
+    assert response.get_json()["committed"] is True
+    job = response.get_json()["responses"][1]["body"]
+    assert client.get(f"/jobs/{job['id']}", headers=auth).get_json()["status"] == "queued"
+    assert (stores(app), jobs(app)) == (2, 1)
@@ -0,0 +1,68 @@
+"""
+GET /changes: cursors resume where the last call stopped, 'since=latest'
+skips the history, and 'store_id' follows a single store.
+"""
+
+import pytest
+
+
+def changes(client, **params):
+    response = client.get("/changes", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def new_item(client, store, name):
+    response = client.post("/item", json={"name": name, "price": 1, "store_id": store["id"]})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_cursor_resumes_after_the_last_change(client, auth, store):
+    first = changes(client)
+    assert [(c["entity"], c["op"]) for c in first["changes"]] == [("store", "create")]
+
+    item = new_item(client, store, "Chair")
+    assert client.delete(f"/item/{item['id']}", headers=auth).status_code == 200
+    later = changes(client, since=first["cursor"])
+
+    assert [(c["entity"], c["entity_id"], c["op"]) for c in later["changes"]] == [
+        ("item", item["id"], "create"), ("item", item["id"], "delete"),
+    ]
+    assert changes(client, since=later["cursor"])["changes"] == []
+
+
+def test_limit_pages_through_the_feed(client, store):
+    for name in ("a", "b", "c"):
+        new_item(client, store, name)
+
+    page = changes(client, limit=2)
+    assert (len(page["changes"]), page["has_more"]) == (2, True)
+    rest = changes(client, since=page["cursor"], limit=2)
+    assert (len(rest["changes"]), rest["has_more"]) == (2, True)
+    assert page["changes"][-1]["id"] < rest["changes"][0]["id"]
+
+
+def test_since_latest_skips_the_history(client, store):
+    new_item(client, store, "old")
+    latest = changes(client, since="latest")
+    assert latest["changes"] == []
+
+    new_item(client, store, "new")
+    (created,) = changes(client, since=latest["cursor"])["changes"]
+    assert created["data"]["name"] == "new"
+
+
+def test_store_filter(client, store):
+    other = client.post("/store", json={"name": "Other"}).get_json()
+    new_item(client, store, "mine")
+    new_item(client, other, "theirs")
+
+    feed = changes(client, store_id=other["id"])["changes"]
+    assert {c["store_id"] for c in feed} == {other["id"]}
+    assert [c["data"]["name"] for c in feed if c["entity"] == "item"] == ["theirs"]
+
+
+@pytest.mark.parametrize("cursor", ["abc", "1.x"])
+def test_invalid_cursor(client, cursor):
+    assert client.get("/changes", query_string={"since": cursor}).status_code == 400
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+import groupcommit
+
+
+TIMEOUT = 0.3
+
+
+@pytest.fixture(autouse=True)
+def group_commit_env(monkeypatch):
+    monkeypatch.setenv("ITEM_GROUP_COMMIT", "True")
+    monkeypatch.setenv("GROUP_COMMIT_TIMEOUT", str(TIMEOUT))
+
+
+@pytest.fixture
+def items(client, store):
+    """Two items, 'a' and 'b', priced 1."""
+    return [
+        client.post("/item", json={"name": name, "price": 1, "store_id": store["id"]}).get_json()
+        for name in ("a", "b")
+    ]
+
+
+@pytest.fixture
+def stalled(monkeypatch):
+    """Holds the flusher in its first batch until 'release' is set."""
+    entered, release = threading.Event(), threading.Event()
+    write_items = groupcommit.write_items
+
+    def stall(writes):
+        if not entered.is_set():
+            entered.set()
+            release.wait(10)
+        return write_items(writes)
+
+    monkeypatch.setattr(groupcommit, "write_items", stall)
+    yield entered, release
+    release.set()
+
+
+def put_later(app, auth, item_id, data, responses, key=None):
+    def put():
+        responses[key or item_id] = app.test_client().put(f"/item/{item_id}", json=data, headers=auth)
+    thread = threading.Thread(target=put)
+    thread.start()
+    return thread
+
+
+def test_update_is_committed(client, auth, items):
+    response = client.put(f"/item/{items[0]['id']}", json={"price": 4.5}, headers=auth)
+
+    assert response.status_code == 200
+    assert response.get_json()["price"] == 4.5
+    assert client.get(f"/item/{items[0]['id']}").get_json()["price"] == 4.5
+
+
+def test_writes_to_one_item_are_merged(app, client, auth, items, stalled):
+    entered, release = stalled
+    responses = {}
+    first = put_later(app, auth, items[0]["id"], {"price": 2}, responses)
+    entered.wait(5)
+    threads = [put_later(app, auth, items[1]["id"], {"name": "renamed", "price": 3}, responses, 1),
+               put_later(app, auth, items[1]["id"], {"price": 4}, responses, 2)]
+    time.sleep(0.05)
+    release.set()
+    for thread in (first, *threads):
+        thread.join()
+
+    assert [responses[key].status_code for key in (1, 2)] == [200, 200]
+    item = client.get(f"/item/{items[1]['id']}").get_json()
+    assert (item["name"], item["price"]) == ("renamed", 4.0)
+
+
+def test_queued_write_is_withdrawn_on_timeout(app, client, auth, items, stalled):
+    entered, release = stalled
+    responses = {}
+    taken = put_later(app, auth, items[0]["id"], {"price": 2}, responses)
+    entered.wait(5)
+
+    queued = client.put(f"/item/{items[1]['id']}", json={"price": 9}, headers=auth)
+    release.set()
+    taken.join()
+    time.sleep(0.1)
+
+    assert queued.status_code == 503
+    assert "not applied" in queued.get_json()["message"]
+    assert client.get(f"/item/{items[1]['id']}").get_json()["price"] == 1.0
+    assert responses[items[0]["id"]].status_code == 200
+
+
+def test_timeout_withdraws_only_its_own_write(app, client, auth, items, stalled):
+    entered, release = stalled
+    responses = {}
+    taken = put_later(app, auth, items[0]["id"], {"price": 2}, responses)
+    entered.wait(5)
+    early = put_later(app, auth, items[1]["id"], {"name": "early"}, responses, "early")
+    time.sleep(TIMEOUT * 2 / 3)
+    late = put_later(app, auth, items[1]["id"], {"price": 7}, responses, "late")
+    early.join()  # timed out while the later write was still within its own timeout
+    release.set()
+    for thread in (taken, late):
+        thread.join()
+
+    assert responses["early"].status_code == 503
+    assert responses["late"].status_code == 200
+    item = client.get(f"/item/{items[1]['id']}").get_json()
+    assert (item["name"], item["price"]) == ("b", 7.0)
+
+
+def test_write_in_a_stuck_commit_gives_up(app, client, auth, items, stalled):
+    entered, release = stalled
+
+    started = time.monotonic()
+    response = client.put(f"/item/{items[0]['id']}", json={"price": 5}, headers=auth)
+    waited = time.monotonic() - started
+
+    assert entered.is_set()
+    assert response.status_code == 503
+    assert "Read the item" in response.get_json()["message"]
+    assert waited < TIMEOUT * 2 + 1
+    release.set()
+    deadline = time.monotonic() + 5
+    while client.get(f"/item/{items[0]['id']}").get_json()["price"] != 5.0:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
@@ -0,0 +1,94 @@
+import io
+import json
+
+import pytest
+
+from db import db
+from importer import CatalogueImporter, read_rows
+from models import ItemModel, StoreModel, TagModel
+
+
+def ndjson(*rows):
+    return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows) + "\n"
+
+
+def run_import(app, text, fmt="ndjson", batch_size=1000, offset=0):
+    with app.app_context():
+        report = CatalogueImporter(batch_size=batch_size).run(
+            read_rows(io.StringIO(text), fmt), offset=offset)
+        return report.to_dict()
+
+
+def test_csv_import_creates_stores_items_and_tags(app):
+    text = ("store,name,price,description,tags\n"
+            "Shop,Chair,9.5,Oak,new|sale\n"
+            "Shop,Table,20,,sale\n"
+            "Market,Lamp,3.25,Brass,\n")
+
+    report = run_import(app, text, fmt="csv")
+
+    assert (report["imported"], report["rejected"], report["offset"]) == (3, 0, 3)
+    with app.app_context():
+        assert sorted(db.session.scalars(db.select(StoreModel.name))) == ["Market", "Shop"]
+        assert db.session.query(TagModel).count() == 2
+        chair = db.session.scalars(db.select(ItemModel).filter_by(name="Chair")).one()
+        assert chair.price == 9.5
+        assert sorted(tag.name for tag in chair.tags) == ["new", "sale"]
+
+
+@pytest.mark.parametrize("row, field", [
+    ({"store": 5, "name": "Chair", "price": 1}, "store"),
+    ({"store": ["Shop"], "name": "Chair", "price": 1}, "store"),
+    ({"store": "Shop", "name": "Chair", "price": 1, "tags": ["new", 7]}, "tags"),
+    ({"store": "Shop", "name": "Chair", "price": 1, "tags": {"name": "new"}}, "tags"),
+    ({"store": "Shop", "name": "Chair", "price": "cheap"}, "price"),
+    ({"name": "Chair", "price": 1}, "store"),
+])
+def test_bad_rows_are_rejected(app, row, field):
+    text = ndjson(row, {"store": "Shop", "name": "Table", "price": 2})
+
+    report = run_import(app, text)
+
+    assert (report["imported"], report["rejected"]) == (1, 1)
+    assert report["rejects"][0]["row"] == 0
+    assert field in report["rejects"][0]["errors"]
+
+
+def test_unparsable_rows_are_rejected(app):
+    report = run_import(app, ndjson("{not json", "[1, 2]", {"store": "Shop", "name": "A", "price": 1}))
+
+    assert (report["imported"], report["rejected"]) == (1, 2)
+
+
+def test_duplicates_are_rejected(app):
+    row = {"store": "Shop", "name": "Chair", "price": 1}
+
+    report = run_import(app, ndjson(row, row))
+
+    assert (report["imported"], report["rejected"]) == (1, 1)
+
+
+def test_offset_resumes_an_import(app):
+    rows = [{"store": "Shop", "name": f"Item {n}", "price": n} for n in range(5)]
+
+    first = run_import(app, ndjson(*rows[:3]), batch_size=2)
+    second = run_import(app, ndjson(*rows), batch_size=2, offset=first["offset"])
+
+    assert first["offset"] == 3
+    assert second["imported"] == 2
+    with app.app_context():
+        assert db.session.query(ItemModel).count() == 5
+
+
+def test_import_endpoint_rejects_bad_row_types(client, auth):
+    body = ndjson({"store": 5, "name": "Chair", "price": 1},
+                  {"store": "Shop", "name": "Table", "price": 2, "tags": [None]},
+                  {"store": "Shop", "name": "Lamp", "price": 3, "tags": ["new"]})
+
+    response = client.post("/import?format=ndjson", data=body, headers=auth,
+                           content_type="application/x-ndjson")
+
+    assert response.status_code == 200
+    report = response.get_json()
+    assert (report["imported"], report["rejected"]) == (1, 2)
+    assert client.get("/item").get_json()[0]["tags"] == [{"id": 1, "name": "new"}]
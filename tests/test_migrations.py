@@ -0,0 +1,88 @@
+"""
+The price cents migrations (b5e0c3f7d218 expand, c9d4a6e1f305 contract) on
+a database with rows, up and back down.
+"""
+
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from flask_migrate import downgrade, upgrade
+
+from app import create_app
+from db import db
+
+
+MIGRATIONS = str(Path(__file__).resolve().parent.parent / "migrations")
+
+BEFORE_CENTS = "a84d1e6f0c52"
+EXPAND = "b5e0c3f7d218"
+CONTRACT = "c9d4a6e1f305"
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    """App context on an empty database, migrated to just before the cents
+    column, with small backfill batches so several are run."""
+    app = create_app(f"sqlite:///{tmp_path / 'migrated.db'}")
+    app.config["MIGRATION_BATCH_SIZE"] = 2
+    with app.app_context():
+        upgrade(directory=MIGRATIONS, revision=BEFORE_CENTS)
+        run("INSERT INTO stores (id, name) VALUES (1, 'Shop')")
+        for item_id, price in enumerate((19.99, 0.1, 5, 1234.5), start=1):
+            add_item(item_id, price)
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def run(sql, **params):
+    with db.engine.begin() as conn:
+        return conn.execute(sa.text(sql), params)
+
+
+def add_item(item_id, price):
+    """An item as the code before the migrations writes it: 'price' only."""
+    run("INSERT INTO items (id, name, price, store_id) VALUES (:id, :name, :price, 1)",
+        id=item_id, name=f"item {item_id}", price=price)
+
+
+def columns():
+    return {column["name"] for column in sa.inspect(db.engine).get_columns("items")}
+
+
+def indexes():
+    return {index["name"] for index in sa.inspect(db.engine).get_indexes("items")}
+
+
+def test_expand_backfills_cents(migrated):
+    upgrade(directory=MIGRATIONS, revision=EXPAND)
+
+    assert {"price", "price_cents"} <= columns()
+    assert "ix_items_price_cents" in indexes()
+    cents = run("SELECT id, price_cents FROM items ORDER BY id").all()
+    assert cents == [(1, 1999), (2, 10), (3, 500), (4, 123450)]
+
+
+def test_contract_picks_up_rows_written_in_between(migrated):
+    upgrade(directory=MIGRATIONS, revision=EXPAND)
+    add_item(5, 2.55)  # the old code still running after the expand step
+    upgrade(directory=MIGRATIONS, revision=CONTRACT)
+
+    assert "price" not in columns()
+    assert run("SELECT price_cents FROM items WHERE id = 5").scalar() == 255
+    assert run("SELECT COUNT(*) FROM items WHERE price_cents IS NULL").scalar() == 0
+
+
+def test_downgrade_restores_prices(migrated):
+    upgrade(directory=MIGRATIONS, revision=CONTRACT)
+    run("UPDATE items SET price_cents = 2000 WHERE id = 1")  # written after the move
+
+    downgrade(directory=MIGRATIONS, revision=EXPAND)
+    assert run("SELECT price FROM items WHERE id = 1").scalar() == 20.0
+
+    downgrade(directory=MIGRATIONS, revision=BEFORE_CENTS)
+    assert "price_cents" not in columns()
+    assert "ix_items_price_cents" not in indexes()
+    prices = run("SELECT price FROM items ORDER BY id").scalars().all()
+    assert prices == [20.0, 0.1, 5, 1234.5]
@@ -0,0 +1,71 @@
+import pytest
+
+from app import create_app
+from db import db
+from ratelimit import parse_limit
+
+
+@pytest.fixture(autouse=True)
+def ratelimit_env(monkeypatch):
+    monkeypatch.setenv("RATELIMIT_ENABLED", "True")
+    monkeypatch.setenv("RATELIMIT_DEFAULT", "100/second")
+    monkeypatch.setenv("RATELIMIT_STORE_LIST", "2/minute")
+
+
+def test_parse_limit():
+    assert parse_limit("100/minute") == (100, 100 / 60)
+    assert parse_limit("5/second") == (5, 5)
+    assert parse_limit(None) is None
+
+
+@pytest.mark.parametrize("spec", ["0/second", "-1/minute", "5/0"])
+def test_parse_limit_rejects_non_positive_limits(spec):
+    with pytest.raises(ValueError):
+        parse_limit(spec)
+
+
+def test_disabled_by_default(monkeypatch, tmp_path):
+    monkeypatch.delenv("RATELIMIT_ENABLED")
+
+    app = create_app(f"sqlite:///{tmp_path / 'other.db'}")
+
+    assert app.config["RATELIMIT_ENABLED"] is False
+    assert "ratelimit" not in app.extensions
+
+
+def test_over_the_limit_gets_429(client):
+    assert [client.get("/store").status_code for _ in range(2)] == [200, 200]
+
+    response = client.get("/store")
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_users_have_their_own_buckets(client, auth):
+    for _ in range(2):
+        client.get("/store")
+    assert client.get("/store").status_code == 429
+
+    assert client.get("/store", headers=auth).status_code == 200
+
+
+def test_clients_behind_a_proxy_share_a_bucket(client):
+    for address in ("10.0.0.1", "10.0.0.2"):
+        client.get("/store", headers={"X-Forwarded-For": address})
+
+    assert client.get("/store", headers={"X-Forwarded-For": "10.0.0.3"}).status_code == 429
+
+
+def test_proxy_fix_keys_clients_by_forwarded_address(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROXY_FIX_X_FOR", "1")
+
+    app = create_app(f"sqlite:///{tmp_path / 'proxied.db'}")
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    for address in ("10.0.0.1", "10.0.0.2"):
+        for _ in range(2):
+            assert client.get("/store", headers={"X-Forwarded-For": address}).status_code == 200
+
+    assert client.get("/store", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 429
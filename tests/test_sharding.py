@@ -0,0 +1,180 @@
+import time
+
+import pytest
+
+import sharding
+from app import create_app
+from db import db
+from models import ItemModel, StoreModel
+from sharding import StoreMoving, move_store, use_store
+from writepath import create_item
+
+
+@pytest.fixture(autouse=True)
+def sharding_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("SHARD_DATABASE_URLS", f"sqlite:///{tmp_path / 'shard1.db'}")
+
+
+@pytest.fixture
+def app(app):
+    """The app with its shards initialised and moves that don't wait."""
+    app.extensions["sharding"].move_grace = 0
+    result = app.test_cli_runner().invoke(args=["shards", "init"])
+    assert result.exit_code == 0, result.output
+    return app
+
+
+@pytest.fixture
+def other_worker(app, tmp_path):
+    """A second app on the same databases, like another worker process."""
+    other = create_app(app.config["SQLALCHEMY_DATABASE_URI"])
+    other.extensions["sharding"].move_grace = 0
+    return other
+
+
+def shard_of_store(app, store_id):
+    with app.app_context():
+        return app.extensions["sharding"].shard_for_store(store_id, cached=False)
+
+
+def set_moving(app, store_id, moving):
+    with app.app_context():
+        sharding._place(store_id, shard_of_store(app, store_id), moving=moving)
+
+
+def new_item(client, store_id, name, auth=None):
+    return client.post("/item", json={"name": name, "price": 1, "store_id": store_id}, headers=auth)
+
+
+def test_items_live_on_their_stores_shard(app, client):
+    stores = [client.post("/store", json={"name": name}).get_json() for name in ("a", "b")]
+    for store in stores:
+        assert new_item(client, store["id"], f"item of {store['name']}").status_code == 201
+
+    assert {shard_of_store(app, store["id"]) for store in stores} == {0, 1}
+    items = client.get("/item").get_json()
+    assert sorted(item["name"] for item in items) == ["item of a", "item of b"]
+    for item in items:
+        assert client.get(f"/item/{item['id']}").status_code == 200
+
+
+def test_move_store(app, client, store):
+    item = new_item(client, store["id"], "Chair").get_json()
+    tag = client.post(f"/store/{store['id']}/tag", json={"name": "sale"}).get_json()
+    client.post(f"/item/{item['id']}/tag/{tag['id']}")
+    source = shard_of_store(app, store["id"])
+
+    with app.app_context():
+        assert move_store(store["id"], 1 - source) == 1
+
+    assert shard_of_store(app, store["id"]) == 1 - source
+    moved = client.get(f"/item/{item['id']}").get_json()
+    assert moved["tags"] == [{"id": tag["id"], "name": "sale"}]
+    assert client.get(f"/store/{store['id']}").get_json()["items"][0]["name"] == "Chair"
+    with app.app_context():
+        with app.extensions["sharding"].engine(source).connect() as conn:
+            assert conn.execute(db.select(StoreModel.id)).all() == []
+            assert conn.execute(db.select(ItemModel.id)).all() == []
+
+
+def test_write_to_a_fenced_store_gets_503(app, client, auth, store):
+    item = new_item(client, store["id"], "Chair").get_json()
+    set_moving(app, store["id"], True)
+
+    created = new_item(client, store["id"], "Table")
+    updated = client.put(f"/item/{item['id']}", json={"price": 5}, headers=auth)
+
+    for response in (created, updated):
+        assert response.status_code == 503
+        assert response.headers["Retry-After"]
+        assert "being moved" in response.get_json()["message"]
+    set_moving(app, store["id"], False)
+    assert [item["name"] for item in client.get("/item").get_json()] == ["Chair"]
+    assert client.get(f"/item/{item['id']}").get_json()["price"] == 1.0
+    assert new_item(client, store["id"], "Table").status_code == 201
+
+
+def test_fenced_commit_outside_a_request_raises_store_moving(app, client, store):
+    set_moving(app, store["id"], True)
+
+    with app.app_context():
+        use_store(store["id"])
+        create_item({"name": "Chair", "price": 1, "store_id": store["id"]})
+        with pytest.raises(StoreMoving):
+            db.session.commit()
+        db.session.rollback()
+        assert db.session.query(ItemModel).count() == 0
+
+
+def test_move_is_rolled_back_when_rows_change(app, client, store, monkeypatch):
+    new_item(client, store["id"], "Chair")
+    source = shard_of_store(app, store["id"])
+    store_rows, calls = sharding._store_rows, []
+
+    def changing(conn, store_id):
+        calls.append(store_id)
+        if len(calls) == 2:  # between the copy and the check
+            conn.exec_driver_sql("UPDATE items SET name = 'changed'")
+            conn.commit()
+        return store_rows(conn, store_id)
+
+    monkeypatch.setattr(sharding, "_store_rows", changing)
+    with app.app_context(), pytest.raises(RuntimeError):
+        move_store(store["id"], 1 - source)
+
+    assert shard_of_store(app, store["id"]) == source
+    with app.app_context():
+        with app.extensions["sharding"].engine(1 - source).connect() as conn:
+            assert conn.execute(db.select(ItemModel.id)).all() == []
+    assert new_item(client, store["id"], "Table").status_code == 201
+
+
+def test_other_workers_follow_a_move(app, client, other_worker, store):
+    new_item(client, store["id"], "Chair")
+    other = other_worker.test_client()
+    assert other.get(f"/store/{store['id']}").status_code == 200  # caches the placement
+    source = shard_of_store(app, store["id"])
+
+    with app.app_context():
+        move_store(store["id"], 1 - source)
+
+    assert other.get(f"/store/{store['id']}").get_json()["items"][0]["name"] == "Chair"
+    assert new_item(other, store["id"], "Table").status_code == 201
+    assert sorted(item["name"] for item in client.get("/item").get_json()) == ["Chair", "Table"]
+
+
+def stale_worker(other_worker, store_id, shard, monkeypatch):
+    """Make 'other_worker' route 'store_id' to 'shard' as if it had cached
+    the placement just before a move and not seen the version bump yet."""
+    router = other_worker.extensions["sharding"]
+    router._map[store_id] = (shard, time.monotonic() + 999)
+    monkeypatch.setattr(router, "_check_version", lambda: None)
+
+
+def test_write_during_the_grace_period_gets_503(app, client, other_worker, store, monkeypatch):
+    new_item(client, store["id"], "Chair")
+    source = shard_of_store(app, store["id"])
+    # The source copy is still there, as during SHARD_MOVE_GRACE.
+    monkeypatch.setattr(sharding, "_delete_store_rows", lambda conn, store_id: None)
+    with app.app_context():
+        move_store(store["id"], 1 - source)
+    stale_worker(other_worker, store["id"], source, monkeypatch)
+
+    assert new_item(other_worker.test_client(), store["id"], "Table").status_code == 503
+
+    with app.app_context():
+        with app.extensions["sharding"].engine(source).connect() as conn:
+            assert conn.execute(db.select(ItemModel.name)).scalars().all() == ["Chair"]
+
+
+def test_write_after_the_source_is_gone_gets_503(app, client, other_worker, store, monkeypatch):
+    new_item(client, store["id"], "Chair")
+    source = shard_of_store(app, store["id"])
+    with app.app_context():
+        move_store(store["id"], 1 - source)
+    stale_worker(other_worker, store["id"], source, monkeypatch)
+    other = other_worker.test_client()
+
+    assert new_item(other, store["id"], "Table").status_code == 503
+    # The 503 re-read the placement: a retry goes to the new shard.
+    assert new_item(other, store["id"], "Table").status_code == 201
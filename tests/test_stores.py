@@ -0,0 +1,86 @@
+"""
+GET /store pages every store's items and tags like GET /store/<id>, in a
+number of queries that doesn't grow with the number of stores.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from db import db
+
+
+@pytest.fixture(autouse=True)
+def no_snapshot(monkeypatch):
+    """Tags from the database, not the catalogue snapshot."""
+    monkeypatch.setenv("SNAPSHOT_ENABLED", "False")
+
+
+@pytest.fixture
+def statements(app):
+    """SQL statements run by the requests made after it is created."""
+    seen = []
+    with app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield seen
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def add_store(client, name, items=0, tags=0):
+    store = client.post("/store", json={"name": name}).get_json()
+    for index in range(items):
+        client.post("/item", json={"name": f"{name} item {index}", "price": 1,
+                                   "store_id": store["id"]})
+    for index in range(tags):
+        client.post(f"/store/{store['id']}/tag", json={"name": f"{name} tag {index}"})
+    return store
+
+
+def test_list_pages_each_store(client):
+    big = add_store(client, "big", items=3, tags=2)
+    small = add_store(client, "small", items=1)
+    add_store(client, "empty")
+
+    stores = client.get("/store?items_limit=2").get_json()
+
+    assert [store["name"] for store in stores] == ["big", "small", "empty"]
+    big_page, small_page, empty_page = stores
+    assert [item["name"] for item in big_page["items"]] == ["big item 0", "big item 1"]
+    assert big_page["items_count"] == 3
+    assert big_page["items_next"].startswith(f"/store/{big['id']}?")
+    assert [tag["name"] for tag in big_page["tags"]] == ["big tag 0", "big tag 1"]
+    assert (big_page["tags_count"], big_page["tags_next"]) == (2, None)
+    assert (small_page["items_count"], small_page["items_next"]) == (1, None)
+    assert (empty_page["items"], empty_page["items_count"], empty_page["tags"]) == ([], 0, [])
+
+    # The next link continues the store's items like GET /store/<id>.
+    rest = client.get(big_page["items_next"]).get_json()
+    assert [item["name"] for item in rest["items"]] == ["big item 2"]
+    assert client.get(f"/store/{small['id']}").get_json()["items_count"] == 1
+
+
+def test_list_matches_single_store_pages(client):
+    for name in ("a", "b"):
+        add_store(client, name, items=4, tags=3)
+
+    for query in ("items_limit=3&tags_limit=1", "items_after=2", "expand=items,tags"):
+        stores = client.get(f"/store?{query}").get_json()
+        for store in stores:
+            assert store == client.get(f"/store/{store['id']}?{query}").get_json()
+
+
+def test_list_queries_do_not_grow_with_stores(client, statements):
+    add_store(client, "first", items=3, tags=3)
+    statements.clear()
+    client.get("/store?items_limit=2&tags_limit=2")
+    few = len(statements)
+
+    for index in range(5):
+        add_store(client, f"more {index}", items=3, tags=3)
+    statements.clear()
+    client.get("/store?items_limit=2&tags_limit=2")
+    assert len(statements) == few
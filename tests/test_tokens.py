@@ -0,0 +1,81 @@
+"""
+CachingJWTManager: repeated requests with one token verify it once, logout
+still revokes a cached token, and the cache honours JWT_DECODE_LEEWAY.
+"""
+
+from datetime import timedelta
+
+import pytest
+from flask_jwt_extended import JWTManager, create_access_token
+
+import tokens
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Number of full decodes (signature checks) done by flask-jwt-extended."""
+    calls = []
+    decode = JWTManager._decode_jwt_from_config
+
+    def counting(self, *args, **kwargs):
+        calls.append(args)
+        return decode(self, *args, **kwargs)
+
+    monkeypatch.setattr(JWTManager, "_decode_jwt_from_config", counting)
+    return calls
+
+
+def bearer(app, **kwargs):
+    """Header with another token for the user of the auth fixture."""
+    with app.app_context():
+        token = create_access_token(identity="1", **kwargs)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_repeated_requests_verify_once(client, auth, decodes):
+    for _ in range(3):
+        assert client.get("/stats/admission", headers=auth).status_code == 200
+    assert len(decodes) == 1
+
+
+def test_logout_revokes_a_cached_token(client, auth, decodes):
+    assert client.get("/stats/admission", headers=auth).status_code == 200
+    assert client.post("/logout", headers=auth).status_code == 200
+
+    response = client.get("/stats/admission", headers=auth)
+    assert response.status_code == 401
+    assert response.get_json()["error"] == "token_revoked"
+    assert len(decodes) == 1  # every check after the first was a cache hit
+
+
+def test_cache_keeps_a_token_for_the_leeway(app, client, auth, decodes):
+    app.config["JWT_DECODE_LEEWAY"] = 30
+    headers = bearer(app, expires_delta=timedelta(seconds=-5))
+
+    for _ in range(2):
+        assert client.get("/stats/admission", headers=headers).status_code == 200
+    assert len(decodes) == 1
+
+
+def test_token_past_the_leeway_is_rejected(app, client, auth):
+    app.config["JWT_DECODE_LEEWAY"] = timedelta(seconds=30)
+    headers = bearer(app, expires_delta=timedelta(seconds=-60))
+
+    response = client.get("/stats/admission", headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()["error"] == "token_expired"
+
+
+def test_cache_entry_expires_at_exp_plus_leeway(app, client, auth):
+    app.config["JWT_DECODE_LEEWAY"] = 30
+    headers = bearer(app, expires_delta=timedelta(seconds=60))
+    assert client.get("/stats/admission", headers=headers).status_code == 200
+
+    (claims, until), = app.extensions["flask-jwt-extended"]._verified.values()
+    assert until == claims["exp"] + 30
+
+
+def test_unsupported_library_version_fails_at_start_up(monkeypatch):
+    monkeypatch.delattr(JWTManager, "_decode_jwt_from_config")
+    with pytest.raises(RuntimeError, match="requirements.txt"):
+        tokens._check_override()
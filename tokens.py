@@ -0,0 +1,178 @@
+"""
+tokens.py
+
+Fast path for JWT verification.
+
+Every protected call decodes the token twice (unverified, then verified),
+rebuilds the claims dict and, with RS/ES algorithms, re-parses the PEM key.
+Here:
+
+    - load_signing_keys() parses asymmetric key files once, at create_app
+      time, and hands PyJWT ready key objects.
+    - CachingJWTManager remembers verified claims by token hash until the
+      token's 'exp' plus JWT_DECODE_LEEWAY (the same window PyJWT accepts),
+      so a client re-using its token skips the decode and signature check
+      entirely. The blocklist, token type and fresh checks still run on
+      every request (they only read the cached claims), so logout and
+      refresh revoke a cached token immediately.
+
+flask-jwt-extended has no public hook that can skip the decode:
+decode_key_loader only picks the key, and @jwt_required calls
+utils.decode_token, which goes straight to
+JWTManager._decode_jwt_from_config. CachingJWTManager overrides that
+private method, so requirements.txt pins flask-jwt-extended to the release
+it was checked against, and init_app fails loudly if the method is gone.
+Re-check the override (and tests/test_tokens.py) before moving the pin.
+
+The cached claims dict is shared between requests: treat get_jwt() as
+read-only.
+
+Users listed in ADMIN_USER_IDS get an 'is_admin' claim in their tokens;
+@admin_required endpoints need it.
+"""
+
+import hashlib
+import inspect
+import math
+import time
+from datetime import timedelta
+from functools import wraps
+
+from flask import current_app
+from flask_jwt_extended import JWTManager, get_jwt, jwt_required
+from flask_smorest import abort
+
+from tracing import span
+
+
+ASYMMETRIC_PREFIXES = ("RS", "PS", "ES", "EdDSA")
+
+
+def load_signing_keys(app, private_key_file=None, public_key_file=None):
+    """Parse PEM key files into key objects for asymmetric JWT algorithms.
+
+    Sets JWT_PRIVATE_KEY / JWT_PUBLIC_KEY. The private key is optional (a
+    service that only verifies tokens doesn't need it). Needs the
+    'cryptography' package, like PyJWT itself does for these algorithms.
+    """
+    if not app.config["JWT_ALGORITHM"].startswith(ASYMMETRIC_PREFIXES):
+        return
+
+    from cryptography.hazmat.primitives.serialization import (
+        load_pem_private_key,
+        load_pem_public_key,
+    )
+
+    if private_key_file:
+        with open(private_key_file, "rb") as f:
+            private_key = load_pem_private_key(f.read(), password=None)
+        app.config["JWT_PRIVATE_KEY"] = private_key
+        app.config["JWT_PUBLIC_KEY"] = private_key.public_key()
+    if public_key_file:
+        with open(public_key_file, "rb") as f:
+            app.config["JWT_PUBLIC_KEY"] = load_pem_public_key(f.read())
+
+
+def _digest(encoded_token):
+    return hashlib.blake2b(encoded_token.encode(), digest_size=16).digest()
+
+
+def _leeway():
+    leeway = current_app.config["JWT_DECODE_LEEWAY"]
+    if isinstance(leeway, timedelta):
+        return leeway.total_seconds()
+    return leeway
+
+
+def _check_override():
+    """Fail at start-up if the private method we override has changed."""
+    method = getattr(JWTManager, "_decode_jwt_from_config", None)
+    if method is None or list(inspect.signature(method).parameters) != [
+        "self", "encoded_token", "csrf_value", "allow_expired",
+    ]:
+        raise RuntimeError(
+            "CachingJWTManager does not support this flask-jwt-extended "
+            "version; install the one pinned in requirements.txt or set "
+            "JWT_VERIFIED_CACHE_SIZE=0."
+        )
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager with a bounded cache of verified token claims.
+
+    JWT_VERIFIED_CACHE_SIZE sets the number of tokens kept (0 disables the
+    cache). When full, the oldest entry is dropped.
+    """
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+        app.config.setdefault("JWT_VERIFIED_CACHE_SIZE", 10000)
+        self._cache_size = app.config["JWT_VERIFIED_CACHE_SIZE"]
+        self._verified = {}  # token digest -> (claims, exp + leeway)
+        if self._cache_size:
+            _check_override()
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        with span("jwt.verify"):
+            return self._decode_cached(encoded_token, csrf_value, allow_expired)
+
+    def _decode_cached(self, encoded_token, csrf_value, allow_expired):
+        if csrf_value is not None or allow_expired or not self._cache_size:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        key = _digest(encoded_token)
+        hit = self._verified.get(key)
+        if hit is not None:
+            if hit[1] > time.time():
+                return hit[0]
+            self._verified.pop(key, None)
+
+        # Raises for invalid or expired tokens; those are never cached.
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+
+        if len(self._verified) >= self._cache_size:
+            try:
+                del self._verified[next(iter(self._verified))]
+            except (KeyError, RuntimeError, StopIteration):
+                pass  # another thread evicted or changed it first
+        self._verified[key] = (claims, claims.get("exp", math.inf) + _leeway())
+        return claims
+
+    def verified_claims(self, encoded_token):
+        """Claims of a valid token through the cache, or None.
+
+        Used before the view (ratelimit.py): the token is decoded at most
+        once, and the view's own verification then hits the cache. Only
+        the signature and expiry are checked here; the view still runs the
+        blocklist, type and fresh checks.
+        """
+        try:
+            return self._decode_cached(encoded_token, None, False)
+        except Exception:
+            return None  # rejected later by @jwt_required
+
+    def clear_verified_cache(self):
+        self._verified.clear()
+
+
+def admin_claims(app, identity):
+    """Extra claims for a new token: 'is_admin' for ADMIN_USER_IDS."""
+    if str(identity) in app.config.get("ADMIN_USER_IDS", ()):
+        return {"is_admin": True}
+    return {}
+
+
+def is_admin():
+    return bool(get_jwt().get("is_admin"))
+
+
+def admin_required(fn):
+    """Like @jwt_required(), and the token must carry the 'is_admin' claim."""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            abort(403, message="Admin privilege required.")
+        return fn(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,476 @@
+"""
+tracing.py
+
+Request tracing: where did the time of one slow request go?
+
+With TRACING_ENABLED each request is recorded as a trace of spans:
+
+    request  GET /store/1                         41.2 ms
+      jwt.verify                                    0.1 ms
+      args.parse                                    0.2 ms
+      handler  stores.Store.get                    32.0 ms
+        sql  SELECT stores.id, ...                  0.4 ms
+        sql  SELECT items.id, ...                  30.9 ms
+      serialize  StoreSchema                        6.3 ms
+      encode  application/json                      2.1 ms
+
+Spans come from:
+
+    - the Blueprint below (used by the user, item, store and tag resources
+      instead of flask_smorest's): argument parsing, the handler and the
+      response schema's dump;
+    - tokens.py / user_cache.py: JWT decoding and the current-user lookup;
+    - engine events: every SQL statement;
+    - the app's JSON provider: encoding the response body (in the format
+      negotiated by negotiation.py).
+
+Trace context uses the W3C 'traceparent' header: a request that carries
+one joins that trace as a child of the caller's span. Every response has
+the trace id in 'X-Trace-Id', so a client can report it with a complaint.
+
+Sampling is tail-based: whether to keep a trace is decided when the
+request has finished. Traces slower than TRACING_SLOW_MS, failed ones
+(5xx), and ones the caller marked as sampled are always kept. Of the rest,
+a TRACING_SAMPLE_RATE fraction is kept. Kept traces are exported in the
+background in OTLP/JSON: appended to TRACING_EXPORT_PATH (one
+ExportTraceServiceRequest per line) and/or POSTed to an OTLP/HTTP
+collector at TRACING_OTLP_ENDPOINT (e.g. http://localhost:4318/v1/traces).
+'flask traces' prints the slowest traces of the export file as span trees.
+
+With TRACING_ENABLED off, a span costs a g lookup and nothing is recorded.
+"""
+
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from functools import wraps
+
+import click
+import flask_smorest
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+from flask_smorest.utils import resolve_schema_instance
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+
+from db import db
+from negotiation import NegotiatingJSONProvider
+from validation import Parser
+
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+
+def _new_id(bytes_):
+    return random.getrandbits(bytes_ * 8).to_bytes(bytes_, "big").hex()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, name, parent_id, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.error = False
+        self.start = time.time_ns()
+        self.end = None
+
+    def finish(self):
+        self.end = time.time_ns()
+
+    def to_otlp(self, trace_id):
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end or self.start),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2 if self.error else 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Trace:
+    """Spans of one request, with the currently open span on top of 'stack'."""
+
+    __slots__ = ("trace_id", "sampled", "spans", "stack")
+
+    def __init__(self, trace_id, sampled=False):
+        self.trace_id = trace_id
+        self.sampled = sampled  # the caller asked for this trace to be kept
+        self.spans = []
+        self.stack = []
+
+    def open(self, name, kind=INTERNAL, attributes=None, parent_id=None):
+        span = Span(name, self.stack[-1].span_id if self.stack else parent_id, kind, attributes)
+        self.spans.append(span)
+        self.stack.append(span)
+        return span
+
+    def close(self, span):
+        span.finish()
+        if self.stack and self.stack[-1] is span:
+            self.stack.pop()
+        elif span in self.stack:
+            self.stack.remove(span)
+
+
+class _SpanContext:
+    __slots__ = ("trace", "name", "kind", "attributes", "span")
+
+    def __init__(self, trace, name, kind, attributes):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span = self.trace.open(self.name, self.kind, self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not (isinstance(exc, HTTPException) and exc.code < 500):
+            self.span.error = True
+        self.trace.close(self.span)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current_trace():
+    return g.get("trace") if has_request_context() else None
+
+
+def span(name, kind=INTERNAL, **attributes):
+    """Context manager timing a span of the current request's trace."""
+    trace = current_trace()
+    if trace is None:
+        return _NO_SPAN
+    return _SpanContext(trace, name, kind, attributes)
+
+
+# ------------------------- instrumented flask-smorest ----------------------- #
+
+class TracingParser(Parser):
+    def parse(self, *args, **kwargs):
+        with span("args.parse"):
+            return super().parse(*args, **kwargs)
+
+
+class Blueprint(flask_smorest.Blueprint):
+    """flask_smorest Blueprint whose argument parsing, handlers and response
+    serialization are spans of the request's trace."""
+
+    ARGUMENTS_PARSER = TracingParser()
+
+    def response(self, status_code, schema=None, **kwargs):
+        schema = resolve_schema_instance(schema)
+        if schema is not None:
+            dump = schema.dump
+            label = type(schema).__name__
+
+            @wraps(dump)
+            def traced_dump(obj, *, many=None):
+                with span("serialize", schema=label):
+                    return dump(obj, many=many)
+
+            schema.dump = traced_dump  # this instance only serves this view
+        decorator = super().response(status_code, schema, **kwargs)
+
+        def traced(func):
+            @wraps(func)
+            def handler(*args, **kwargs):
+                with span("handler", endpoint=request.endpoint or ""):
+                    return func(*args, **kwargs)
+
+            return decorator(handler)
+
+        return traced
+
+
+class TracingJSONProvider(NegotiatingJSONProvider):
+    def response(self, *args, **kwargs):
+        with span("encode") as encode:
+            response = super().response(*args, **kwargs)
+            if encode is not None:
+                encode.attributes["media_type"] = response.mimetype
+            return response
+
+
+# --------------------------------- export ---------------------------------- #
+
+class Exporter:
+    """Background thread exporting kept traces in batches."""
+
+    def __init__(self, logger, service, path=None, endpoint=None, queue_size=1000,
+                 batch_size=100):
+        self.logger = logger
+        self.service = service
+        self.path = path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1  # never slow requests down for tracing
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + 1.0
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception:  # the collector being down must not kill the thread
+                self.logger.exception("Trace export failed.")
+
+    def payload(self, traces):
+        """OTLP/JSON ExportTraceServiceRequest for a list of traces."""
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", self.service)]},
+            "scopeSpans": [{
+                "scope": {"name": "tracing.py"},
+                "spans": [span.to_otlp(trace.trace_id) for trace in traces for span in trace.spans],
+            }],
+        }]}
+
+    def export(self, traces):
+        body = json.dumps(self.payload(traces), separators=(",", ":"))
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(body + "\n")
+        if self.endpoint:
+            urllib.request.urlopen(urllib.request.Request(
+                self.endpoint, data=body.encode(), method="POST",
+                headers={"Content-Type": "application/json"},
+            ), timeout=5).close()
+
+
+class Tracer:
+    """Flask extension recording request traces with tail sampling."""
+
+    def __init__(self, app=None):
+        self.exporter = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("TRACING_ENABLED", False)
+        app.config.setdefault("TRACING_SERVICE_NAME", app.config.get("API_TITLE", app.name))
+        app.config.setdefault("TRACING_SLOW_MS", 500)
+        app.config.setdefault("TRACING_SAMPLE_RATE", 0.01)
+        app.config.setdefault("TRACING_EXPORT_PATH", os.path.join(app.instance_path, "traces.jsonl"))
+        app.config.setdefault("TRACING_OTLP_ENDPOINT", None)
+        app.config.setdefault("TRACING_SQL_MAX_LENGTH", 500)
+
+        self.enabled = app.config["TRACING_ENABLED"]
+        app.extensions["tracing"] = self
+        if not self.enabled:
+            return
+
+        self.slow_ns = app.config["TRACING_SLOW_MS"] * 1_000_000
+        self.sample_rate = app.config["TRACING_SAMPLE_RATE"]
+        self.sql_max_length = app.config["TRACING_SQL_MAX_LENGTH"]
+        path = app.config["TRACING_EXPORT_PATH"]
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.exporter = Exporter(app.logger, app.config["TRACING_SERVICE_NAME"], path,
+                                 app.config["TRACING_OTLP_ENDPOINT"])
+
+        app.json = TracingJSONProvider(app)
+        app.before_request_funcs.setdefault(None, []).insert(0, self.start)
+        app.after_request_funcs.setdefault(None, []).insert(0, self.stop)
+        app.teardown_request(self.finish)
+
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            _listen_sql(engine, self.sql_max_length)
+
+    # ------------------------------ hooks ----------------------------------- #
+
+    def start(self):
+        match = TRACEPARENT.match(request.headers.get("traceparent", ""))
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            trace = Trace(trace_id, sampled=bool(int(flags, 16) & 1))
+        else:
+            trace_id, parent_id = _new_id(16), None
+            trace = Trace(trace_id)
+        g.trace = trace
+        trace.open(f"{request.method} {request.path}", SERVER, {
+            "http.method": request.method,
+            "http.target": request.full_path.rstrip("?"),
+        }, parent_id=parent_id)
+
+    def stop(self, response):
+        trace = g.get("trace")
+        if trace is None:
+            return response
+        root = trace.spans[0]
+        root.attributes["http.status_code"] = response.status_code
+        root.attributes["http.route"] = request.endpoint or ""
+        root.error = response.status_code >= 500
+        response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+
+    def finish(self, error=None):
+        trace = g.pop("trace", None)
+        if trace is None:
+            return
+        root = trace.spans[0]
+        if error is not None:
+            root.error = True
+        for open_span in reversed(trace.stack):
+            open_span.finish()
+        if self.keep(trace):
+            self.exporter.submit(trace)
+
+    def keep(self, trace):
+        """Tail sampling: decided once the request is over."""
+        root = trace.spans[0]
+        return (
+            trace.sampled
+            or root.error
+            or root.end - root.start >= self.slow_ns
+            or random.random() < self.sample_rate
+        )
+
+
+def _listen_sql(engine, max_length):
+    engine_name = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace()
+        if trace is not None:
+            context._trace_span = trace.open("sql", CLIENT, {
+                "db.system": engine_name,
+                "db.statement": statement[:max_length],
+            })
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        sql_span = getattr(context, "_trace_span", None)
+        trace = current_trace()
+        if sql_span is not None and trace is not None:
+            trace.close(sql_span)
+
+    @event.listens_for(engine, "handle_error")
+    def failed(exception_context):
+        context = exception_context.execution_context
+        sql_span = getattr(context, "_trace_span", None)
+        trace = current_trace()
+        if sql_span is not None and trace is not None:
+            sql_span.error = True
+            trace.close(sql_span)
+
+
+# ------------------------------- flask traces ------------------------------- #
+
+def read_traces(path):
+    """Traces in an export file: {trace id: [OTLP span, ...]}."""
+    traces = {}
+    with open(path) as f:
+        for line in f:
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    for otlp_span in scope["spans"]:
+                        traces.setdefault(otlp_span["traceId"], []).append(otlp_span)
+    return traces
+
+
+def _duration_ms(otlp_span):
+    return (int(otlp_span["endTimeUnixNano"]) - int(otlp_span["startTimeUnixNano"])) / 1e6
+
+
+@click.command("traces")
+@click.option("--slowest", type=int, default=5, show_default=True,
+              help="Number of traces to show, slowest first.")
+@click.option("--trace-id", help="Show only this trace.")
+@with_appcontext
+def traces_command(slowest, trace_id):
+    """Print the slowest exported traces as span trees."""
+    path = current_app.config["TRACING_EXPORT_PATH"]
+    if not path or not os.path.exists(path):
+        raise click.ClickException("No trace export file (TRACING_EXPORT_PATH).")
+    traces = read_traces(path)
+    if trace_id:
+        traces = {trace_id: traces.get(trace_id, [])}
+
+    def root_of(spans):
+        ids = {s["spanId"] for s in spans}
+        return next(s for s in spans if s.get("parentSpanId") not in ids)
+
+    chosen = sorted((spans for spans in traces.values() if spans),
+                    key=lambda spans: _duration_ms(root_of(spans)), reverse=True)[:slowest]
+    for spans in chosen:
+        children = {}
+        for s in spans:
+            children.setdefault(s.get("parentSpanId"), []).append(s)
+        root = root_of(spans)
+        click.echo(f"\ntrace {root['traceId']}")
+
+        def show(s, depth):
+            attributes = {a["key"]: next(iter(a["value"].values())) for a in s["attributes"]}
+            detail = (attributes.get("db.statement") or attributes.get("schema")
+                      or attributes.get("media_type") or "")
+            detail = " ".join(detail.split())[:60]
+            flag = " ERROR" if s["status"]["code"] == 2 else ""
+            click.echo(f"{_duration_ms(s):9.2f} ms  {'  ' * depth}{s['name']}  {detail}{flag}")
+            for child in sorted(children.get(s["spanId"], []), key=lambda c: int(c["startTimeUnixNano"])):
+                show(child, depth + 1)
+
+        show(root, 0)
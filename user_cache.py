@@ -0,0 +1,100 @@
+"""
+user_cache.py
+
+Current-user lookup for flask_jwt_extended's 'user_lookup_loader'.
+
+Handlers get the caller with 'flask_jwt_extended.current_user' instead of
+re-querying 'users' by get_jwt_identity(). The user is loaded as a small
+CurrentUser tuple (id and username only; the password hash is never
+loaded) and cached per process for USER_CACHE_TTL seconds, so repeated
+authorization checks cost no SQL.
+
+Updating (e.g. a password change) or deleting a user drops it from the
+cache once the transaction commits. Other worker processes see the change
+when their entry expires.
+"""
+
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+
+from db import RoutingSession, db
+from models import UserModel
+from tracing import span
+
+
+CurrentUser = namedtuple("CurrentUser", ["id", "username"])
+
+
+class UserCache:
+    """Bounded TTL cache of CurrentUser by user id."""
+
+    def __init__(self, ttl=60, size=10000):
+        self.ttl = ttl
+        self.size = size
+        self._users = {}  # user_id -> (CurrentUser or None, expires)
+
+    def get(self, user_id):
+        """Return the user, loading it on a miss. None if it doesn't exist.
+
+        'user_id' may be the token's string 'sub'; entries are keyed by the
+        integer id so that invalidate(UserModel.id) finds them.
+        """
+        user_id = int(user_id)
+        now = time.monotonic()
+        hit = self._users.get(user_id)
+        if hit is not None and hit[1] > now:
+            return hit[0]
+
+        row = db.session.execute(
+            select(UserModel.id, UserModel.username).where(UserModel.id == user_id)
+        ).first()
+        user = CurrentUser(*row) if row else None
+
+        if len(self._users) >= self.size:
+            try:
+                del self._users[next(iter(self._users))]
+            except (KeyError, RuntimeError, StopIteration):
+                pass
+        self._users[user_id] = (user, now + self.ttl)
+        return user
+
+    def invalidate(self, user_id):
+        self._users.pop(int(user_id), None)
+
+
+def init_user_cache(app):
+    app.config.setdefault("USER_CACHE_TTL", 60)
+    app.config.setdefault("USER_CACHE_SIZE", 10000)
+    app.extensions["user_cache"] = UserCache(app.config["USER_CACHE_TTL"],
+                                             app.config["USER_CACHE_SIZE"])
+
+
+def load_current_user(user_id):
+    with span("jwt.user_lookup"):
+        return current_app.extensions["user_cache"].get(user_id)
+
+
+@event.listens_for(UserModel, "after_update")
+@event.listens_for(UserModel, "after_delete")
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("users_changed", set()).add(int(target.id))
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _invalidate_users(session):
+    changed = session.info.pop("users_changed", None)
+    if changed:
+        cache = current_app.extensions["user_cache"]
+        for user_id in changed:
+            cache.invalidate(user_id)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_users(session):
+    session.info.pop("users_changed", None)
@@ -0,0 +1,284 @@
+"""
+writepath.py
+
+Single-statement writes for the create and update endpoints.
+
+Through the ORM, a create was an INSERT and a commit, then - the instance
+being expired by the commit - a SELECT to reload it when the schema dumped
+it, and one more per relationship; PUT /item/<id> also read the item
+before writing it, and the duplicate checks were queries of their own.
+Here each write is one statement returning the columns the response
+needs, and the response is built from that row (readpath.py records or
+dicts) without reading anything back:
+
+    POST /item                INSERT ... SELECT ... WHERE NOT EXISTS
+                              (same item in the store) AND EXISTS
+                              (the store) RETURNING
+    PUT  /item/<id>           UPDATE ... RETURNING; for a new id,
+                              INSERT ... ON CONFLICT (id) DO UPDATE RETURNING
+    POST /store               INSERT ... ON CONFLICT (name) DO NOTHING RETURNING
+    POST /store/<id>/tag      INSERT ... SELECT ... WHERE NOT EXISTS
+                              (same name in the store) AND EXISTS
+                              (the store) RETURNING
+    POST /item/<id>/tag/<id>  INSERT ... SELECT ... WHERE NOT EXISTS
+                              (same link) AND EXISTS (the tag) RETURNING
+    DELETE /item/<id>/tag/<id>
+                              DELETE ... WHERE (item is live) RETURNING
+    DELETE /item/<id>         UPDATE ... SET deleted_at RETURNING
+
+Only live items count: a soft-deleted item (deleted_at set, see
+archive.py) is not a duplicate, can't be updated, tagged or untagged, and
+a PUT to its id creates it again through the upsert.
+
+A duplicate, or a store or tag that is gone, is a statement returning no
+row: the catalogue snapshot (snapshot.py) may not have seen another
+worker's delete yet, so the statement decides, not the snapshot. Core
+statements skip the
+ORM's flush hooks, so each write logs its change with changefeed.record()
+in the same transaction (as groupcommit.py does), and takes item and tag
+ids from the shard sequence itself when sharded (sharding.next_id).
+
+RETURNING needs SQLite 3.35+ or Postgres; ON CONFLICT comes from the
+dialect's insert(). Nothing here commits: the callers do.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import delete, exists, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from changefeed import change, record
+from db import db
+from models import ItemModel, ItemTags, StoreModel, TagModel
+from models.item import to_cents
+from readpath import ITEM_COLUMNS, PLAIN_ITEM_COLUMNS, ItemRow, PlainItemRow, attach, item_row
+from sharding import next_id
+
+
+items = ItemModel.__table__
+stores = StoreModel.__table__
+tags = TagModel.__table__
+links = ItemTags.__table__
+
+live = items.c.deleted_at.is_(None)
+
+# PUT /item fields, and the column each one sets.
+ITEM_FIELDS = {"name": "name", "price": "price_cents", "description": "description"}
+
+
+def _upsert(table):
+    """insert() with on_conflict_do_*() for the request's database."""
+    dialect = db.session.get_bind().dialect.name
+    return (postgresql if dialect == "postgresql" else sqlite).insert(table)
+
+
+def _insert_unless(table, values, duplicate, parent, returning=None):
+    """INSERT ... SELECT 'values' WHERE NOT EXISTS ('duplicate') AND EXISTS
+    ('parent') RETURNING 'returning' (default: every column)."""
+    row = select(*(literal(value, table.c[column].type) for column, value in values.items()))
+    return (
+        insert(table)
+        .from_select(list(values), row.where(~exists(duplicate), exists(parent)))
+        .returning(*(returning or table.c))
+    )
+
+
+def _item_values(data):
+    values = {ITEM_FIELDS[field]: value for field, value in data.items() if field in ITEM_FIELDS}
+    if "price_cents" in values:
+        values["price_cents"] = to_cents(values["price_cents"])
+    return values
+
+
+def _logged_item(row, op):
+    """ItemRow of a returned row of ITEM_COLUMNS, its change logged."""
+    data = dict(row._mapping)
+    data["price"] = data.pop("price_cents") / 100
+    record(db.session, [change("item", row.id, op, row.store_id, data)])
+    return ItemRow(*row)
+
+
+def create_item(data):
+    """Insert an item unless its store has one with the same name and
+    description. Returns its ItemRow, or None for a duplicate or a store
+    that doesn't exist (snapshot.missing_store tells them apart)."""
+    values = {
+        "name": data["name"],
+        "price_cents": to_cents(data["price"]),
+        "description": data.get("description"),
+        "store_id": data["store_id"],
+    }
+    ident = next_id(items)
+    if ident is not None:
+        values = {"id": ident, **values}
+    row = db.session.execute(_insert_unless(items, values, select(items.c.id).where(
+        items.c.store_id == values["store_id"],
+        items.c.name == values["name"],
+        items.c.description.is_not_distinct_from(values["description"]),
+        live,
+    ), select(stores.c.id).where(stores.c.id == values["store_id"]), ITEM_COLUMNS)).first()
+    if row is None:
+        return None
+    return _logged_item(row, "create")  # no tags yet; the caller has the store
+
+
+def update_item(item_id, data):
+    """Update an existing item's name, price and description.
+
+    Returns its ItemRow with its tags, or None if there is no such live
+    item (on the shard the request is routed to).
+    """
+    if not str(item_id).isdigit():
+        return None
+    values = _item_values(data)
+    if not values:
+        return item_row(item_id)
+    row = db.session.execute(
+        update(items).where(items.c.id == int(item_id), live)
+        .values(values).returning(*ITEM_COLUMNS)
+    ).first()
+    if row is None:
+        return None
+    item = _logged_item(row, "update")
+    attach([item])
+    return item
+
+
+def upsert_item(item_id, data):
+    """Create item 'item_id' from a PUT. If a concurrent PUT created it
+    first, or it was soft-deleted, the fields given update it instead (and
+    undelete it). Returns its ItemRow."""
+    values = {
+        "id": int(item_id),
+        "name": data["name"],
+        "price_cents": to_cents(data["price"]),
+        "description": data.get("description"),
+        "store_id": data["store_id"],
+    }
+    stmt = _upsert(items).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[items.c.id],
+        # set_ skips the columns' onupdate, so 'updated_at' is set here.
+        set_={**{column: stmt.excluded[column] for column in _item_values(data)},
+              "updated_at": datetime.utcnow(), "deleted_at": None},
+    ).returning(*ITEM_COLUMNS)
+    item = _logged_item(db.session.execute(stmt).one(), "create")
+    attach([item])
+    return item
+
+
+def delete_item(item_id):
+    """Soft-delete a live item: set its 'deleted_at'.
+
+    Returns its id, or None if there is no such live item (on the shard
+    the request is routed to).
+    """
+    if not str(item_id).isdigit():
+        return None
+    row = db.session.execute(
+        update(items).where(items.c.id == int(item_id), live)
+        .values(deleted_at=datetime.utcnow()).returning(items.c.id, items.c.store_id)
+    ).first()
+    if row is None:
+        return None
+    record(db.session, [change("item", row.id, "delete", row.store_id)])
+    return row.id
+
+
+def create_store(name, store_id=None):
+    """Insert a store unless the name is taken. Returns it as a dict for
+    StoreSchema, or None for a duplicate.
+
+    :param store_id: Id from the shard map (sharding.place_store).
+    """
+    values = {"name": name} if store_id is None else {"id": store_id, "name": name}
+    stmt = _upsert(stores).values(values)
+    row = db.session.execute(
+        stmt.on_conflict_do_nothing(index_elements=[stores.c.name]).returning(*stores.c)
+    ).first()
+    if row is None:
+        return None
+    record(db.session, [change("store", row.id, "create", row.id, dict(row._mapping))])
+    return {"id": row.id, "name": row.name, "items": [], "tags": []}
+
+
+def create_tag(store, name):
+    """Insert a tag unless the store has one with that name. Returns it as
+    a dict for TagSchema, or None for a duplicate or a store that doesn't
+    exist (snapshot.missing_store tells them apart).
+
+    :param store: The store as {"id", "name"}.
+    """
+    values = {"name": name, "store_id": store["id"]}
+    ident = next_id(tags)
+    if ident is not None:
+        values = {"id": ident, **values}
+    row = db.session.execute(_insert_unless(tags, values, select(tags.c.id).where(
+        tags.c.store_id == store["id"], tags.c.name == name,
+    ), select(stores.c.id).where(stores.c.id == store["id"]))).first()
+    if row is None:
+        return None
+    record(db.session, [change("tag", row.id, "create", row.store_id, dict(row._mapping))])
+    return {"id": row.id, "name": row.name, "store": store, "items": []}
+
+
+def link_tag(item_id, tag):
+    """Link an item to a tag, unless it already is.
+
+    Returns the tag as a dict for TagSchema, with all its items, or None if
+    there is no such item or tag (on the shard the request is routed to).
+
+    :param tag: The tag as {"id", "name", "store"}.
+    """
+    if not str(item_id).isdigit():
+        return None
+    item_id = int(item_id)
+    linked = select(links.c.id).where(links.c.item_id == item_id,
+                                      links.c.tag_id == tag["id"])
+    found = select(tags.c.id).where(tags.c.id == tag["id"])
+    row = db.session.execute(
+        insert(links)
+        .from_select(["item_id", "tag_id"],
+                     select(items.c.id, literal(tag["id"], links.c.tag_id.type))
+                     .where(items.c.id == item_id, live, ~exists(linked), exists(found)))
+        .returning(links.c.item_id)
+    ).first()
+    if row is not None:
+        store_id = tag["store"]["id"]  # an item is linked to tags of its store
+        record(db.session, [change("item_tag", item_id, "create", store_id,
+                                   {"item_id": item_id, "tag_id": tag["id"]})])
+    else:
+        item_found, tag_found = db.session.execute(
+            select(exists().where(items.c.id == item_id, live), exists(found))
+        ).one()
+        if not (item_found and tag_found):
+            return None
+    tagged = db.session.execute(
+        select(*PLAIN_ITEM_COLUMNS).join(links, links.c.item_id == items.c.id)
+        .where(links.c.tag_id == tag["id"], live).order_by(items.c.id)
+    )
+    return {**tag, "items": [PlainItemRow(*item) for item in tagged]}
+
+
+def unlink_tag(item_id, tag_id):
+    """Unlink an item from a tag.
+
+    Returns the item's ItemRow with its remaining tags, or None if there is
+    no such live item (on the shard the request is routed to) or it isn't
+    linked to the tag.
+    """
+    if not str(item_id).isdigit() or not str(tag_id).isdigit():
+        return None
+    item_id, tag_id = int(item_id), int(tag_id)
+    row = db.session.execute(
+        delete(links)
+        .where(links.c.item_id == item_id, links.c.tag_id == tag_id,
+               links.c.item_id.in_(select(items.c.id).where(items.c.id == item_id, live)))
+        .returning(links.c.item_id)
+    ).first()
+    if row is None:
+        return None
+    item = item_row(item_id)
+    record(db.session, [change("item_tag", item_id, "delete", item.store_id,
+                               {"item_id": item_id, "tag_id": tag_id})])
+    return item